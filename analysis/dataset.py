@@ -0,0 +1,211 @@
+import argparse
+import hashlib
+import os
+import pathlib
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Union
+
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+from parquet import convert
+
+"""
+# Example: how to use the parquet dataset
+
+python dataset.py  # convert new or changed ../db/*-*/*.csv.gz into ../db/dataset
+
+dataset = load_dataset(pathlib.Path("../db/dataset"))
+battles = dataset.to_table(
+    columns=["('team', 'deck_lo')", "('team', 'deck_hi')"],
+    filter=(ds.field("season") == "20221107-20221205") & (ds.field("day") >= "20221201"),
+)
+"""
+
+# PATHS -------------------------------------------------------------------------------
+
+here = pathlib.Path(__file__).parent
+db = here.parent / "db"
+
+
+# CONSTANTS ---------------------------------------------------------------------------
+
+# Days of season START-END (db/START-END/YYYYMMDD.csv.gz) are written in
+# DATASET/season=START-END/day=YYYYMMDD/PART. DATASET/_metadata gathers the
+# footers of every file: a scan is planned (and filtered on partitions and row
+# groups statistics) by reading that single file.
+PART = "part-0.parquet"
+PARTITIONING = ds.partitioning(
+    pa.schema([("season", pa.string()), ("day", pa.string())]), flavor="hive"
+)
+
+# footer key with the hash of the csv (and layout) a parquet file was made from
+SOURCE_KEY = b"source_sha256"
+
+
+# CONVERSION --------------------------------------------------------------------------
+
+
+def output_path(csv_path: pathlib.Path, dataset_dir: pathlib.Path) -> pathlib.Path:
+    season = csv_path.parent.name
+    day = csv_path.name.split(".")[0]
+    return dataset_dir / f"season={season}" / f"day={day}" / PART
+
+
+def source_hash(csv_path: pathlib.Path, bools: bool) -> bytes:
+    digest = hashlib.sha256(b"bools" if bools else b"masks")
+    with open(csv_path, "rb") as f:
+        while chunk := f.read(1 << 20):
+            digest.update(chunk)
+    return digest.hexdigest().encode()
+
+
+def update(
+    csv_path: pathlib.Path,
+    parquet_path: pathlib.Path,
+    chunksize: int,
+    bools: bool,
+    force: bool = False,
+) -> tuple[str, int]:
+    # Convert csv_path unless parquet_path is up to date: newer than csv_path or
+    # made from the same content (then only its modification time is updated).
+    if parquet_path.exists() and not force:
+        if parquet_path.stat().st_mtime >= csv_path.stat().st_mtime:
+            return "skipped", 0
+        digest = source_hash(csv_path, bools)
+        schema = pq.read_schema(parquet_path)
+        if (schema.metadata or {}).get(SOURCE_KEY) == digest:
+            os.utime(parquet_path)
+            return "unchanged", 0
+    else:
+        digest = source_hash(csv_path, bools)
+    parquet_path.parent.mkdir(parents=True, exist_ok=True)
+    n = convert(csv_path, parquet_path, chunksize, bools, {SOURCE_KEY: digest})
+    return "converted", n
+
+
+def write_metadata(dataset_dir: pathlib.Path) -> int:
+    # Summary files of every parquet file of the dataset: _common_metadata with
+    # the schema and _metadata with the row groups of every file.
+    paths = sorted(dataset_dir.glob(f"season=*/day=*/{PART}"))
+    if not paths:
+        return 0
+    schema = pq.read_schema(paths[0])
+    schema = schema.with_metadata(
+        {k: v for k, v in schema.metadata.items() if k != SOURCE_KEY}
+    )
+    collector = []
+    for path in paths:
+        metadata = pq.read_metadata(path)
+        metadata.set_file_path(path.relative_to(dataset_dir).as_posix())
+        collector.append(metadata)
+    pq.write_metadata(schema, dataset_dir / "_common_metadata")
+    tmp_path = dataset_dir / "._metadata.tmp"
+    pq.write_metadata(schema, tmp_path, metadata_collector=collector)
+    tmp_path.replace(dataset_dir / "_metadata")
+    return len(paths)
+
+
+def load_dataset(dataset_dir: pathlib.Path) -> ds.Dataset:
+    # Dataset from _metadata: no footer of single files is read until scanned
+    return ds.parquet_dataset(dataset_dir / "_metadata", partitioning=PARTITIONING)
+
+
+def batch(
+    paths: list[pathlib.Path],
+    dataset_dir: pathlib.Path,
+    chunksize: int = 500_000,
+    bools: bool = True,
+    force: bool = False,
+    workers: Union[int, None] = None,
+) -> dict[str, int]:
+    # Update the parquet files of every csv with a pool of processes (modules and
+    # cards.json are loaded once per worker), then the summary files.
+    counters = {"converted": 0, "unchanged": 0, "skipped": 0, "battles": 0}
+    with ProcessPoolExecutor(workers) as executor:
+        futures = {
+            executor.submit(
+                update,
+                path,
+                output_path(path, dataset_dir),
+                chunksize,
+                bools,
+                force,
+            ): path
+            for path in paths
+        }
+        for i, future in enumerate(as_completed(futures)):
+            status, n = future.result()
+            counters[status] += 1
+            counters["battles"] += n
+            print(f"{status} '{futures[future]}' ({n} battles) [{i + 1}/{len(paths)}]")
+    if counters["converted"] or not (dataset_dir / "_metadata").exists():
+        write_metadata(dataset_dir)
+    return counters
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert csv battles of every season into a parquet dataset.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "inputs",
+        type=pathlib.Path,
+        nargs="*",
+        help="csv files of seasons (default: every db/START-END/*.csv.gz)",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        default=db / "dataset",
+        help="Dataset directory (season=START-END/day=YYYYMMDD partitions).",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=None, help="Processes (default: cpus)."
+    )
+    parser.add_argument(
+        "-c",
+        "--chunksize",
+        type=int,
+        default=500_000,
+        help="Battles converted at once (a parquet row group).",
+    )
+    parser.add_argument(
+        "--masks-only",
+        action="store_true",
+        help="Store decks only as 128-bit masks (deck_lo, deck_hi), no bool columns.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Convert every input, even if its output is up to date.",
+    )
+    args = parser.parse_args()
+
+    inputs = args.inputs or sorted(db.glob("*-*/*.csv.gz"))
+    start = time.perf_counter()
+    counters = batch(
+        inputs,
+        args.output,
+        args.chunksize,
+        not args.masks_only,
+        args.force,
+        args.jobs,
+    )
+    elapsed = time.perf_counter() - start
+    print(
+        f"{counters['converted']} converted ({counters['battles']} battles), "
+        f"{counters['unchanged']} unchanged, {counters['skipped']} skipped "
+        f"in {elapsed:.1f} s"
+    )
+
+
+if __name__ == "__main__":
+    main()
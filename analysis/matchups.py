@@ -0,0 +1,318 @@
+import argparse
+import pathlib
+from collections import namedtuple
+from typing import Iterator, Union
+
+import numpy as np
+import pyarrow.parquet as pq
+from parquet import DECK_OPPONENT, DECK_TEAM, encode_cards, encode_decks, read_csv
+
+"""
+# Example: how to use matchups
+
+python matchups.py ../db/dataset/season=20221107-20221205/day=*/part-0.parquet
+
+m = load_matchups(pathlib.Path("../db/matchups"), "20221201", "20221207", top=100)
+m.cards[hog, fireball]  # battles won by decks with hog rider against fireball
+m.cards / (m.cards + m.cards.T)  # card vs card win rate
+m.wins[0, 1]  # battles won by the most played deck against the second one
+mask_cards(m.decks["lo"], m.decks["hi"])  # card indices of the top decks
+"""
+
+# PATHS -------------------------------------------------------------------------------
+
+here = pathlib.Path(__file__).parent
+db = here.parent / "db"
+
+
+# CONSTANTS ---------------------------------------------------------------------------
+
+CARDS = 128
+NO_CARD = CARDS  # index of unknown cards (an extra row/column, then dropped)
+
+# decks are identified by their 128-bit mask (see parquet.py)
+DECK = np.dtype([("lo", "<u8"), ("hi", "<u8")])
+DECK_TOTALS = np.dtype(
+    [("lo", "<u8"), ("hi", "<u8"), ("wins", "<i8"), ("games", "<i8")]
+)
+
+COLUMNS = [
+    f"('{side}', '{column}')"
+    for side in ("team", "opponent")
+    for column in ("crowns", "deck_lo", "deck_hi")
+]
+
+# Matchups of some days: cards[a, b] battles won by decks with card a against
+# decks with card b; decks the top decks by games (with wins and games) and
+# wins[i, j] the battles won by decks[i] against decks[j].
+Matchups = namedtuple("Matchups", ["cards", "decks", "wins"])
+
+# Battles of a chunk: decks (DECK) and card indices (N x 8 int16, NO_CARD if
+# missing) of winners and losers (draws are skipped). Card indices are None when
+# only decks are needed.
+Battles = namedtuple("Battles", ["winners", "losers", "winner_cards", "loser_cards"])
+
+# decks (or battles) of mask_cards and card_wins processed at once: bounds
+# temporaries (N x 128 bits, N x 64 pairs) whatever the chunksize
+BLOCK = 1 << 16
+
+
+# READ BATTLES ------------------------------------------------------------------------
+
+
+def to_decks(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    decks = np.empty(len(lo), dtype=DECK)
+    decks["lo"], decks["hi"] = lo, hi
+    return decks
+
+
+def mask_cards(lo: np.ndarray, hi: np.ndarray) -> np.ndarray:
+    # Card indices of decks (N x 8) from masks: set bits of the bytes of masks,
+    # in card order (nonzero is row major), BLOCK decks at once
+    indices = np.full((len(lo), 8), NO_CARD, dtype=np.int16)
+    for start in range(0, len(lo), BLOCK):
+        masks = np.stack([lo[start : start + BLOCK], hi[start : start + BLOCK]], 1)
+        bits = np.unpackbits(masks.astype("<u8").view(np.uint8), 1, bitorder="little")
+        rows, cards = np.nonzero(bits)
+        counts = np.bincount(rows, minlength=len(masks))
+        slots = np.arange(len(rows)) - np.repeat(np.cumsum(counts) - counts, counts)
+        keep = slots < 8
+        indices[start + rows[keep], slots[keep]] = cards[keep]
+    return indices
+
+
+def battles_of(
+    crowns: tuple, lo: tuple, hi: tuple, cards: Union[tuple, None] = None
+) -> Battles:
+    # crowns, lo, hi (and card indices) of team and opponent -> battles by
+    # winner and loser
+    team_wins = crowns[0] > crowns[1]
+    keep = crowns[0] != crowns[1]
+    sides = [to_decks(lo[i][keep], hi[i][keep]) for i in (0, 1)]
+    winners = np.where(team_wins[keep], sides[0], sides[1])
+    losers = np.where(team_wins[keep], sides[1], sides[0])
+    if cards is None:
+        return Battles(winners, losers, None, None)
+    team_wins = team_wins[keep, None]
+    team, opponent = cards[0][keep], cards[1][keep]
+    return Battles(
+        winners,
+        losers,
+        np.where(team_wins, team, opponent),
+        np.where(team_wins, opponent, team),
+    )
+
+
+def read_battles(
+    path: pathlib.Path, chunksize: int = 500_000, cards: bool = True
+) -> Iterator[Battles]:
+    # Stream battles of a csv (collect.py) or parquet file (parquet.py) in
+    # chunks, with card indices of decks if cards
+    if path.suffix == ".parquet":
+        for batch in pq.ParquetFile(path).iter_batches(chunksize, columns=COLUMNS):
+            c = [batch.column(i).to_numpy() for i in range(len(COLUMNS))]
+            indices = None
+            if cards:
+                indices = (mask_cards(c[1], c[2]), mask_cards(c[4], c[5]))
+            yield battles_of((c[0], c[3]), (c[1], c[4]), (c[2], c[5]), indices)
+        return
+    for chunk in read_csv(path, chunksize):
+        crowns = (chunk[4].values, chunk[15].values)
+        indices = [encode_cards(chunk[DECK_TEAM].values)]
+        indices.append(encode_cards(chunk[DECK_OPPONENT].values))
+        masks = [encode_decks(i) for i in indices]
+        if cards:
+            indices = [np.where(i < 0, NO_CARD, i).astype(np.int16) for i in indices]
+        yield battles_of(crowns, *zip(*masks), tuple(indices) if cards else None)
+
+
+# ACCUMULATE --------------------------------------------------------------------------
+
+
+def card_wins(battles: Battles) -> np.ndarray:
+    # Every card of the winner against every card of the loser (64 pairs per
+    # battle) counted with bincount on packed indices, BLOCK battles at once
+    side = NO_CARD + 1
+    counts = np.zeros(side * side, dtype=np.int64)
+    for start in range(0, len(battles.winners), BLOCK):
+        w = battles.winner_cards[start : start + BLOCK].astype(np.int32)
+        l = battles.loser_cards[start : start + BLOCK].astype(np.int32)
+        pairs = w[:, :, None] * side + l[:, None, :]
+        counts += np.bincount(pairs.ravel(), minlength=side * side)
+    return counts.reshape(side, side)[:CARDS, :CARDS]
+
+
+def deck_totals(battles: Battles) -> np.ndarray:
+    # wins and games of every deck of battles
+    decks = np.concatenate([battles.winners, battles.losers])
+    uniques, inverse = np.unique(decks, return_inverse=True)
+    totals = np.zeros(len(uniques), dtype=DECK_TOTALS)
+    totals["lo"], totals["hi"] = uniques["lo"], uniques["hi"]
+    totals["wins"] = np.bincount(
+        inverse[: len(battles.winners)], minlength=len(uniques)
+    )
+    totals["games"] = np.bincount(inverse, minlength=len(uniques))
+    return totals
+
+
+def combine_totals(totals: list[np.ndarray]) -> np.ndarray:
+    # sum wins and games of the same decks
+    totals = np.concatenate(totals)
+    uniques, inverse = np.unique(totals[["lo", "hi"]].astype(DECK), return_inverse=True)
+    combined = np.zeros(len(uniques), dtype=DECK_TOTALS)
+    combined["lo"], combined["hi"] = uniques["lo"], uniques["hi"]
+    for field in ("wins", "games"):
+        combined[field] = np.bincount(
+            inverse, weights=totals[field], minlength=len(uniques)
+        )
+    return combined
+
+
+def top_decks(totals: np.ndarray, top: int) -> np.ndarray:
+    # most played decks (ties broken by deck) sorted by games
+    order = np.lexsort((totals["hi"], totals["lo"], -totals["games"]))
+    return totals[order[:top]]
+
+
+def deck_index(decks: np.ndarray, top: np.ndarray) -> np.ndarray:
+    # index of every deck in top (-1 if not in top)
+    if not len(top):
+        return np.full(len(decks), -1)
+    keys = top[["lo", "hi"]].astype(DECK)
+    order = np.argsort(keys)
+    pos = np.minimum(np.searchsorted(keys[order], decks), len(top) - 1)
+    found = keys[order][pos] == decks
+    return np.where(found, order[pos], -1)
+
+
+def pair_wins(
+    winners: np.ndarray, losers: np.ndarray, top: np.ndarray, counts=None
+) -> np.ndarray:
+    # top x top matrix of wins (bincount of packed winner * top + loser)
+    w, l = deck_index(winners, top), deck_index(losers, top)
+    keep = (w >= 0) & (l >= 0)
+    if counts is not None:
+        counts = counts[keep]
+    wins = np.bincount(
+        w[keep] * len(top) + l[keep], weights=counts, minlength=len(top) ** 2
+    )
+    return wins.astype(np.int64).reshape(len(top), len(top))
+
+
+def day_matchups(path: pathlib.Path, top: int = 2000, chunksize: int = 500_000):
+    # Matchups of a battles file in two streaming passes (memory is bounded by
+    # chunksize, unique decks and top): cards and decks totals, then wins
+    # between the top decks of the day.
+    cards = np.zeros((CARDS, CARDS), dtype=np.int64)
+    totals = np.zeros(0, dtype=DECK_TOTALS)
+    for battles in read_battles(path, chunksize):
+        cards += card_wins(battles)
+        totals = combine_totals([totals, deck_totals(battles)])
+    decks = top_decks(totals, top)
+    wins = np.zeros((len(decks), len(decks)), dtype=np.int64)
+    for battles in read_battles(path, chunksize, cards=False):
+        wins += pair_wins(battles.winners, battles.losers, decks)
+    return Matchups(cards, decks, wins)
+
+
+# SAVE AND LOAD -----------------------------------------------------------------------
+
+
+def day_of(path: pathlib.Path) -> str:
+    # YYYYMMDD of a day file (YYYYMMDD.csv.gz, YYYYMMDD.parquet or day=YYYYMMDD/...)
+    if path.parent.name.startswith("day="):
+        return path.parent.name[len("day=") :]
+    return path.name[:8]
+
+
+def save_matchups(path: pathlib.Path, matchups: Matchups) -> None:
+    # deck vs deck wins are stored as sparse (winner, loser, wins) triplets
+    w, l = np.nonzero(matchups.wins)
+    tmp_path = path.with_name(f".{path.name}.tmp.npz")
+    np.savez_compressed(
+        tmp_path,
+        cards=matchups.cards,
+        decks=matchups.decks,
+        winners=w,
+        losers=l,
+        wins=matchups.wins[w, l],
+    )
+    tmp_path.replace(path)
+
+
+def load_matchups(
+    matchups_dir: pathlib.Path,
+    start: str = "",
+    end: Union[str, None] = None,
+    top: int = 100,
+) -> Matchups:
+    # Sum matchups of days from start to end (YYYYMMDD, included): cards are
+    # summed, top decks of the range are the most played of the summed top decks
+    # of every day (so top must be smaller than the top of days).
+    paths = [
+        path
+        for path in sorted(matchups_dir.glob("????????.npz"))
+        if start <= path.stem and (end is None or path.stem <= end)
+    ]
+    cards = np.zeros((CARDS, CARDS), dtype=np.int64)
+    days = []
+    for path in paths:
+        with np.load(path) as day:
+            cards += day["cards"]
+            days.append({key: day[key] for key in day.files if key != "cards"})
+    totals = combine_totals(
+        [day["decks"] for day in days] or [np.zeros(0, DECK_TOTALS)]
+    )
+    decks = top_decks(totals, top)
+    wins = np.zeros((len(decks), len(decks)), dtype=np.int64)
+    for day in days:
+        day_decks = day["decks"][["lo", "hi"]].astype(DECK)
+        wins += pair_wins(
+            day_decks[day["winners"]], day_decks[day["losers"]], decks, day["wins"]
+        )
+    return Matchups(cards, decks, wins)
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Compute card vs card and deck vs deck matchups of every day.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "inputs", type=pathlib.Path, nargs="+", help="Days (.csv.gz or .parquet)"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        default=db / "matchups",
+        help="Directory of matchups of days (YYYYMMDD.npz).",
+    )
+    parser.add_argument(
+        "-t", "--top", type=int, default=2000, help="Top decks of every day."
+    )
+    parser.add_argument(
+        "-c", "--chunksize", type=int, default=500_000, help="Battles read at once."
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Compute again existing days."
+    )
+    args = parser.parse_args()
+
+    args.output.mkdir(parents=True, exist_ok=True)
+    for path in args.inputs:
+        output = args.output / f"{day_of(path)}.npz"
+        if output.exists() and not args.force:
+            print(f"skipped '{path}' ('{output}' exists)")
+            continue
+        matchups = day_matchups(path, args.top, args.chunksize)
+        save_matchups(output, matchups)
+        battles = matchups.wins.sum()
+        print(f"created '{output}' ({battles} battles between top decks)")
+
+
+if __name__ == "__main__":
+    main()
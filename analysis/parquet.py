@@ -1,9 +1,24 @@
 import argparse
 import json
 import pathlib
+from typing import Iterator, Union
 
 import numpy as np
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+"""
+# Example: how to read decks stored as masks
+
+battles = pd.read_parquet(
+    "../db/20221107-20221205/20221107.parquet",
+    columns=["('team', 'deck_lo')", "('team', 'deck_hi')"],
+)
+team = battles["('team', 'deck_lo')"], battles["('team', 'deck_hi')"]
+decks = expand_decks(*team)
+decks.shape  # (battles, 128) bool: decks[i, card] is True if card is in deck i
+"""
 
 # PATHS -------------------------------------------------------------------------------
 
@@ -11,53 +26,6 @@ here = pathlib.Path(__file__).parent
 db = here.parent / "db"
 assets = here / "assets"
 
-# ARGPARSE ----------------------------------------------------------------------------
-
-parser = argparse.ArgumentParser(
-    description="Convert csv battles file into parquet.",
-)
-parser.add_argument(
-    "-i",
-    "--input",
-    action="store",
-    type=pathlib.Path,
-    required=True,
-    help="Input file: csv or csv.gz.",
-)
-parser.add_argument(
-    "-o",
-    "--output",
-    action="store",
-    type=pathlib.Path,
-    help="Output path for .parquet.",
-)
-parser.add_argument(
-    "-f",
-    "--force",
-    action="store_true",
-    help="Overwrite output file.",
-)
-
-args = parser.parse_args()
-
-if args.output is None:
-    name: str = args.input.name.split(".")[0]
-    args.output = args.input.with_name(f"{name}.parquet")
-
-# CHECKS ------------------------------------------------------------------------------
-
-args.output.parent.mkdir(parents=True, exist_ok=True)
-
-csv_path: pathlib.Path = args.input
-parquet_path: pathlib.Path = args.output
-
-assert (
-    not parquet_path.exists() or args.force
-), f"{parquet_path} already exists. Use -f for overwrite it."
-assert (
-    parquet_path.suffix == ".parquet"
-), "Output file will be a parquet file. Use .parquet as suffix for output."
-
 
 # CONSTANTS ---------------------------------------------------------------------------
 
@@ -68,66 +36,192 @@ INFO_OPPONENT = [13, 14, 15]
 DECK_OPPONENT = [16, 17, 18, 19, 20, 21, 22, 23]
 
 with open(assets / "cards.json") as f:
-    CARDS_INDEX = {str(card["id"]): i for i, card in enumerate(json.load(f))}
-
+    CARDS_IDS = np.array([card["id"] for card in json.load(f)], dtype=np.int64)
+CARDS_ORDER = CARDS_IDS.argsort()
 
-# READ AND PARSE CSV ------------------------------------------------------------------
-
-converters = {
-    # datetime parsed by parse_date = [0]
+DTYPES = {
+    0: str,  # datetime
     1: np.int32,  # game_mode
     2: str,  # team tag
     3: np.int16,  # team trophies
     4: np.int8,  # team crowns
-    **{i: CARDS_INDEX.get for i in DECK_TEAM},  # team deck
+    **{i: np.int64 for i in DECK_TEAM},  # team deck
     13: str,  # opponent tag
     14: np.int16,  # opponent trophies
     15: np.int8,  # opponent crowns
-    **{i: CARDS_INDEX.get for i in DECK_OPPONENT},  # opponent deck
+    **{i: np.int64 for i in DECK_OPPONENT},  # opponent deck
 }
 
-battles = pd.read_csv(csv_path, header=None, converters=converters, parse_dates=[0])
-
 
 # ENCODE DECKS ------------------------------------------------------------------------
 
-decks_team = np.eye(128, dtype=bool)[battles.iloc[:, DECK_TEAM]]
-decks_team = np.logical_or.reduce(decks_team, axis=1)
-decks_team = pd.DataFrame(decks_team)
 
-decks_opponent = np.eye(128, dtype=bool)[battles.iloc[:, DECK_OPPONENT]]
-decks_opponent = np.logical_or.reduce(decks_opponent, axis=1)
-decks_opponent = pd.DataFrame(decks_opponent)
+def encode_cards(ids: np.ndarray) -> np.ndarray:
+    # Card ids to indices of cards.json with a binary search (-1 if unknown)
+    i = np.searchsorted(CARDS_IDS, ids, sorter=CARDS_ORDER)
+    i = np.minimum(i, len(CARDS_IDS) - 1)
+    return np.where(CARDS_IDS[CARDS_ORDER[i]] == ids, CARDS_ORDER[i], -1)
 
 
-# CREATE NEW DATAFRAME ----------------------------------------------------------------
+def encode_decks(cards: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    # Decks (N x 8 card indices) as 128-bit masks: cards 0-63 in lo, 64-127 in hi
+    lo = np.zeros(len(cards), dtype=np.uint64)
+    hi = np.zeros(len(cards), dtype=np.uint64)
+    for card in cards.T:
+        bit = np.left_shift(np.uint64(1), (card % 64).astype(np.uint64))
+        lo |= np.where((card >= 0) & (card < 64), bit, np.uint64(0))
+        hi |= np.where(card >= 64, bit, np.uint64(0))
+    return lo, hi
 
-battles = pd.concat(
-    [
-        battles.iloc[:, INFO],
-        battles.iloc[:, INFO_TEAM],
-        decks_team,
-        battles.iloc[:, INFO_OPPONENT],
-        decks_opponent,
-    ],
-    axis=1,
-)
 
-columns = [
-    ("info", "datetime"),
-    ("info", "game_mode"),
-    ("team", "tag"),
-    ("team", "trophies"),
-    ("team", "crowns"),
-    *[("team", f"c{i}") for i in np.arange(128)],
-    ("opponent", "tag"),
-    ("opponent", "trophies"),
-    ("opponent", "crowns"),
-    *[("opponent", f"c{i}") for i in np.arange(128)],
-]
+def expand_decks(lo, hi) -> np.ndarray:
+    # 128-bit masks back to a N x 128 bool array (bit i is card i of cards.json)
+    masks = np.stack([np.asarray(lo), np.asarray(hi)], axis=1).astype("<u8")
+    bits = np.unpackbits(masks.view(np.uint8), axis=1, bitorder="little")
+    return bits.view(bool)
 
-battles.columns = pd.MultiIndex.from_tuples(columns)
 
-# SAVE TO PARQUET ---------------------------------------------------------------------
+# READ AND PARSE CSV ------------------------------------------------------------------
+
 
-battles.to_parquet(parquet_path, engine="pyarrow", index=False)
+def read_csv(path: pathlib.Path, chunksize: int) -> Iterator[pd.DataFrame]:
+    # Stream csv in chunks: memory is bounded by chunksize, not by file size
+    try:
+        yield from pd.read_csv(path, header=None, dtype=DTYPES, chunksize=chunksize)
+    except pd.errors.EmptyDataError:
+        return
+
+
+def to_battles(chunk: pd.DataFrame, bools: bool = True) -> pd.DataFrame:
+    datetime = pd.to_datetime(chunk[0], format="%Y%m%dT%H%M%S.%fZ", utc=True)
+    columns = {
+        ("info", "datetime"): datetime.dt.as_unit("us"),
+        ("info", "game_mode"): chunk[1].values,
+    }
+    for side, info, deck in (
+        ("team", INFO_TEAM, DECK_TEAM),
+        ("opponent", INFO_OPPONENT, DECK_OPPONENT),
+    ):
+        columns[side, "tag"] = chunk[info[0]].values
+        columns[side, "trophies"] = chunk[info[1]].values
+        columns[side, "crowns"] = chunk[info[2]].values
+        lo, hi = encode_decks(encode_cards(chunk[deck].values))
+        if bools:
+            # 128 bool columns (one per card) as in the original layout
+            decks = expand_decks(lo, hi)
+            for i in range(128):
+                columns[side, f"c{i}"] = decks[:, i]
+        columns[side, "deck_lo"] = lo
+        columns[side, "deck_hi"] = hi
+    battles = pd.DataFrame(columns)
+    battles.columns = pd.MultiIndex.from_tuples(columns.keys())
+    return battles
+
+
+# CONVERSION --------------------------------------------------------------------------
+
+
+def convert(
+    csv_path: pathlib.Path,
+    parquet_path: pathlib.Path,
+    chunksize: int = 500_000,
+    bools: bool = True,
+    metadata: Union[dict, None] = None,
+) -> int:
+    # Every chunk of csv is a row group of parquet file. Optional metadata are
+    # added to the schema (key-value metadata of the footer).
+    n = 0
+    writer = None
+    tmp_path = parquet_path.with_name(f".{parquet_path.name}.tmp")
+    try:
+        for chunk in read_csv(csv_path, chunksize):
+            table = pa.Table.from_pandas(to_battles(chunk, bools), preserve_index=False)
+            if writer is None:
+                schema = table.schema.with_metadata(
+                    {**table.schema.metadata, **(metadata or {})}
+                )
+                writer = pq.ParquetWriter(tmp_path, schema)
+            writer.write_table(table)
+            n += len(chunk)
+    finally:
+        if writer is not None:
+            writer.close()
+    if writer is None:
+        # empty csv: empty parquet with the usual columns
+        empty = pd.DataFrame([], columns=range(24)).astype(DTYPES)
+        empty = pa.Table.from_pandas(to_battles(empty, bools), preserve_index=False)
+        empty = empty.replace_schema_metadata(
+            {**empty.schema.metadata, **(metadata or {})}
+        )
+        pq.write_table(empty, tmp_path)
+    tmp_path.replace(parquet_path)
+    return n
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert csv battles file into parquet.",
+    )
+    parser.add_argument(
+        "-i",
+        "--input",
+        action="store",
+        type=pathlib.Path,
+        required=True,
+        help="Input file: csv or csv.gz.",
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        action="store",
+        type=pathlib.Path,
+        help="Output path for .parquet.",
+    )
+    parser.add_argument(
+        "-c",
+        "--chunksize",
+        action="store",
+        type=int,
+        default=500_000,
+        help="Battles converted at once (a parquet row group).",
+    )
+    parser.add_argument(
+        "--masks-only",
+        action="store_true",
+        help="Store decks only as 128-bit masks (deck_lo, deck_hi), no bool columns.",
+    )
+    parser.add_argument(
+        "-f",
+        "--force",
+        action="store_true",
+        help="Overwrite output file.",
+    )
+
+    args = parser.parse_args()
+
+    if args.output is None:
+        name: str = args.input.name.split(".")[0]
+        args.output = args.input.with_name(f"{name}.parquet")
+
+    # CHECKS
+
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+
+    csv_path: pathlib.Path = args.input
+    parquet_path: pathlib.Path = args.output
+
+    assert (
+        not parquet_path.exists() or args.force
+    ), f"{parquet_path} already exists. Use -f for overwrite it."
+    assert (
+        parquet_path.suffix == ".parquet"
+    ), "Output file will be a parquet file. Use .parquet as suffix for output."
+
+    convert(csv_path, parquet_path, args.chunksize, bools=not args.masks_only)
+
+
+if __name__ == "__main__":
+    main()
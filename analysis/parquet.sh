@@ -1,8 +1,5 @@
 #!/bin/bash
 
-input_files=$(find ../db/*-*/ -type f -name "*.csv.gz")
-
-for input_file in $input_files; do
-  echo "processing $input_file"
-  python parquet.py -f -i $input_file
-done
+# Convert every csv file of seasons (db/START-END/*.csv.gz) into the parquet
+# dataset db/dataset: files are converted in parallel and only if new or changed.
+python dataset.py "$@"
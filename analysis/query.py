@@ -0,0 +1,233 @@
+import argparse
+import json
+import pathlib
+import time
+from typing import Iterable, Iterator, Sequence, Union
+
+import numpy as np
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
+from dataset import load_dataset
+
+"""
+# Example: how to query battles of the parquet dataset
+
+days = ["20221201", "20221202", "20221203"]
+for batch in battles(days, include=["hog-rider"], exclude=["fireball"]):
+    batch.num_rows  # battles where team or opponent plays hog rider without fireball
+    batch["('team', 'match')"]  # True if the team deck matches
+
+table = pa.Table.from_batches(decks(days, include=["hog-rider"]), schema=DECKS_SCHEMA)
+expand_decks(table["deck_lo"], table["deck_hi"])  # matching decks as 128 bools
+"""
+
+# PATHS -------------------------------------------------------------------------------
+
+here = pathlib.Path(__file__).parent
+db = here.parent / "db"
+assets = here / "assets"
+
+
+# CONSTANTS ---------------------------------------------------------------------------
+
+with open(assets / "cards.json") as f:
+    CARDS_KEYS = {card["key"]: i for i, card in enumerate(json.load(f))}
+
+SIDES = ("team", "opponent")
+GAME_MODE = "('info', 'game_mode')"
+
+# columns read by default: a few scalars and decks as masks (see parquet.py),
+# never the 128 bool columns of every side
+COLUMNS = [
+    "('info', 'datetime')",
+    GAME_MODE,
+    *[
+        f"('{side}', '{column}')"
+        for side in SIDES
+        for column in ("trophies", "crowns", "deck_lo", "deck_hi")
+    ],
+]
+
+DECKS_SCHEMA = pa.schema(
+    [
+        ("day", pa.string()),
+        ("side", pa.string()),
+        ("deck_lo", pa.uint64()),
+        ("deck_hi", pa.uint64()),
+    ]
+)
+
+# a card is a key of cards.json ("hog-rider") or its index
+Card = Union[str, int]
+
+
+# PREDICATES --------------------------------------------------------------------------
+
+
+def card_masks(cards: Iterable[Card]) -> tuple[int, int]:
+    # Cards as a 128-bit mask split in lo (cards 0-63) and hi (64-127) words
+    mask = 0
+    for card in cards:
+        mask |= 1 << (CARDS_KEYS[card] if isinstance(card, str) else int(card))
+    return mask & (2**64 - 1), mask >> 64
+
+
+def match_mask(column: str, include: int, exclude: int) -> Union[pc.Expression, None]:
+    # column & (include | exclude) == include: every included card in the deck
+    # and no excluded card, in a single bitwise AND per word
+    if not include | exclude:
+        return None
+    bits = pa.scalar(include | exclude, pa.uint64())
+    return pc.bit_wise_and(ds.field(column), bits) == pa.scalar(include, pa.uint64())
+
+
+def side_filter(
+    side: str,
+    include: Sequence[Card] = (),
+    exclude: Sequence[Card] = (),
+    trophies: Union[tuple[int, int], None] = None,
+) -> pc.Expression:
+    # Predicate of the deck (and trophies, both included) of side
+    include_lo, include_hi = card_masks(include)
+    exclude_lo, exclude_hi = card_masks(exclude)
+    predicates = [
+        match_mask(f"('{side}', 'deck_lo')", include_lo, exclude_lo),
+        match_mask(f"('{side}', 'deck_hi')", include_hi, exclude_hi),
+    ]
+    if trophies is not None:
+        field = ds.field(f"('{side}', 'trophies')")
+        predicates += [field >= trophies[0], field <= trophies[1]]
+    expression = pc.scalar(True)
+    for predicate in predicates:
+        if predicate is not None:
+            expression = expression & predicate
+    return expression
+
+
+# QUERIES -----------------------------------------------------------------------------
+
+
+def battles(
+    days: Iterable[str],
+    include: Sequence[Card] = (),
+    exclude: Sequence[Card] = (),
+    game_modes: Union[Sequence[int], None] = None,
+    trophies: Union[tuple[int, int], None] = None,
+    columns: Sequence[str] = COLUMNS,
+    dataset_dir: pathlib.Path = db / "dataset",
+    batch_size: int = 500_000,
+) -> Iterator[pa.RecordBatch]:
+    # Battles of days (YYYYMMDD) where the deck of a side has every card of
+    # include, no card of exclude and trophies in range. Every file is read
+    # once, with only columns and the masks: predicates are evaluated by the
+    # scanner on batches, days and game modes also prune files and row groups.
+    # Batches have columns, day and ('team', 'match') / ('opponent', 'match').
+    sides = {side: side_filter(side, include, exclude, trophies) for side in SIDES}
+    expression = ds.field("day").isin(list(days)) & (sides["team"] | sides["opponent"])
+    if game_modes is not None:
+        expression = expression & ds.field(GAME_MODE).isin(list(game_modes))
+    projection = {column: ds.field(column) for column in columns}
+    projection["day"] = ds.field("day")
+    for side, predicate in sides.items():
+        projection[f"('{side}', 'match')"] = predicate
+    dataset = load_dataset(dataset_dir)
+    scanner = dataset.scanner(
+        columns=projection, filter=expression, batch_size=batch_size
+    )
+    for batch in scanner.to_batches():
+        if batch.num_rows:
+            yield batch
+
+
+def decks(
+    days: Iterable[str],
+    include: Sequence[Card] = (),
+    exclude: Sequence[Card] = (),
+    game_modes: Union[Sequence[int], None] = None,
+    trophies: Union[tuple[int, int], None] = None,
+    dataset_dir: pathlib.Path = db / "dataset",
+    batch_size: int = 500_000,
+) -> Iterator[pa.RecordBatch]:
+    # Matching decks of team and opponent (DECKS_SCHEMA) from a single scan
+    columns = [
+        f"('{side}', '{column}')" for side in SIDES for column in ("deck_lo", "deck_hi")
+    ]
+    for batch in battles(
+        days, include, exclude, game_modes, trophies, columns, dataset_dir, batch_size
+    ):
+        for side in SIDES:
+            match = batch[f"('{side}', 'match')"]
+            n = pc.sum(match).as_py() or 0
+            if not n:
+                continue
+            yield pa.RecordBatch.from_arrays(
+                [
+                    pc.filter(batch["day"], match),
+                    pa.array([side] * n, pa.string()),
+                    pc.filter(batch[f"('{side}', 'deck_lo')"], match),
+                    pc.filter(batch[f"('{side}', 'deck_hi')"], match),
+                ],
+                schema=DECKS_SCHEMA,
+            )
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Count battles of days matching a deck filter.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("days", nargs="+", help="Days (YYYYMMDD).")
+    parser.add_argument(
+        "-i", "--include", nargs="*", default=[], help="Cards (keys) in the deck."
+    )
+    parser.add_argument(
+        "-e", "--exclude", nargs="*", default=[], help="Cards (keys) not in the deck."
+    )
+    parser.add_argument(
+        "-g", "--game-modes", type=int, nargs="*", default=None, help="Game modes."
+    )
+    parser.add_argument(
+        "-t",
+        "--trophies",
+        type=int,
+        nargs=2,
+        default=None,
+        help="Trophies of the deck (min and max, included).",
+    )
+    parser.add_argument(
+        "-d",
+        "--dataset",
+        type=pathlib.Path,
+        default=db / "dataset",
+        help="Dataset directory (see dataset.py).",
+    )
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    counts = {day: 0 for day in args.days}
+    for batch in battles(
+        args.days,
+        args.include,
+        args.exclude,
+        args.game_modes,
+        args.trophies,
+        columns=[],
+        dataset_dir=args.dataset,
+    ):
+        days, n = np.unique(
+            batch["day"].to_numpy(zero_copy_only=False), return_counts=True
+        )
+        for day, count in zip(days, n):
+            counts[day] += int(count)
+    elapsed = time.perf_counter() - start
+    for day, count in counts.items():
+        print(f"{day}: {count} battles")
+    print(f"{sum(counts.values())} battles in {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()
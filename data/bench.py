@@ -0,0 +1,237 @@
+import argparse
+import asyncio
+import gzip
+import logging
+import os
+import pathlib
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import get_context
+
+from crawler import Crawler
+from mockapi import player_tag
+
+"""
+# Example: compare crawler throughput for 10, 20 and 50 concurrent requests
+
+python bench.py --concurrent-requests 10 20 50 --players 2000 --mock-args "--latency 0.1"
+"""
+
+here = pathlib.Path(__file__).parent
+
+# ARGPARSE ----------------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description="Measure Crawler and collect.py throughput against mockapi.py.",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument(
+    "-cr",
+    "--concurrent-requests",
+    type=int,
+    nargs="+",
+    default=[5, 10, 20, 50],
+    help="Values of concurrent_requests to compare.",
+)
+parser.add_argument(
+    "-p",
+    "--players",
+    type=int,
+    default=1000,
+    help="Battlelogs requested by every run.",
+)
+parser.add_argument(
+    "-rps",
+    "--requests-per-second",
+    type=float,
+    default=1000.0,
+    help="Rate limit of Crawler (high enough to measure concurrency only).",
+)
+parser.add_argument(
+    "-pw",
+    "--parse-workers",
+    type=int,
+    default=1,
+    help="Threads that parse battlelogs (0: on the event loop).",
+)
+parser.add_argument(
+    "--collect",
+    action="store_true",
+    help="Also run collect.py end to end (writer and dedup included).",
+)
+parser.add_argument(
+    "--mock-args",
+    type=str,
+    default="--latency 0.05 --jitter 0.02 --battles-per-hour 6",
+    help="Arguments of mockapi.py (e.g. latency, throttle rate, battle pace).",
+)
+parser.add_argument("--port", type=int, default=8089)
+args = parser.parse_args()
+
+base_url = f"http://127.0.0.1:{args.port}"
+root_players = [player_tag(i) for i in range(4)]
+
+
+# MOCK API ----------------------------------------------------------------------------
+
+
+def start_mock_api() -> subprocess.Popen:
+    # The mock runs in its own process, so it does not steal time from crawler
+    mock = subprocess.Popen(
+        [sys.executable, here / "mockapi.py", "--port", str(args.port)]
+        + args.mock_args.split(),
+        stdout=subprocess.DEVNULL,
+    )
+    for _ in range(100):
+        try:
+            socket.create_connection(("127.0.0.1", args.port)).close()
+            return mock
+        except OSError:
+            time.sleep(0.1)
+    mock.kill()
+    sys.exit("Mock api did not start")
+
+
+# CRAWLER -----------------------------------------------------------------------------
+
+
+async def loop_lag(lags: list[float], interval: float = 0.01) -> None:
+    # delay of a timer callback: how long the event loop was busy
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        lags.append(time.perf_counter() - start - interval)
+
+
+async def crawl(battlelogs: Crawler) -> dict:
+    lags = []
+    monitor = asyncio.create_task(loop_lag(lags))
+    battles = 0
+    start = time.perf_counter()
+    async for battlelog in battlelogs:
+        battles += len(battlelog)
+    elapsed = time.perf_counter() - start
+    monitor.cancel()
+    lags.sort()
+    return {
+        "elapsed": elapsed,
+        "requests": battlelogs.requests_counter,
+        "battles": battles,
+        "yield": battlelogs.new_battles_per_request,
+        "lag_p99": lags[int(len(lags) * 0.99)] if lags else 0.0,
+        "lag_max": lags[-1] if lags else 0.0,
+        "throttled": battlelogs.limiter.throttled_counter,
+    }
+
+
+def run_crawler(concurrent_requests: int) -> dict:
+    # Runs in a fresh process: peak rss is the one of this run only
+    battlelogs = Crawler(
+        api_token="mock",
+        base_url=base_url,
+        root_players=root_players,
+        battlelogs_limit=args.players,
+        concurrent_requests=concurrent_requests,
+        requests_per_second=args.requests_per_second,
+        max_requests_per_second=args.requests_per_second,
+        parse_workers=args.parse_workers,
+        log_level_console=logging.ERROR,
+    )
+    stats = asyncio.run(crawl(battlelogs))
+    stats["rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return stats
+
+
+# COLLECT -----------------------------------------------------------------------------
+
+
+def run_collect(concurrent_requests: int, tmp_dir: pathlib.Path) -> dict:
+    output = tmp_dir / f"{concurrent_requests}.csv.gz"
+    cmd = [
+        sys.executable,
+        here / "collect.py",
+        "--quiet",
+        "--force",
+        "--base-url",
+        base_url,
+        "--api-token",
+        "mock",
+        "--players",
+        str(args.players),
+        "--requests",
+        str(concurrent_requests),
+        "--requests-per-second",
+        str(args.requests_per_second),
+        "--parse-workers",
+        str(args.parse_workers),
+        "--output",
+        output,
+        "--root-players",
+        *root_players,
+    ]
+    start = time.perf_counter()
+    process = subprocess.Popen(cmd, stderr=subprocess.DEVNULL)
+    _, status, rusage = os.wait4(process.pid, 0)
+    elapsed = time.perf_counter() - start
+    assert status == 0, f"collect.py exited with status {status}"
+    with gzip.open(output, "rt") as f:
+        battles = sum(1 for _ in f)
+    return {
+        "elapsed": elapsed,
+        "requests": args.players,
+        "battles": battles,
+        "rss": rusage.ru_maxrss / 1024,
+    }
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def report(name: str, results: dict) -> None:
+    print(
+        f"\n{name:10s} {'req/s':>8s} {'battles/s':>10s} {'yield':>6s} "
+        f"{'lag p99':>8s} {'lag max':>8s} {'429':>5s} {'rss MiB':>8s}"
+    )
+    for concurrent_requests, r in results.items():
+        lag_p99 = f"{r['lag_p99'] * 1e3:6.1f}ms" if "lag_p99" in r else "-"
+        lag_max = f"{r['lag_max'] * 1e3:6.1f}ms" if "lag_max" in r else "-"
+        new_battles = f"{r['yield']:6.2f}" if "yield" in r else "-"
+        print(
+            f"{concurrent_requests:10d} {r['requests'] / r['elapsed']:8.1f} "
+            f"{r['battles'] / r['elapsed']:10.1f} {new_battles:>6s} "
+            f"{lag_p99:>8s} {lag_max:>8s} {r.get('throttled', '-'):>5} "
+            f"{r['rss']:8.1f}"
+        )
+
+
+def main():
+    mock = start_mock_api()
+    try:
+        results = {}
+        for concurrent_requests in args.concurrent_requests:
+            with ProcessPoolExecutor(1, mp_context=get_context("spawn")) as pool:
+                results[concurrent_requests] = pool.submit(
+                    run_crawler, concurrent_requests
+                ).result()
+        report("Crawler", results)
+
+        if args.collect:
+            results = {}
+            with tempfile.TemporaryDirectory() as tmp_dir:
+                for concurrent_requests in args.concurrent_requests:
+                    results[concurrent_requests] = run_collect(
+                        concurrent_requests, pathlib.Path(tmp_dir)
+                    )
+            report("collect.py", results)
+    finally:
+        mock.terminate()
+        mock.wait()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,161 @@
+import argparse
+import csv
+import pathlib
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+from decks import CARDS_TEXT, P1_DECK, P2_DECK, cards, idtoi, process_csv_file
+
+# ARGPARSE ----------------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description="Measure decks.process_csv_file on a synthetic day (before/after).",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument(
+    "-n",
+    "--battles",
+    action="store",
+    type=int,
+    default=10_000_000,
+    help="Number of battles of the synthetic day.",
+)
+parser.add_argument(
+    "-d",
+    "--decks",
+    action="store",
+    type=int,
+    default=200_000,
+    help="Number of distinct decks played (zipf distributed).",
+)
+parser.add_argument(
+    "--dir",
+    action="store",
+    type=pathlib.Path,
+    default=None,
+    help="Directory for the synthetic day and outputs (default: temporary).",
+)
+args = parser.parse_args()
+
+
+# SYNTHETIC DAY -----------------------------------------------------------------------
+
+ALPHABET = np.array(list("0289PYLQGRJCUV"))
+CARDS_IDS = np.array([str(card["id"]) for card in cards], dtype=object)
+CHUNK_SIZE = 1_000_000
+
+
+def synthetic_day(path: pathlib.Path, n: int, n_decks: int, seed: int = 0) -> None:
+    # csv of battles like collect.py writes (cards as ids): decks are drawn from
+    # a pool of n_decks decks, a few of them played far more than the others.
+    rng = np.random.default_rng(seed)
+    pool = np.argsort(rng.random((n_decks, len(cards))), axis=1)[:, :8]
+    weights = 1 / np.arange(1, n_decks + 1)
+    weights /= weights.sum()
+    with open(path, "w") as f:
+        for start in range(0, n, CHUNK_SIZE):
+            m = min(CHUNK_SIZE, n - start)
+            seconds = np.sort(rng.integers(0, 86400, m))
+            times = pd.Timestamp("2023-11-06") + pd.to_timedelta(seconds, unit="s")
+            columns = [
+                times.strftime("%Y%m%dT%H%M%S.000Z").to_numpy(dtype=object),
+                rng.choice(["72000006", "72000201", "72000323"], m).astype(object),
+            ]
+            for _ in range(2):
+                tags = ALPHABET[rng.integers(1, len(ALPHABET), (m, 9))]
+                columns.append(np.array(["".join(tag) for tag in tags], dtype=object))
+                columns.append(rng.integers(5000, 9000, m).astype(str).astype(object))
+                columns.append(CARDS_TEXT[rng.integers(0, 4, m)])
+                decks = pool[rng.choice(n_decks, m, p=weights)]
+                # cards in the order of the api (not sorted)
+                decks = np.take_along_axis(decks, rng.random((m, 8)).argsort(1), 1)
+                columns.extend(CARDS_IDS[decks].T)
+            rows = np.stack(columns, axis=1).tolist()
+            f.write("\n".join(map(",".join, rows)))
+            f.write("\n")
+
+
+# BEFORE: converters per cell, a python call per deck and per output row ---------
+
+stringify = lambda deck: "".join(map(lambda x: str(x).zfill(3), deck))  # noqa: E731
+
+CONVERTERS = {
+    "datetime": pd.to_datetime,
+    "gamemode": int,
+    "p1_tag": str,
+    "p1_trophies": int,
+    "p1_crowns": int,
+    **{c: lambda id: idtoi[id] for c in P1_DECK},
+    "p2_tag": str,
+    "p2_trophies": int,
+    "p2_crowns": int,
+    **{c: lambda id: idtoi[id] for c in P2_DECK},
+}
+USECOLS = ["gamemode", "p1_crowns", *P1_DECK, "p2_crowns", *P2_DECK]
+
+
+def process_csv_file_before(csv_path_in, csv_path_out, max_rows=None):
+    df = pd.read_csv(
+        csv_path_in,
+        nrows=max_rows,
+        names=list(CONVERTERS.keys()),
+        usecols=USECOLS,
+        converters=CONVERTERS,  # type: ignore
+    )
+    df = df[(df[P1_DECK].values != df[P2_DECK].values).any(axis=1)]
+    df = df[df["p1_crowns"] != df["p2_crowns"]]
+    decks = df[P1_DECK + P2_DECK].values.reshape(-1, 2, 8)
+    targets = np.eye(2, 2, dtype=int)[(df["p1_crowns"] < df["p2_crowns"]).astype(int)]
+    decks.sort()
+    idx = np.apply_along_axis(stringify, axis=2, arr=decks).argsort(axis=1)
+    idx_decks = idx[:, :, np.newaxis]
+    idx_targets = idx[:, 0].astype(bool)
+    decks = np.take_along_axis(decks, idx_decks, axis=1).reshape(-1, 16)
+    targets[idx_targets] = (targets[idx_targets] + 1) % 2
+    decks, inv = np.unique(decks, axis=0, return_inverse=True)
+    wins = np.zeros((len(decks), 2), dtype=int)
+    np.add.at(wins, inv, targets)
+    with open(csv_path_out, "w", newline="") as f:
+        writer = csv.writer(f)
+        for deck, win in zip(decks, wins):
+            writer.writerow([*deck, *win])
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        tmp = pathlib.Path(tmp)
+        day = tmp / "20231106.csv"
+        start = time.perf_counter()
+        synthetic_day(day, args.battles, args.decks)
+        elapsed = time.perf_counter() - start
+        size = day.stat().st_size / 2**20
+        print(f"{args.battles} battles ({size:.0f} MiB) generated in {elapsed:.1f} s")
+
+        start = time.perf_counter()
+        process_csv_file_before(day, tmp / "before.csv")
+        before = time.perf_counter() - start
+
+        start = time.perf_counter()
+        process_csv_file(day, tmp / "after.csv")
+        after = time.perf_counter() - start
+
+        identical = (tmp / "before.csv").read_bytes() == (
+            tmp / "after.csv"
+        ).read_bytes()
+        assert identical, "outputs are different"
+        with open(tmp / "after.csv") as f:
+            pairs = sum(1 for _ in f)
+
+    print(f"{pairs} pairs of decks, outputs identical")
+    print(f"{'':24s} {'before':>10s} {'after':>10s}")
+    print(f"{'process_csv_file [s]':24s} {before:10.1f} {after:10.1f}")
+    print(f"{'speedup':24s} {'':>10s} {before / after:9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,197 @@
+import argparse
+import asyncio
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import orjson
+from crawler import GAME_MODE_1V1, Battle, Player, parse_battlelogs
+from frontier import ALPHABET
+
+# ARGPARSE ----------------------------------------------------------------------------
+
+parser = argparse.ArgumentParser(
+    description="Measure the cost of parsing battlelogs (before/after).",
+    formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+)
+parser.add_argument(
+    "-n",
+    "--battlelogs",
+    action="store",
+    type=int,
+    default=2000,
+    help="Number of synthetic battlelogs to parse.",
+)
+parser.add_argument(
+    "-b",
+    "--batch",
+    action="store",
+    type=int,
+    default=8,
+    help="Battlelogs parsed in a single executor call.",
+)
+args = parser.parse_args()
+
+
+# SYNTHETIC BATTLELOGS ----------------------------------------------------------------
+
+GAME_MODES = [72000006, 72000323, 72000007, 72000268, 72000010]
+
+
+def synthetic_card(r: random.Random) -> dict:
+    i = r.randrange(121)
+    return {
+        "name": f"Card {i}",
+        "id": 26000000 + i,
+        "level": 14,
+        "starLevel": 1,
+        "maxLevel": 14,
+        "elixirCost": r.randint(1, 9),
+        "iconUrls": {
+            "medium": f"https://api-assets.clashroyale.com/cards/300/{i:032d}.png",
+        },
+    }
+
+
+def synthetic_player(r: random.Random) -> dict:
+    return {
+        "tag": "#" + "".join(r.choices(ALPHABET, k=9)),
+        "name": "Player",
+        "startingTrophies": r.randint(5000, 9000),
+        "trophyChange": r.choice([-30, 30]),
+        "crowns": r.randint(0, 3),
+        "kingTowerHitPoints": 6000,
+        "princessTowersHitPoints": [3000, 2000],
+        "clan": {"tag": "#ABCD", "name": "Clan", "badgeId": 16000000},
+        "cards": [synthetic_card(r) for _ in range(8)],
+        "elixirLeaked": 1.23,
+    }
+
+
+def synthetic_battlelog(seed: int) -> bytes:
+    r = random.Random(seed)
+    battlelog = [
+        {
+            "type": "PvP",
+            "battleTime": f"202311{r.randint(1, 28):02d}T{r.randint(0, 23):02d}"
+            "0000.000Z",
+            "arena": {"id": 54000000, "name": "Legendary Arena"},
+            "gameMode": {"id": r.choice(GAME_MODES), "name": "Ladder"},
+            "deckSelection": "collection",
+            "team": [synthetic_player(r)],
+            "opponent": [synthetic_player(r)],
+        }
+        for _ in range(25)
+    ]
+    return orjson.dumps(battlelog)
+
+
+# BEFORE: body decoded by aiohttp on the event loop, battles filtered then parsed ---
+
+
+def parse_battle_before(battle: dict) -> Battle:
+    p1, p2 = battle["team"][0], battle["opponent"][0]
+    return Battle(
+        battle["battleTime"],
+        battle["gameMode"]["id"],
+        Player(
+            p1["tag"][1:],
+            p1.get("startingTrophies", 0) + p1.get("trophyChange", 0),
+            p1["crowns"],
+            *[card["id"] for card in p1["cards"]],
+        ),
+        Player(
+            p2["tag"][1:],
+            p2.get("startingTrophies", 0) + p2.get("trophyChange", 0),
+            p2["crowns"],
+            *[card["id"] for card in p2["cards"]],
+        ),
+    )
+
+
+def parse_before(raw: bytes) -> list[Battle]:
+    # what resp.json(content_type=None, loads=orjson.loads) does
+    battlelog = orjson.loads(raw.strip().decode("utf-8"))
+    return [
+        parse_battle_before(battle)
+        for battle in battlelog
+        if battle["gameMode"]["id"] in GAME_MODE_1V1
+    ]
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+# period of the timer that probes the event loop (see Crawler._monitor)
+PROBE_INTERVAL = 0.005
+
+
+async def probe(lags: list[float]) -> None:
+    # Event loop lag is the delay of a timer callback: how long the loop was busy
+    # (running parsing or waiting for the GIL) without serving callbacks
+    while True:
+        start = time.perf_counter()
+        await asyncio.sleep(PROBE_INTERVAL)
+        lags.append(time.perf_counter() - start - PROBE_INTERVAL)
+
+
+async def loop_lag(raws: list[bytes], executor) -> list[float]:
+    # Lags of the event loop while parsing every battlelog (on the loop as
+    # before if executor is None)
+    loop = asyncio.get_running_loop()
+    lags = []
+    monitor = asyncio.create_task(probe(lags))
+    await asyncio.sleep(0)
+    for i in range(0, len(raws), args.batch):
+        batch = raws[i : i + args.batch]
+        if executor is None:
+            [parse_before(raw) for raw in batch]
+            await asyncio.sleep(0)
+        else:
+            await loop.run_in_executor(executor, parse_battlelogs, batch)
+    monitor.cancel()
+    return lags
+
+
+async def idle_lag(seconds: float) -> float:
+    # Lag of a probe on an idle loop (timer resolution), subtracted from others
+    lags = []
+    monitor = asyncio.create_task(probe(lags))
+    await asyncio.sleep(seconds)
+    monitor.cancel()
+    return sum(lags) / max(len(lags), 1)
+
+
+def main():
+    raws = [synthetic_battlelog(seed) for seed in range(args.battlelogs)]
+    size = sum(map(len, raws)) / len(raws) / 1024
+    print(f"{len(raws)} battlelogs, {size:.0f} KiB each")
+
+    assert [parse_before(raw) for raw in raws] == parse_battlelogs(raws)
+
+    start = time.perf_counter()
+    [parse_before(raw) for raw in raws]
+    before = (time.perf_counter() - start) / len(raws)
+
+    start = time.perf_counter()
+    parse_battlelogs(raws)
+    after = (time.perf_counter() - start) / len(raws)
+
+    idle = asyncio.run(idle_lag(1.0))
+    lags = {"on the loop (before)": asyncio.run(loop_lag(raws, None))}
+    with ThreadPoolExecutor(1) as executor:
+        lags["thread pool"] = asyncio.run(loop_lag(raws, executor))
+    with ProcessPoolExecutor(1) as executor:
+        lags["process pool"] = asyncio.run(loop_lag(raws, executor))
+
+    print(f"{'':24s} {'before':>10s} {'after':>10s}")
+    print(f"{'parse [ms/battlelog]':24s} {before * 1e3:10.3f} {after * 1e3:10.3f}")
+    print()
+    print(f"{'event loop lag (probe)':24s} {'[ms/battlelog]':>16s} {'max [ms]':>10s}")
+    for name, probes in lags.items():
+        blocked = max(0.0, sum(probes) - idle * len(probes)) / len(raws)
+        print(f"{name:24s} {blocked * 1e3:16.3f} {max(probes) * 1e3:10.3f}")
+
+
+if __name__ == "__main__":
+    main()
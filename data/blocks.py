@@ -0,0 +1,188 @@
+import argparse
+import gzip
+import pathlib
+import sys
+import zlib
+from bisect import bisect_left, bisect_right
+from typing import Iterator, Union
+
+"""
+# Example: how to use block compressed files
+
+with BlockWriter(pathlib.Path("20231106.csv.gz")) as f:
+    f.write(sorted_lines)  # bytes, sorted by battle time
+
+# battles between 18:00 and 20:00: only the blocks of that range are read
+for line in read_range(pathlib.Path("20231106.csv.gz"), "20231106T18", "20231106T20"):
+    ...
+
+# from shell (zcat, gunzip and pandas still read the whole file as usual)
+python blocks.py ../db/days/20231106.csv.gz --start 20231106T18 --end 20231106T20
+"""
+
+# Files are a sequence of independent gzip members of about BLOCK_SIZE bytes of
+# uncompressed lines (a valid gzip file, like BGZF). The sidecar index FILE.idx
+# has a line "KEY OFFSET" per block, where KEY is the minute (YYYYMMDDTHHMM) of
+# the first battle of the block and OFFSET its position in FILE.
+BLOCK_SIZE = 1 << 16
+KEY_SIZE = len("YYYYMMDDTHHMM")
+
+
+def index_path(path: pathlib.Path) -> pathlib.Path:
+    return path.with_name(f"{path.name}.idx")
+
+
+class BlockWriter:
+    def __init__(
+        self,
+        path: pathlib.Path,
+        block_size: int = BLOCK_SIZE,
+        compresslevel: int = 6,
+    ) -> None:
+        # Both file and index are written to temporary files and renamed on
+        # close: readers never see a partial file.
+        self.path = path
+        self.tmp_path = path.with_name(f".{path.name}.tmp")
+        self.block_size = block_size
+        self.compresslevel = compresslevel
+        self.f = open(self.tmp_path, "wb")
+        self.index = []
+        self.block = []
+        self.size = 0
+        self.lines_counter = 0
+
+    def write(self, lines: list[bytes]) -> None:
+        for line in lines:
+            self.block.append(line)
+            self.size += len(line)
+            if self.size >= self.block_size:
+                self._flush()
+        self.lines_counter += len(lines)
+
+    def _flush(self) -> None:
+        if not self.block:
+            return
+        self.index.append(f"{self.block[0][:KEY_SIZE].decode()} {self.f.tell()}\n")
+        data = b"".join(self.block)
+        self.f.write(gzip.compress(data, self.compresslevel, mtime=0))
+        self.block, self.size = [], 0
+
+    def close(self) -> None:
+        self._flush()
+        self.f.close()
+        tmp_index = index_path(self.tmp_path)
+        tmp_index.write_text("".join(self.index))
+        self.tmp_path.replace(self.path)
+        tmp_index.replace(index_path(self.path))
+
+    def __enter__(self):
+        return self
+
+    def abort(self) -> None:
+        # Drop the temporary file: the target (maybe the input of rewrite) is
+        # left untouched
+        self.f.close()
+        self.tmp_path.unlink(missing_ok=True)
+
+    def __exit__(self, *exc) -> None:
+        if exc[0] is not None:
+            self.abort()
+        else:
+            self.close()
+
+
+def read_index(path: pathlib.Path) -> tuple[list[str], list[int]]:
+    keys, offsets = [], []
+    with open(index_path(path)) as f:
+        for line in f:
+            key, offset = line.split()
+            keys.append(key)
+            offsets.append(int(offset))
+    return keys, offsets
+
+
+def _blocks(path: pathlib.Path, first: int, last: int) -> Iterator[bytes]:
+    # decompress blocks from first to last (excluded) only, one at a time
+    _, offsets = read_index(path)
+    offsets.append(path.stat().st_size)
+    with open(path, "rb") as f:
+        f.seek(offsets[first])
+        for i in range(first, last):
+            yield zlib.decompress(f.read(offsets[i + 1] - offsets[i]), wbits=31)
+
+
+def read_range(
+    path: pathlib.Path, start: str = "", end: Union[str, None] = None
+) -> Iterator[bytes]:
+    # Lines (battles) with start <= line < end, where start and end are prefixes
+    # of battle times (e.g. "20231106T18"). Without index the whole file is read.
+    start_bytes = start.encode()
+    end_bytes = end.encode() if end is not None else None
+    if not index_path(path).exists():
+        blocks = gzip.open(path, "rb")
+    else:
+        keys, _ = read_index(path)
+        if not keys:
+            return
+        # the block before the first key >= start may end with battles >= start
+        first = max(0, bisect_left(keys, start[:KEY_SIZE]) - 1)
+        # blocks of the minute of end may start with battles < end (e.g. end is
+        # "20231106T200030" and the block starts at 20:00:00)
+        last = len(keys) if end is None else bisect_right(keys, end[:KEY_SIZE])
+        if first >= last:
+            return
+        blocks = _blocks(path, first, last)
+    remainder = b""
+    for block in blocks:
+        lines = (remainder + block).split(b"\n")
+        remainder = lines.pop()
+        for line in lines:
+            line += b"\n"
+            if end_bytes is not None and line >= end_bytes:
+                return
+            if line >= start_bytes:
+                yield line
+    if remainder and remainder >= start_bytes:
+        if end_bytes is None or remainder < end_bytes:
+            yield remainder
+
+
+def rewrite(path: pathlib.Path) -> int:
+    # Convert a (sorted) plain gzip file into a block compressed file with index
+    with gzip.open(path, "rb") as f, BlockWriter(path) as writer:
+        while lines := f.readlines(BLOCK_SIZE):
+            writer.write(lines)
+    return writer.lines_counter
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Print battles of a time range of block compressed .csv.gz files.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("inputs", type=pathlib.Path, nargs="+", help=".csv.gz files")
+    parser.add_argument(
+        "-s", "--start", type=str, default="", help="e.g. 20231106T18 (included)"
+    )
+    parser.add_argument(
+        "-e", "--end", type=str, default=None, help="e.g. 20231106T20 (excluded)"
+    )
+    parser.add_argument(
+        "--rewrite",
+        action="store_true",
+        help="Rewrite plain gzip inputs as block compressed files with index.",
+    )
+    args = parser.parse_args()
+
+    for path in args.inputs:
+        if args.rewrite:
+            print(f"rewritten '{path}' ({rewrite(path)} battles)")
+        else:
+            sys.stdout.buffer.writelines(read_range(path, args.start, args.end))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,14 +1,17 @@
 import argparse
 import asyncio
-import csv
 import logging
 import os
 import pathlib
+import signal
+import sys
 from datetime import datetime
 
 import httpx
 import tqdm
 from crawler import Crawler
+from dedup import BattlesFilter, fingerprint
+from writer import SortedWriter
 
 # PATHS -------------------------------------------------------------------------------
 
@@ -52,15 +55,116 @@ parser.add_argument(
     metavar="Y",
     type=int,
     default=13,
-    help="Perform up to Y http requests concurently.",
+    help="Start performing Y http requests concurently (adapted to api quota).",
+)
+parser.add_argument(
+    "-rps",
+    "--requests-per-second",
+    action="store",
+    metavar="Z",
+    type=float,
+    default=10.0,
+    help="Start performing Z http requests per second (adapted to api quota).",
+)
+parser.add_argument(
+    "-pw",
+    "--parse-workers",
+    action="store",
+    type=int,
+    default=1,
+    help="Threads that parse battlelogs outside the event loop (0: on the loop).",
+)
+parser.add_argument(
+    "--parse-processes",
+    action="store_true",
+    help="Parse battlelogs in --parse-workers processes instead of threads.",
 )
 parser.add_argument(
     "-o",
     "--output",
     action="store",
     type=pathlib.Path,
-    default=here.parent / "db" / "test" / f"{now}.csv",
-    help="Output path for .csv.",
+    default=here.parent / "db" / "test" / f"{now}.csv.gz",
+    help="Output path for .csv.gz (sorted and without duplicates).",
+)
+parser.add_argument(
+    "-F",
+    "--frontier",
+    action="store",
+    type=pathlib.Path,
+    default=None,
+    help="Resume crawl from (and save it to) this frontier file (.gz).",
+)
+parser.add_argument(
+    "-d",
+    "--dedup",
+    action="store",
+    type=pathlib.Path,
+    default=None,
+    help="Skip battles saved by previous runs using filters stored in this dir.",
+)
+parser.add_argument(
+    "-s",
+    "--shard",
+    action="store",
+    metavar="K/N",
+    type=str,
+    default="0/1",
+    help="Request only players of shard K out of N (see --coordinator).",
+)
+parser.add_argument(
+    "-c",
+    "--coordinator",
+    action="store",
+    type=pathlib.Path,
+    default=here.parent / "db" / "hours" / "coordinator.sqlite",
+    help="SQLite file shared by shards to exchange players.",
+)
+parser.add_argument(
+    "-m",
+    "--metrics",
+    action="store",
+    type=pathlib.Path,
+    default=None,
+    help="Export crawler metrics to this file (.prom for Prometheus, else json).",
+)
+parser.add_argument(
+    "--profile",
+    action="store",
+    type=pathlib.Path,
+    default=None,
+    help="Sample cpu time of requests and parsing into this file (folded stacks).",
+)
+parser.add_argument(
+    "--base-url",
+    action="store",
+    type=str,
+    default=None,
+    help="Use another api server (e.g. mockapi.py) instead of Clash Royale api.",
+)
+parser.add_argument(
+    "--api-token",
+    action="store",
+    type=str,
+    default=None,
+    help="Use this api token instead of creating one on developer portal.",
+)
+parser.add_argument(
+    "-D",
+    "--daemon",
+    action="store",
+    metavar="DIR",
+    type=pathlib.Path,
+    default=None,
+    help="Run until SIGTERM/SIGINT writing battles of every hour in a file of DIR.",
+)
+parser.add_argument(
+    "--ip-check",
+    action="store",
+    metavar="S",
+    type=float,
+    default=600.0,
+    help="In daemon mode check public ip every S seconds (new api key if changed).",
 )
 parser.add_argument(
     "-f",
@@ -78,6 +182,8 @@ parser.add_argument(
 
 args = parser.parse_args()
 
+args.shard, args.shards = map(int, args.shard.split("/"))
+
 # convert v counts into logging level https://gist.github.com/ms5/9f6df9c42a5f5435be0e
 args.verbose = 40 - (10 * args.verbose) if args.verbose > 0 else 0
 
@@ -85,40 +191,71 @@ args.verbose = 40 - (10 * args.verbose) if args.verbose > 0 else 0
 # CONFIGS -----------------------------------------------------------------------------
 
 
-args.output.parent.mkdir(parents=True, exist_ok=True)
-
-csv_path: pathlib.Path = args.output
-log_path: pathlib.Path = args.output.parent / "collect.log"
-
-assert (
-    not csv_path.exists() or args.force
-), f"{csv_path} already exists. Use -f for overwrite it."
-assert (
-    csv_path.suffix == ".csv"
-), "Output file will be a csv file. Use .csv as suffix for output."
-assert (
-    email := os.getenv("API_CLASH_ROYALE_EMAIL")
-), "API_CLASH_ROYALE_EMAIL env variable is not define"
-assert (
-    password := os.getenv("API_CLASH_ROYALE_PASSWORD")
-), "API_CLASH_ROYALE_PASSWORD env variable is not define"
-
-ip = httpx.get("https://wtfismyip.com/text").text.strip()
-
-credentials = {"email": email, "password": password}
-api_key = {
-    "name": "cr-analysis",
-    "description": f"API key automatically generated at {now}",
-    "cidrRanges": [ip],
-    "scope": None,
-}
-
-with httpx.Client(base_url="https://developer.clashroyale.com") as client:
-    client.post("/api/login", json=credentials)
-    keys = client.post("/api/apikey/list", json={}).json().get("keys", [])
-    if len(keys) == 10:
-        client.post("/api/apikey/revoke", json={"id": keys[-1]["id"]})
-    api_token = client.post("/api/apikey/create", json=api_key).json()["key"]["key"]
+if args.daemon is not None:
+    # output files are named after the hour they start (like collect.sh does)
+    args.daemon.mkdir(parents=True, exist_ok=True)
+    log_path: pathlib.Path = args.daemon / "collect.log"
+else:
+    args.output.parent.mkdir(parents=True, exist_ok=True)
+
+    csv_path: pathlib.Path = args.output
+    log_path: pathlib.Path = args.output.parent / "collect.log"
+
+    assert (
+        not csv_path.exists() or args.force
+    ), f"{csv_path} already exists. Use -f for overwrite it."
+    assert csv_path.name.endswith(
+        ".csv.gz"
+    ), "Output file will be a compressed csv file. Use .csv.gz as suffix for output."
+
+
+def public_ip() -> str:
+    return httpx.get("https://wtfismyip.com/text").text.strip()
+
+
+def create_api_token(ip: str) -> str:
+    # Log in developer portal and create an api key for the given public ip
+    assert (
+        email := os.getenv("API_CLASH_ROYALE_EMAIL")
+    ), "API_CLASH_ROYALE_EMAIL env variable is not define"
+    assert (
+        password := os.getenv("API_CLASH_ROYALE_PASSWORD")
+    ), "API_CLASH_ROYALE_PASSWORD env variable is not define"
+
+    credentials = {"email": email, "password": password}
+    api_key = {
+        "name": "cr-analysis" if args.shards == 1 else f"cr-analysis-{args.shard}",
+        "description": "API key automatically generated at "
+        f"{datetime.now():%Y%m%dT%H%M%S}",
+        "cidrRanges": [ip],
+        "scope": None,
+    }
+
+    with httpx.Client(base_url="https://developer.clashroyale.com") as client:
+        client.post("/api/login", json=credentials)
+        keys = client.post("/api/apikey/list", json={}).json().get("keys", [])
+        if args.shards > 1:
+            # every shard has its own key: never revoke the ones of other shards
+            for key in [key for key in keys if key["name"] == api_key["name"]]:
+                client.post("/api/apikey/revoke", json={"id": key["id"]})
+                keys.remove(key)
+        if len(keys) == 10:
+            # make room for the new key (in shard mode, with a key of no shard)
+            if args.shards > 1:
+                keys = [k for k in keys if not k["name"].startswith("cr-analysis-")]
+                assert keys, (
+                    "Api keys limit (10) reached by keys of other shards: "
+                    "revoke one in the developer portal or use fewer shards"
+                )
+            client.post("/api/apikey/revoke", json={"id": keys[-1]["id"]})
+        return client.post("/api/apikey/create", json=api_key).json()["key"]["key"]
+
+
+if args.api_token is not None:
+    ip, api_token = None, args.api_token
+else:
+    ip = public_ip()
+    api_token = create_api_token(ip)
 
 battlelogs = Crawler(
     api_token=api_token,
@@ -127,17 +264,42 @@ battlelogs = Crawler(
     root_players=args.root_players,
     battlelogs_limit=args.players,
     concurrent_requests=args.requests,
+    requests_per_second=args.requests_per_second,
+    parse_workers=args.parse_workers,
+    parse_processes=args.parse_processes,
     log_level_console=args.verbose,
     log_level_file=logging.INFO,
     log_file_path=log_path,
+    frontier_path=args.frontier,
+    shard=args.shard,
+    shards=args.shards,
+    coordinator_path=args.coordinator,
+    base_url=args.base_url,
+    metrics_path=args.metrics,
+    profile_path=args.profile,
+    keep_alive=args.daemon is not None,
 )
 
 
 # MAIN --------------------------------------------------------------------------------
 
 
+def new_rows(battles: list, battles_saved: BattlesFilter) -> list[tuple]:
+    # csv rows of battles not saved yet (player with the greater tag first)
+    rows = []
+    for b in battles:
+        if b.player1.tag > b.player2.tag:
+            battle = (b.battle_time, b.game_mode, *b.player1, *b.player2)
+        else:
+            battle = (b.battle_time, b.game_mode, *b.player2, *b.player1)
+        if not battles_saved.check_and_add(b.battle_time, fingerprint(battle)):
+            rows.append(battle)
+    return rows
+
+
 async def main():
-    battles_saved = set()
+    battles_saved = BattlesFilter(args.dedup)
+    battles_written = 0
 
     progress_bar = tqdm.tqdm(
         total=args.players,
@@ -149,21 +311,103 @@ async def main():
 
     battlelogs.log.info("Start collecting ...")
 
-    with open(csv_path, "a", newline="") as csvfile:
-        writer = csv.writer(csvfile)
+    # sorting, compression and disk writes happen in a background thread
+    async with SortedWriter(csv_path) as writer:
         async for battles in battlelogs:
-            for b in battles:
-                if b.player1.tag > b.player2.tag:
-                    battle = (b.battle_time, b.game_mode, *b.player1, *b.player2)
-                else:
-                    battle = (b.battle_time, b.game_mode, *b.player2, *b.player1)
-                if (hb := hash(battle)) not in battles_saved:
-                    writer.writerow(battle)
-                    battles_saved.add(hb)
+            rows = new_rows(battles, battles_saved)
+            await writer.write(rows)
+            battles_written += len(rows)
             progress_bar.update()
     progress_bar.close()
+    battles_saved.save()
+    battlelogs.log.info(f"Skip {battles_saved.duplicates_counter} duplicated battles")
+    # the real measure of crawl throughput
+    battlelogs.log.info(
+        f"Saved {battles_written} battles "
+        f"({battles_written / max(1, battlelogs.requests_counter):.2f} per request)"
+    )
+
+    battlelogs.log.info("End collecting.")
+
+
+# DAEMON ------------------------------------------------------------------------------
+
+
+async def check_ip(ip: str) -> None:
+    # The api key is bound to the public ip: create a new one only if ip changes
+    while True:
+        await asyncio.sleep(args.ip_check)
+        try:
+            new_ip = await asyncio.to_thread(public_ip)
+            if new_ip != ip:
+                battlelogs.log.warning(f"Public ip is {new_ip} (was {ip})")
+                api_token = await asyncio.to_thread(create_api_token, new_ip)
+                battlelogs.set_api_token(api_token)
+                ip = new_ip
+        except (httpx.HTTPError, KeyError) as exc:
+            battlelogs.log.error(f"Error while checking public ip: {exc!r}")
+
+
+def hour_writer(hour: datetime) -> SortedWriter:
+    writer = SortedWriter(args.daemon / f"{hour:%Y%m%dT%H%M%S}.csv.gz")
+    writer.open()
+    return writer
+
+
+def close_writer(writer: SortedWriter, errors: list) -> asyncio.Task:
+    # Close (merge and compress) an hour file in background. The crawl goes on:
+    # errors (e.g. disk full) are logged as soon as they happen and collected.
+    def done(task: asyncio.Task) -> None:
+        if not task.cancelled() and task.exception() is not None:
+            battlelogs.log.critical(
+                f"Error while saving {writer.path}: {task.exception()!r}"
+            )
+            errors.append(task.exception())
+
+    task = asyncio.create_task(writer.close())
+    task.add_done_callback(done)
+    return task
+
+
+async def daemon():
+    # One crawler (and http session) for the whole run: every hour the battles
+    # file is closed (merged in background) and a new one is opened.
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, battlelogs.stop)
+    ip_checker = asyncio.create_task(check_ip(ip)) if ip is not None else None
+
+    battles_saved = BattlesFilter(args.dedup)
+    battles_written = 0
+    writer = hour_writer(datetime.now())
+    writer_hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+    closing, errors = [], []
+
+    battlelogs.log.info("Start collecting (daemon) ...")
+
+    async for battles in battlelogs:
+        hour = datetime.now().replace(minute=0, second=0, microsecond=0)
+        if hour > writer_hour:
+            battlelogs.log.info(f"Saved {battles_written} battles in {writer.path}")
+            closing = [task for task in closing if not task.done()]
+            closing.append(close_writer(writer, errors))
+            battles_saved.save()
+            writer, writer_hour = hour_writer(hour), hour
+            battles_written = 0
+        rows = new_rows(battles, battles_saved)
+        await writer.write(rows)
+        battles_written += len(rows)
 
+    if ip_checker is not None:
+        ip_checker.cancel()
+    battlelogs.log.info(f"Saved {battles_written} battles in {writer.path}")
+    closing.append(close_writer(writer, errors))
+    await asyncio.gather(*closing, return_exceptions=True)
+    battles_saved.save()
+    battlelogs.log.info(f"Skip {battles_saved.duplicates_counter} duplicated battles")
     battlelogs.log.info("End collecting.")
+    if errors:
+        sys.exit(f"{len(errors)} hour files could not be saved (see the log)")
 
 
-asyncio.run(main())
+asyncio.run(main() if args.daemon is None else daemon())
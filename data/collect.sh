@@ -1,17 +1,14 @@
 #!/bin/bash
 
-csv_path="../db/hours/$(date '+%Y%m%dT%H%M%S').csv"
+csv_path="../db/hours/$(date '+%Y%m%dT%H%M%S').csv.gz"
 
 # collect battles into csv_path file
+# (already sorted by battles datetime, without duplication and compressed)
 python collect.py                                 \
   --quiet                                         \
   --players $1                                    \
   --requests 13                                   \
+  --frontier "../db/hours/frontier.gz"            \
+  --dedup "../db/dedup"                           \
+  --metrics "../db/hours/metrics.prom"            \
   --output "$csv_path"
-
-# sort csv file by battles datetime,
-# remove duplication and compress.
-sort --unique "$csv_path" | gzip > "$csv_path.gz"
-
-# remove csv file keeping only the compress version.
-[[ -s "$csv_path.gz" ]] && rm "$csv_path"
@@ -0,0 +1,24 @@
+#!/bin/bash
+
+# Run $2 crawlers in parallel (one api key each) that share players through
+# a coordinator, e.g. `./collect_shards.sh 25000 4`
+players="$1"
+shards="$2"
+datetime="$(date '+%Y%m%dT%H%M%S')"
+
+for ((shard = 0; shard < shards; shard++)); do
+  csv_path="../db/hours/${datetime}-${shard}.csv.gz"
+  # collect battles into csv_path file
+  # (already sorted by battles datetime, without duplication and compressed)
+  python collect.py                                       \
+    --quiet                                               \
+    --players "$players"                                  \
+    --requests 13                                         \
+    --shard "$shard/$shards"                              \
+    --coordinator "../db/hours/coordinator.sqlite"        \
+    --frontier "../db/hours/frontier-${shard}.gz"         \
+    --dedup "../db/dedup"                                 \
+    --output "$csv_path" &
+done
+
+wait
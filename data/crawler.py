@@ -3,12 +3,27 @@ import logging
 import pathlib
 import sys
 import time
-from collections import namedtuple
+from collections import deque, namedtuple
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
 from typing import Union
 
 import aiohttp
 import orjson
-from heapdict import heapdict
+from frontier import (
+    Frontier,
+    PlayersQueue,
+    PlayersStats,
+    Priority,
+    TagSet,
+    decode_tag,
+    encode_tag,
+    load_frontier,
+    save_frontier,
+    to_epoch,
+)
+from limiter import RateLimiter
+from metrics import BATTLES, Metrics, SamplingProfiler
+from shard import ShardRouter
 
 """
 # Example: how to use Crawler
@@ -53,11 +68,6 @@ GAME_MODE_1V1 = {
 }
 
 
-Priority = namedtuple(
-    "Priority",
-    ("ranked_trophies", "ladder_trophies", "last_ranked_battle", "last_ladder_battle"),
-    defaults=[0, 0, "", ""],
-)
 Battle = namedtuple(
     "Battle",
     ("battle_time", "game_mode", "player1", "player2"),
@@ -68,6 +78,75 @@ Player = namedtuple(
 )
 
 
+# Parsing is a pure function of the response body, so it can run in a worker
+# thread or process (see Crawler parse_workers) without touching the event loop.
+
+
+def parse_battle(battle: dict) -> Union[Battle, None]:
+    try:
+        p1, p2 = battle["team"][0], battle["opponent"][0]
+        # If startingTrophies or trophyChange is not present in json, their vaule
+        # is assume to be 0 (hence .get with 0 as default).
+        return Battle(
+            battle["battleTime"],
+            battle["gameMode"]["id"],
+            Player(
+                p1["tag"][1:],
+                p1.get("startingTrophies", 0) + p1.get("trophyChange", 0),
+                p1["crowns"],
+                *[card["id"] for card in p1["cards"]],
+            ),
+            Player(
+                p2["tag"][1:],
+                p2.get("startingTrophies", 0) + p2.get("trophyChange", 0),
+                p2["crowns"],
+                *[card["id"] for card in p2["cards"]],
+            ),
+        )
+    except (KeyError, IndexError, TypeError):
+        logging.getLogger(__name__).error(f"Error while parsing {battle}")
+        return None
+
+
+def parse_battlelog(raw: bytes) -> Union[list[Battle], None]:
+    # Decode the body once and parse 1v1 battles only, in a single pass. None if
+    # the body is not a battlelog (the player is requested again).
+    if not raw:
+        return []
+    try:
+        battlelog = orjson.loads(raw)
+    except orjson.JSONDecodeError:
+        return None
+    if not isinstance(battlelog, list):
+        return None
+    battles = []
+    for battle in battlelog:
+        # gameMode is missing in battles of some events
+        if not isinstance(battle, dict):
+            continue
+        if (battle.get("gameMode") or {}).get("id") in GAME_MODE_1V1:
+            parsed = parse_battle(battle)
+            if parsed is not None:
+                battles.append(parsed)
+    return battles
+
+
+def error_reason(body: bytes) -> str:
+    # Reason of an error response: json of the api or any other body (html page
+    # of a proxy for 502 and 504)
+    try:
+        msg = orjson.loads(body)
+        return f"{msg['reason']} - {msg.get('message')}"
+    except (orjson.JSONDecodeError, KeyError, TypeError):
+        return body[:200].decode(errors="replace").strip() or "no reason"
+
+
+def parse_battlelogs(raws: list[bytes]) -> list[Union[list[Battle], None]]:
+    # Parse several battlelogs with a single executor call (an invalid one does
+    # not fail the others)
+    return [parse_battlelog(raw) for raw in raws]
+
+
 class Crawler:
     def __init__(
         self,
@@ -78,18 +157,114 @@ class Crawler:
         battlelogs_limit: Union[int, float] = float("inf"),
         battles_limit: Union[int, float] = float("inf"),
         concurrent_requests: int = 10,
+        parse_workers: int = 1,
+        parse_processes: bool = False,
+        requests_per_second: float = 10.0,
+        max_requests_per_second: float = 100.0,
         royaleapi_proxy: bool = False,
+        base_url: Union[str, None] = None,
         log_level_console: int = logging.INFO,
         log_level_file: int = logging.ERROR,
         log_file_path: Union[pathlib.Path, None] = None,
+        frontier_path: Union[pathlib.Path, None] = None,
+        frontier_ttl: Union[int, float] = 6 * 60 * 60,
+        checkpoint_interval: int = 1000,
+        shard: int = 0,
+        shards: int = 1,
+        coordinator_path: Union[pathlib.Path, None] = None,
+        exchange_interval: int = 50,
+        revisit_battles: int = 10,
+        yield_bias: int = 100,
+        max_attempts: int = 5,
+        retry_backoff: float = 2.0,
+        max_backoff: float = 300.0,
+        maintenance_pause: float = 60.0,
+        maintenance_timeout: float = 30 * 60,
+        keep_alive: bool = False,
+        metrics_path: Union[pathlib.Path, None] = None,
+        metrics_interval: float = 10.0,
+        profile_path: Union[pathlib.Path, None] = None,
     ) -> None:
-        # Keep track of api requests
-        self.players_queue = heapdict()
+        # Logger
+        self.log_level_console = log_level_console
+        self.log_level_file = log_level_file
+        self.log_file_path = log_file_path
+        self.log = self._setup_logger()
+
+        # Metrics are exported to metrics_path (Prometheus text format if its
+        # suffix is .prom, json otherwise) every metrics_interval seconds. Cpu
+        # time of requests and parsing is sampled if profile_path is not None.
+        self.metrics = Metrics()
+        self.metrics_path = metrics_path
+        self.metrics_interval = metrics_interval
+        self.profile_path = profile_path
+        self.profiler = None
+        if self.profile_path is not None:
+            # parse workers that are processes can not be sampled
+            self.profiler = SamplingProfiler([self._request_battlelog, parse_battlelog])
+
+        # Keep track of api requests (players are identified by encoded tags)
+        self.players_queue = PlayersQueue()
         self.root_players = root_players
-        self.players_requested = set()
+        self.players_requested = TagSet()
         self.pending_requests = dict()
+
+        # Schedule requests by expected new battles: requested players are
+        # revisited once they have probably played `revisit_battles` new battles.
+        # Queued players are ranked by (trophy distance + yield_bias) / expected
+        # new battles.
+        self.players_stats = PlayersStats()
+        self.players_revisit = PlayersQueue()
+        self.revisit_battles = revisit_battles
+        self.yield_bias = yield_bias
+        self.new_battles_counter = 0
+        self.requests_counter = 0
+        # Battlelogs received and parsed but not yet returned by __anext__
+        self.battlelogs_ready = deque()
+
+        # Players whose request failed are requested again after an exponential
+        # backoff (scored by due time), at most max_attempts times.
+        self.players_retry = PlayersQueue()
+        self.retry_attempts = dict()
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_backoff = max_backoff
+        self.retries_counter = 0
+        self.recovered_counter = 0
+        self.lost_counter = 0
+
+        # Parse battlelogs outside the event loop (inline if parse_workers is 0)
+        self.parse_workers = parse_workers
+        self.parse_processes = parse_processes
+
+        # Split players among crawlers: each shard only requests the players it
+        # owns and routes the others through the coordinator.
+        self.router = None
+        self.players_outbox = []
+        self.exchange_interval = exchange_interval
+        self.next_exchange = 0
+        if shards > 1:
+            assert coordinator_path is not None, "Sharding requires a coordinator"
+            self.router = ShardRouter(coordinator_path, shard, shards)
+
+        # Resume the frontier saved by a previous run (if any)
+        self.frontier_path = frontier_path
+        self.frontier_ttl = frontier_ttl
+        self.checkpoint_interval = checkpoint_interval
+        if self.frontier_path is not None and self.frontier_path.exists():
+            self._load_frontier()
         for root_player in self.root_players:
-            self.players_queue[root_player] = Priority()
+            if self.router is not None and not self.router.owns(root_player):
+                continue
+            tag = encode_tag(root_player)
+            self.players_requested.discard(tag)
+            if tag not in self.players_queue:
+                self.players_queue[tag] = Priority()
+
+        # A crawler that is kept alive (e.g. by a daemon) waits for players to
+        # revisit when queue is empty, and stops only when stop() is called.
+        self.keep_alive = keep_alive
+        self.stopping = False
 
         # Set a limit on the numeber of iterations
         self.battlelogs_limit = battlelogs_limit
@@ -103,23 +278,42 @@ class Crawler:
         self.api_token = api_token
         self.headers = {"Authorization": f"Bearer {api_token}"}
         self.concurrent_requests = concurrent_requests
+        # Every request goes through the limiter that learns the sustainable
+        # request rate and the number of concurrent requests.
+        self.limiter = RateLimiter(
+            rate=requests_per_second,
+            window=concurrent_requests,
+            max_rate=max_requests_per_second,
+        )
         self.royaleapi_proxy = royaleapi_proxy
         self.base_url = (
             "https://proxy.royaleapi.dev"
             if royaleapi_proxy
             else "https://api.clashroyale.com"
         )
+        if base_url is not None:
+            # e.g. a local mock of the api (see mockapi.py)
+            self.base_url = base_url
+        # During maintenance (503) requests are paused, the crawl stops only if
+        # maintenance lasts more than maintenance_timeout seconds.
+        self.maintenance_pause = maintenance_pause
+        self.maintenance_timeout = maintenance_timeout
+        self.maintenance_started: Union[float, None] = None
         self.api_in_maintenance = False
 
-        # Logger
-        self.log_level_console = log_level_console
-        self.log_level_file = log_level_file
-        self.log_file_path = log_file_path
-        self.log = self._setup_logger()
-
         # Ensure connection with clashroyale api
         asyncio.run(self._test_connection())
 
+    def stop(self) -> None:
+        # The crawl ends at the next iteration (e.g. on SIGTERM), then pending
+        # requests are awaited and frontier is saved as usual.
+        self.stopping = True
+
+    def set_api_token(self, api_token: str) -> None:
+        # e.g. a new key for a new public ip: used by the next requests
+        self.api_token = api_token
+        self.headers = {"Authorization": f"Bearer {api_token}"}
+
     def _setup_logger(self) -> logging.Logger:
         log = logging.getLogger(__name__)
         log.setLevel(logging.DEBUG)
@@ -142,6 +336,42 @@ class Crawler:
 
         return log
 
+    def _load_frontier(self) -> None:
+        frontier = load_frontier(self.frontier_path)
+        self.players_queue = frontier.queue
+        self.players_revisit = frontier.revisits
+        self.players_stats = frontier.stats
+        # Requested players are skipped only while their battlelogs are recent,
+        # otherwise they can be discovered (and requested) again.
+        age = time.time() - frontier.saved_at
+        if age < self.frontier_ttl:
+            self.players_requested = frontier.requested
+        self.log.info(
+            f"Resume frontier from {self.frontier_path} ({age / 60:.0f} min old): "
+            f"{len(self.players_queue)} queued, "
+            f"{len(self.players_requested)} requested, "
+            f"{len(self.players_revisit)} to revisit"
+        )
+
+    def save_frontier(self) -> None:
+        if self.frontier_path is None:
+            return
+        # Players with a pending request (or a battlelog not yet returned) were
+        # popped from the queue but their battlelog is not collected yet, so put
+        # them back in the saved queue.
+        pending = list(self.pending_requests.values())
+        pending += [(tag, priority) for tag, priority, _ in self.battlelogs_ready]
+        pending += list(self.players_retry.items())
+        frontier = Frontier(
+            self.players_queue,
+            self.players_requested,
+            self.players_revisit,
+            self.players_stats,
+            saved_at=time.time(),
+        )
+        save_frontier(self.frontier_path, frontier, pending=pending)
+        self.log.debug(f"Save frontier to {self.frontier_path}")
+
     async def _test_connection(self) -> None:
         async with aiohttp.ClientSession(
             self.base_url, headers=self.headers
@@ -154,195 +384,431 @@ class Crawler:
                 else:
                     self.log.info("Connection is ok, ready to collect.")
 
-    async def _request_battlelog(self, player_tag: str) -> dict:
+    async def _request_battlelog(self, player_tag: str) -> tuple[int, bytes]:
+        # Return response status (0 for connection errors) and body
         url = f"/v1/players/%23{player_tag}/battlelog"
+        await self.limiter.acquire()
+        start = time.perf_counter()
+        status = 0
         try:
-            async with self.session.get(url) as resp:
+            async with self.session.get(url, headers=self.headers) as resp:
+                status = resp.status
                 if resp.status == 200:
-                    return await resp.json(content_type=None, loads=orjson.loads)
-                elif resp.status == 429:  # requestThrottled
-                    msg = await resp.json()
-                    self.log.error(f"{msg['reason']} - {msg['message']}")
-                    # pause this requests for 5 seconds
-                    await asyncio.sleep(5)
-                    return {}
+                    # decoding is left to parse_battlelog
+                    battlelog = await resp.read()
+                    self.limiter.on_success(time.perf_counter() - start)
+                    self._end_maintenance()
+                    return status, battlelog
+                reason = error_reason(await resp.read())
+                if resp.status == 429:  # requestThrottled
+                    self.log.error(reason)
+                    # slow down every request, not only this one
+                    self.limiter.on_throttle()
                 elif resp.status == 503:
-                    msg = await resp.json()
-                    self.log.critical(f"{msg['reason']} - {msg['message']}")
-                    self.api_in_maintenance = True
-                    return {}
+                    self._start_maintenance(reason)
                 else:
-                    msg = await resp.json()
-                    self.log.error(f"{msg['reason']} - {msg['message']}")
-                    breakpoint()
-                    return {}
-        except aiohttp.ClientError as exc:
-            self.log.error(exc)
-            return {}
-
-    def _parse_battle(self, battle: dict) -> Battle:
-        try:
-            battle_time = battle["battleTime"]
-            game_mode = battle["gameMode"]["id"]
-            p1, p2 = battle["team"][0], battle["opponent"][0]
-            tag1, tag2 = p1["tag"][1:], p2["tag"][1:]
-            # If startingTrophies or trophyChange is not present in json, their vaule
-            # is assume to be 0 (hence .get with 0 as default).
-            trophies1 = p1.get("startingTrophies", 0) + p1.get("trophyChange", 0)
-            trophies2 = p2.get("startingTrophies", 0) + p2.get("trophyChange", 0)
-            crowns1, crowns2 = p1["crowns"], p2["crowns"]
-            deck1 = [card["id"] for card in p1["cards"]]
-            deck2 = [card["id"] for card in p2["cards"]]
-            return Battle(
-                battle_time,
-                game_mode,
-                Player(tag1, trophies1, crowns1, *deck1),
-                Player(tag2, trophies2, crowns2, *deck2),
+                    self.log.error(f"{player_tag}: {resp.status} {reason}")
+                return status, b""
+        except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
+            self.log.error(f"{player_tag}: {exc!r}")
+            return status, b""
+        finally:
+            label = str(status) if status else "error"
+            self.metrics.inc("requests_total", status=label)
+            self.metrics.observe(
+                "request_seconds", time.perf_counter() - start, status=label
             )
-        except KeyError:
-            self.log.error(f"KeyError while parsing {battle}")
-            breakpoint()
-            return Battle(None, None, None, None)
 
-    def _update_players_queue(self, battles: list[Battle]) -> None:
-        # Add player1 to players_requested
+    def _start_maintenance(self, reason: str) -> None:
+        now = time.time()
+        if self.maintenance_started is None:
+            self.maintenance_started = now
+            self.log.critical(f"{reason}: pause requests")
+        elif now - self.maintenance_started > self.maintenance_timeout:
+            self.log.critical(f"{reason} for {now - self.maintenance_started:.0f} s")
+            self.api_in_maintenance = True
+        self.limiter.pause(self.maintenance_pause)
+
+    def _end_maintenance(self) -> None:
+        if self.maintenance_started is not None:
+            elapsed = time.time() - self.maintenance_started
+            self.log.warning(f"Api is back after {elapsed:.0f} s of maintenance")
+            self.maintenance_started = None
+
+    def _schedule_retry(self, tag: int, priority: Priority, status: int) -> None:
+        # Requests failed during maintenance do not count as attempts
+        attempts = self.retry_attempts.get(tag, 0)
+        if status != 503:
+            attempts += 1
+        if attempts >= self.max_attempts:
+            self.retry_attempts.pop(tag, None)
+            self.lost_counter += 1
+            self.metrics.inc("players_lost_total")
+            self.log.warning(f"Give up {decode_tag(tag)} after {attempts} attempts")
+            return
+        self.retry_attempts[tag] = attempts
+        if status == 503:
+            delay = self.maintenance_pause
+        else:
+            delay = min(self.max_backoff, self.retry_backoff * 2 ** (attempts - 1))
+        self.players_retry.push(tag, priority, int(time.time() + delay))
+        self.retries_counter += 1
+        self.metrics.inc("retries_total")
+
+    def _retry_players(self) -> None:
+        # Move players whose backoff is over back to queue
+        now = time.time()
+        while self.players_retry and self.players_retry.peek_score() <= now:
+            tag, priority = self.players_retry.popitem()
+            self._merge_player(tag, priority)
+
+    def _expected_battles(self, tag: int, now: float) -> float:
+        # Players never requested have a whole battlelog of new battles
+        stats = self.players_stats.get(tag)
+        if stats is None:
+            return 25.0
+        _, fetched, rate = stats
+        return min(25.0, max(0.1, rate * (now - fetched)))
+
+    def _score(self, tag: int, priority: Priority, now: float) -> int:
+        # Cost (in trophy distance) of every new battle: the lower the better
+        if priority.last_ranked_battle:
+            distance = priority.ranked_trophies
+        else:
+            distance = priority.ladder_trophies
+        expected = self._expected_battles(tag, now)
+        return int(1000 * (distance + self.yield_bias) / expected)
+
+    def _update_player_stats(self, tag: int, battles: list[Battle], now: float) -> int:
+        # Update newest battle and play rate of the requested player, return the
+        # number of battles newer than the ones seen in the previous request.
+        times = [to_epoch(battle.battle_time) for battle in battles]
+        newest, _, rate = self.players_stats.get(tag, (0, 0, 0.0))
+        new_battles = sum(1 for t in times if t > newest)
+        # Battles played from the oldest in battlelog up to now: inactive players
+        # get a low rate.
+        battles_rate = len(times) / max(1.0, now - min(times))
+        rate = battles_rate if rate == 0.0 else (rate + battles_rate) / 2
+        # at least one battle per day, otherwise player would never be revisited
+        rate = max(rate, 1 / 86400)
+        self.players_stats[tag] = max(newest, *times), int(now), rate
+        return new_battles
+
+    def _schedule_revisit(self, tag: int, priority: Priority) -> None:
+        _, fetched, rate = self.players_stats[tag]
+        due = int(fetched + self.revisit_battles / rate)
+        self.players_requested.add(tag)
+        self.players_revisit.push(tag, priority, due)
+
+    def _revisit_players(self) -> None:
+        # Move players that have probably played enough new battles back to queue
+        now = time.time()
+        while self.players_revisit and self.players_revisit.peek_score() <= now:
+            tag, priority = self.players_revisit.popitem()
+            self.players_requested.discard(tag)
+            self._merge_player(tag, priority)
+
+    def _update_players_queue(self, battles: list[Battle], priority: Priority) -> None:
+        now = time.time()
+
+        # Schedule player1 revisit
         _, _, p1, _ = battles[0]
-        self.players_requested.add(p1.tag)
+        tag = encode_tag(p1.tag)
+        new_battles = self._update_player_stats(tag, battles, now)
+        self.new_battles_counter += new_battles
+        self.metrics.inc("new_battles_total", new_battles)
+        self._schedule_revisit(tag, priority)
 
         # Update/Create priority for player2 in players_queue
         for battle in reversed(battles):
             battle_time, game_mode, _, p2 = battle
 
-            if p2.tag in self.players_requested:
+            if game_mode in GAME_MODE_RANKED:
+                if p2.trophies < 31:
+                    # filter out battles between top player and mediocre players
+                    continue
+            elif game_mode not in GAME_MODE_LADDER:
+                # battles of other game modes do not update priority
                 continue
 
-            if game_mode in GAME_MODE_RANKED and p2.trophies < 31:
-                # filter out battles between top player and mediocre players
+            tag = encode_tag(p2.tag)
+            if tag in self.players_requested:
                 continue
 
-            if p2.tag in self.players_queue:
-                p = self.players_queue[p2.tag]
-
-                if game_mode in GAME_MODE_RANKED:
-                    if p.last_ranked_battle < battle_time:
-                        self.players_queue[p2.tag] = Priority(
-                            abs(p2.trophies - self.trophies_ranked_target),
-                            p.ladder_trophies,
-                            battle_time,
-                            p.last_ladder_battle,
-                        )
-                    self.log.debug(
-                        f"Update player {p2.tag} ranked trophies ({p2.trophies})"
-                    )
-
-                elif game_mode in GAME_MODE_LADDER:
-                    if p.last_ladder_battle < battle_time:
-                        self.players_queue[p2.tag] = Priority(
-                            p.ranked_trophies,
-                            abs(p2.trophies - self.trophies_ladder_target),
-                            p.last_ranked_battle,
-                            battle_time,
-                        )
-                    self.log.debug(
-                        f"Update player {p2.tag} ladder trophies ({p2.trophies})"
-                    )
+            battle_time = to_epoch(battle_time)
+            if game_mode in GAME_MODE_RANKED:
+                priority = Priority(
+                    abs(p2.trophies - self.trophies_ranked_target),
+                    0,
+                    battle_time,
+                    0,
+                )
             else:
-                if game_mode in GAME_MODE_RANKED:
-                    self.players_queue[p2.tag] = Priority(
-                        abs(p2.trophies - self.trophies_ranked_target),
-                        0,
-                        battle_time,
-                        "",
-                    )
-                    self.log.debug(
-                        f"Add player {p2.tag} with ranked trophies ({p2.trophies})"
-                    )
+                priority = Priority(
+                    0,
+                    abs(p2.trophies - self.trophies_ladder_target),
+                    0,
+                    battle_time,
+                )
 
-                elif game_mode in GAME_MODE_LADDER:
-                    self.players_queue[p2.tag] = Priority(
-                        0,
-                        abs(p2.trophies - self.trophies_ladder_target),
-                        "",
-                        battle_time,
-                    )
-                    self.log.debug(
-                        f"Add player {p2.tag} with ladder trophies ({p2.trophies})"
-                    )
+            if self.router is not None and not self.router.owns(p2.tag):
+                # the shard that owns player2 will merge its priority
+                self.players_outbox.append((p2.tag, priority))
+                continue
+
+            p = self.players_queue.get(tag)
+            if p is None:
+                self.log.debug(f"Add player {p2.tag} with trophies ({p2.trophies})")
+            elif game_mode in GAME_MODE_RANKED:
+                if p.last_ranked_battle >= battle_time:
+                    continue
+                priority = p._replace(
+                    ranked_trophies=priority.ranked_trophies,
+                    last_ranked_battle=battle_time,
+                )
+                self.log.debug(
+                    f"Update player {p2.tag} ranked trophies ({p2.trophies})"
+                )
+            else:
+                if p.last_ladder_battle >= battle_time:
+                    continue
+                priority = p._replace(
+                    ladder_trophies=priority.ladder_trophies,
+                    last_ladder_battle=battle_time,
+                )
+                self.log.debug(
+                    f"Update player {p2.tag} ladder trophies ({p2.trophies})"
+                )
+            self.players_queue.push(tag, priority, self._score(tag, priority, now))
+
+    def _merge_player(self, tag: int, priority: Priority) -> None:
+        if tag in self.players_requested:
+            return
+        p = self.players_queue.get(tag)
+        if p is not None:
+            if p.last_ranked_battle < priority.last_ranked_battle:
+                p = p._replace(
+                    ranked_trophies=priority.ranked_trophies,
+                    last_ranked_battle=priority.last_ranked_battle,
+                )
+            if p.last_ladder_battle < priority.last_ladder_battle:
+                p = p._replace(
+                    ladder_trophies=priority.ladder_trophies,
+                    last_ladder_battle=priority.last_ladder_battle,
+                )
+            priority = p
+        self.players_queue.push(tag, priority, self._score(tag, priority, time.time()))
+
+    @property
+    def new_battles_per_request(self) -> float:
+        # battles not seen in the previous battlelog of the same player
+        return self.new_battles_counter / max(1, self.requests_counter)
+
+    async def _exchange_players(self) -> None:
+        # sqlite calls are blocking: run them outside the event loop
+        players, self.players_outbox = self.players_outbox, []
+        received = await asyncio.to_thread(self.router.exchange, players)
+        for tag, priority in received:
+            self._merge_player(encode_tag(tag), Priority(*priority))
+        self.next_exchange = self.battlelog_counter + self.exchange_interval
+        self.log.debug(f"Sent {len(players)} and received {len(received)} players")
+
+    def _update_gauges(self) -> None:
+        self.metrics.set("players_queue", len(self.players_queue))
+        self.metrics.set("players_revisit", len(self.players_revisit))
+        self.metrics.set("players_requested", len(self.players_requested))
+        self.metrics.set("pending_requests", len(self.pending_requests))
+        self.metrics.set("battlelogs_ready", len(self.battlelogs_ready))
+        self.metrics.set("players_retry", len(self.players_retry))
+        self.metrics.set("rate_limit", self.limiter.rate)
+        self.metrics.set("rate_effective", self.limiter.rate_effective)
+        self.metrics.set("window", self.limiter.window)
+
+    def export_metrics(self) -> None:
+        self._update_gauges()
+        if self.metrics_path is not None:
+            self.metrics.write(self.metrics_path)
+        if self.profiler is not None:
+            self.profiler.write(self.profile_path)
+
+    async def _monitor(self, interval: float = 0.1) -> None:
+        # Event loop lag is the delay of a timer callback (i.e. how long the loop
+        # was busy without awaiting). Metrics are exported every metrics_interval.
+        next_export = time.monotonic() + self.metrics_interval
+        while True:
+            start = time.perf_counter()
+            await asyncio.sleep(interval)
+            self.metrics.observe(
+                "loop_lag_seconds", time.perf_counter() - start - interval
+            )
+            if time.monotonic() >= next_export:
+                self.export_metrics()
+                next_export += self.metrics_interval
 
     def __aiter__(self):
         # Move creation of aiohttp.ClientSession inside__aiter__ to avoid
         # RuntimeError: Timeout context manager should be used inside a task
-        self.session = aiohttp.ClientSession(self.base_url, headers=self.headers)
+        self.session = aiohttp.ClientSession(self.base_url)
+        self.parse_executor: Union[Executor, None] = None
+        if self.parse_workers > 0:
+            pool = ProcessPoolExecutor if self.parse_processes else ThreadPoolExecutor
+            self.parse_executor = pool(self.parse_workers)
+        self.monitor = asyncio.create_task(self._monitor())
+        if self.profiler is not None:
+            self.profiler.start()
         return self
 
+    async def _parse_battlelogs(
+        self, raws: list[bytes]
+    ) -> list[Union[list[Battle], None]]:
+        start = time.perf_counter()
+        if self.parse_executor is None:
+            battlelogs = parse_battlelogs(raws)
+        else:
+            loop = asyncio.get_running_loop()
+            battlelogs = await loop.run_in_executor(
+                self.parse_executor, parse_battlelogs, raws
+            )
+        # time per battlelog (including the wait for a free worker)
+        elapsed = (time.perf_counter() - start) / len(raws)
+        for _ in raws:
+            self.metrics.observe("parse_seconds", elapsed)
+        return battlelogs
+
     async def __anext__(self) -> list[Battle]:
         while (
             self.battlelog_counter < self.battlelogs_limit
             and self.battles_counter < self.battles_limit
             and not self.api_in_maintenance
+            and not self.stopping
         ):
+            if self.battlelogs_ready:
+                player_tag, priority, battles = self.battlelogs_ready.popleft()
+                self.metrics.observe("battles_per_battlelog", len(battles), BATTLES)
+                if battles:
+                    self._update_players_queue(battles, priority)
+                    self.log.debug(
+                        f"Found {len(battles)} battles for {decode_tag(player_tag)}"
+                    )
+                    self.battles_counter += len(battles)
+                    self.battlelog_counter += 1
+                    self.metrics.inc("battles_total", len(battles))
+                    self.metrics.inc("battlelogs_total")
+                    if self.battlelog_counter % self.checkpoint_interval == 0:
+                        self.save_frontier()
+                    return battles
+                else:
+                    # ladder battlelog is empty hence does not update priority
+                    self.log.debug(f"Empty battles for {decode_tag(player_tag)}")
+                    self.players_requested.add(player_tag)
+                continue
+
+            if self.router is not None and (
+                self.battlelog_counter >= self.next_exchange
+                or (not self.players_queue and not self.pending_requests)
+            ):
+                await self._exchange_players()
+            self._revisit_players()
+            self._retry_players()
             if (
-                len(self.pending_requests) < self.concurrent_requests
+                len(self.pending_requests) < self.limiter.window
                 and len(self.players_queue) > 0
             ):
                 player_tag, priority = self.players_queue.popitem()
-                task = asyncio.create_task(self._request_battlelog(player_tag))
+                task = asyncio.create_task(
+                    self._request_battlelog(decode_tag(player_tag))
+                )
                 self.pending_requests[task] = (player_tag, priority)
+                self.requests_counter += 1
+            elif not self.pending_requests:
+                if self.players_retry:
+                    # wait for the first player to retry
+                    due = self.players_retry.peek_score() - time.time()
+                    await asyncio.sleep(min(1.0, max(0.0, due)))
+                elif self.keep_alive and self.players_revisit:
+                    # wait for the first player to revisit
+                    due = self.players_revisit.peek_score() - time.time()
+                    await asyncio.sleep(min(1.0, max(0.0, due)))
+                elif self.router is None:
+                    # no more players to request
+                    break
+                else:
+                    # wait for other shards to discover players owned by this shard
+                    await asyncio.sleep(1)
             else:
                 done, _ = await asyncio.wait(
                     self.pending_requests.keys(),
                     return_when=asyncio.FIRST_COMPLETED,
                 )
+                players, raws = [], []
                 for task in done:
-                    if (
-                        self.battlelog_counter >= self.battlelogs_limit
-                        or self.battles_counter >= self.battles_limit
-                    ):
-                        break
                     player_tag, priority = self.pending_requests.pop(task)
-                    battles = [
-                        self._parse_battle(battle)
-                        for battle in task.result()
-                        if battle["gameMode"]["id"] in GAME_MODE_1V1
-                    ]
-                    if battles:
-                        self._update_players_queue(battles)
-                        self.log.debug(f"Found {len(battles)} battles for {player_tag}")
-                        self.battles_counter += len(battles)
-                        self.battlelog_counter += 1
-                        return battles
-                    else:
-                        # ladder battlelog is empty hence does not update priority
-                        self.log.debug(f"Empty battles for {player_tag}")
+                    status, raw = task.result()
+                    if status == 404:
+                        # player does not exist (anymore): like an empty battlelog
+                        self.log.debug(f"Player {decode_tag(player_tag)} not found")
                         self.players_requested.add(player_tag)
+                    elif status != 200:
+                        self._schedule_retry(player_tag, priority, status)
+                    else:
+                        players.append((player_tag, priority))
+                        raws.append(raw)
+                if not raws:
+                    continue
+                # parse every completed request in one go
+                battlelogs = await self._parse_battlelogs(raws)
+                for (player_tag, priority), battles in zip(players, battlelogs):
+                    if battles is None:
+                        # a 200 whose body is not a battlelog: request it again
+                        self.log.error(f"{decode_tag(player_tag)}: invalid battlelog")
+                        self._schedule_retry(player_tag, priority, 200)
+                        continue
+                    if self.retry_attempts.pop(player_tag, None) is not None:
+                        self.recovered_counter += 1
+                    self.battlelogs_ready.append((player_tag, priority, battles))
 
         self.log.info(f"Requested {self.battlelog_counter} players")
         self.log.info(f"Found {self.battles_counter} battles")
-        # stop gracefully: wait for pending http requests and close http session
+        self.log.info(
+            f"Found {self.new_battles_counter} new battles "
+            f"({self.new_battles_per_request:.2f} per request)"
+        )
+        self.log.info(
+            f"Effective rate {self.limiter.rate_effective:.1f} req/s "
+            f"(rate limit {self.limiter.rate:.1f} req/s, "
+            f"{self.limiter.window} concurrent requests, "
+            f"{self.limiter.throttled_counter} throttled)"
+        )
+        self.log.info(
+            f"Retried {self.retries_counter} requests: {self.recovered_counter} "
+            f"players recovered, {self.lost_counter} lost after {self.max_attempts} "
+            f"attempts, {len(self.players_retry)} still to retry"
+        )
+        # stop gracefully: hand over discovered players to other shards, save
+        # frontier, wait for pending http requests and close http session
+        if self.router is not None:
+            await asyncio.to_thread(self.router.send, self.players_outbox)
+            self.players_outbox = []
+            self.log.info(
+                f"Shard {self.router.shard}/{self.router.shards}: sent "
+                f"{self.router.sent_counter} and received "
+                f"{self.router.received_counter} players"
+            )
+        self.save_frontier()
         if self.pending_requests:
             await asyncio.wait(self.pending_requests.keys())
         await self.session.close()
+        if self.parse_executor is not None:
+            self.parse_executor.shutdown()
+        self.monitor.cancel()
+        if self.profiler is not None:
+            self.profiler.stop()
+        self.export_metrics()
+        for (name, labels), h in sorted(self.metrics.histograms.items()):
+            if name in ("request_seconds", "parse_seconds", "loop_lag_seconds"):
+                self.log.info(
+                    f"{name} {dict(labels)}: {h.count} times, "
+                    f"mean {h.sum / max(1, h.count) * 1e3:.1f} ms, "
+                    f"p99 < {h.quantile(0.99) * 1e3:.0f} ms"
+                )
         raise StopAsyncIteration
-
-
-# Timers
-def timer(function):
-    def wrapper(*args, **kwargs):
-        start = time.perf_counter()
-        result = function(*args, **kwargs)
-        end = time.perf_counter()
-        print(f"{function.__name__:16s} tooks {end - start:.3f} sec")
-        return result
-
-    return wrapper
-
-
-def atimer(function):
-    async def wrapper(*args, **kwargs):
-        start = time.perf_counter()
-        result = await function(*args, **kwargs)
-        end = time.perf_counter()
-        print(f"{function.__name__:16s} tooks {end - start:.3f} sec")
-        return result
-
-    return wrapper
@@ -1,6 +1,7 @@
 import json
 import argparse
-import csv
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 
 import numpy as np
@@ -29,150 +30,346 @@ itos = {i: card["name"] for i, card in enumerate(cards)}
 # conversion functions
 encode = lambda deck: [idtoi[card] for card in deck]  # noqa: E731
 decode = lambda deck: [itos[card] for card in deck]  # noqa: E731
-stringify = lambda deck: "".join(map(lambda x: str(x).zfill(3), deck))  # noqa: E731
+
+# Decks as 64-bit keys: the 8 sorted card indices (< 256) are the bytes of the key,
+# first card in the most significant byte. Comparing keys is comparing decks card
+# by card (the order of the old zero-padded strings), so ordering, equality,
+# hashing and joins on decks are integer operations.
+SHIFTS = np.arange(56, -8, -8, dtype=np.uint64)
+
+
+def pack(decks):
+    # (..., 8) sorted card indices -> (...) uint64 keys
+    return np.bitwise_or.reduce(
+        np.asarray(decks).astype(np.uint64) << SHIFTS, axis=-1
+    ).astype(np.uint64)
+
+
+def unpack(keys):
+    # (...) uint64 keys -> (..., 8) card indices
+    keys = np.asarray(keys, dtype=np.uint64)
+    return ((keys[..., np.newaxis] >> SHIFTS) & np.uint64(0xFF)).astype(np.uint8)
+
+
+class DeckDictionary:
+    # Persistent map from deck keys to dense deck ids (0, 1, 2, ...) shared by
+    # every file of the dataset: ids never change, new decks get the next ones.
+    # Stored as the .npy array of keys in id order.
+
+    def __init__(self, path):
+        self.path = Path(path)
+        if self.path.exists():
+            self.keys = np.load(self.path)
+        else:
+            self.keys = np.empty(0, dtype=np.uint64)
+        self._index()
+
+    def _index(self):
+        self.order = self.keys.argsort(kind="stable")
+        self.sorted_keys = self.keys[self.order]
+
+    def __len__(self):
+        return len(self.keys)
+
+    def _lookup(self, keys):
+        pos = np.searchsorted(self.sorted_keys, keys)
+        pos = np.minimum(pos, max(len(self.keys) - 1, 0))
+        found = np.zeros(len(keys), dtype=bool)
+        if len(self.keys):
+            found = self.sorted_keys[pos] == keys
+        ids = np.full(len(keys), -1, dtype=np.int64)
+        ids[found] = self.order[pos[found]]
+        return ids
+
+    def ids(self, keys, add=True):
+        # Deck ids of keys (-1 for unknown decks if not add)
+        keys = np.asarray(keys, dtype=np.uint64)
+        uniques, inverse = np.unique(keys.ravel(), return_inverse=True)
+        ids = self._lookup(uniques)
+        new = ids < 0
+        if add and new.any():
+            ids[new] = np.arange(len(self.keys), len(self.keys) + new.sum())
+            self.keys = np.concatenate([self.keys, uniques[new]])
+            self._index()
+        return ids[inverse].reshape(keys.shape)
+
+    def decks(self, ids):
+        # Deck ids -> (..., 8) card indices
+        return unpack(self.keys[ids])
+
+    def save(self):
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp.npy")
+        np.save(tmp_path, self.keys)
+        tmp_path.replace(self.path)
+
 
 P1_DECK = [f"p1_card{i}" for i in range(1, 9)]
 P2_DECK = [f"p2_card{i}" for i in range(1, 9)]
-CONVERTERS = {
-    "datetime": pd.to_datetime,
-    "gamemode": int,
-    "p1_tag": str,
-    "p1_trophies": int,
-    "p1_crowns": int,
-    **{c: lambda id: idtoi[id] for c in P1_DECK},
-    "p2_tag": str,
-    "p2_trophies": int,
-    "p2_crowns": int,
-    **{c: lambda id: idtoi[id] for c in P2_DECK},
-}
+COLUMNS = [
+    "datetime",
+    "gamemode",
+    "p1_tag",
+    "p1_trophies",
+    "p1_crowns",
+    *P1_DECK,
+    "p2_tag",
+    "p2_trophies",
+    "p2_crowns",
+    *P2_DECK,
+]
 
 # Converting datetime to datetime object is slow, use only if needed
 USECOLS = ["gamemode", "p1_crowns", *P1_DECK, "p2_crowns", *P2_DECK]
+DTYPES = {c: np.int64 for c in USECOLS}
+
+# card id -> card index (-1 if unknown) for ids from CARDS_MIN to CARDS_MAX
+CARDS_MIN = min(card["id"] for card in cards)
+CARDS_MAX = max(card["id"] for card in cards)
+CARDS_LUT = np.full(CARDS_MAX - CARDS_MIN + 1, -1, dtype=np.int16)
+CARDS_LUT[[card["id"] - CARDS_MIN for card in cards]] = np.arange(len(cards))
+
+
+def lookup_cards(ids):
+    # Card ids to card indices with a lookup table (no python call per card)
+    outside = (ids < CARDS_MIN) | (ids > CARDS_MAX)
+    indices = CARDS_LUT[np.where(outside, 0, ids - CARDS_MIN)]
+    unknown = outside | (indices < 0)
+    if unknown.any():
+        raise KeyError(str(ids[unknown][0]))
+    return indices.astype(np.uint8)
+
+
+def combine(keys, wins):
+    # Sum wins of rows with the same pair of decks: unique pairs (N x 2 keys)
+    # sorted by keys and their total wins
+    if not len(keys):
+        return keys, wins
+    order = np.lexsort((keys[:, 1], keys[:, 0]))
+    keys = keys[order]
+    new = np.ones(len(keys), dtype=bool)
+    new[1:] = (keys[1:] != keys[:-1]).any(axis=1)
+    return keys[new], np.add.reduceat(wins[order], np.flatnonzero(new), axis=0)
+
+
+def aggregate(decks, p1_wins):
+    # Battles (N x 2 x 8 card indices) to unique pairs of decks, sorted by keys,
+    # with wins of the first and of the second deck. Decks of a battle are
+    # ordered by key, so a pair of decks is counted once whoever was p1.
+    decks.sort()
+    keys = pack(decks)
+    swap = keys[:, 0] > keys[:, 1]
+    first_wins = p1_wins != swap
+    keys.sort(axis=1)
+    wins = np.stack([first_wins, ~first_wins], axis=1).astype(np.int64)
+    return combine(keys, wins)
+
+
+# text of card indices, so cards are formatted by indexing instead of str()
+CARDS_TEXT = np.array([str(i) for i in range(256)], dtype=object)
+# rows formatted at once (strings of a row take about 1 KiB)
+WRITE_ROWS = 100_000
 
 
-def process_csv_file(csv_path_in, csv_path_out, max_rows=None):
-    df = pd.read_csv(
+def write_decks(csv_path_out, keys, wins):
+    # Rows "16 card indices, wins, losses" written at once (with the line
+    # terminator of csv.writer) in a temporary file renamed at the end: a
+    # partial file is never mistaken for an up to date one.
+    tmp_path = csv_path_out.with_name(f".{csv_path_out.name}.tmp")
+    with open(tmp_path, "w", newline="") as f:
+        for i in range(0, len(keys), WRITE_ROWS):
+            cards = CARDS_TEXT[unpack(keys[i : i + WRITE_ROWS]).reshape(-1, 16)]
+            text = wins[i : i + WRITE_ROWS].astype(str).astype(object)
+            rows = np.concatenate([cards, text], axis=1).tolist()
+            f.write("\r\n".join(map(",".join, rows)))
+            f.write("\r\n")
+    tmp_path.replace(csv_path_out)
+
+
+# Peak memory of process_csv_file per battle read at once (pandas columns, card
+# indices, keys and temporaries), used to split days in chunks of battles.
+BYTES_PER_BATTLE = 600
+
+
+def aggregate_battles(df):
+    # numpy arrays
+    decks = lookup_cards(df[P1_DECK + P2_DECK].values).reshape(-1, 2, 8)
+    p1_crowns = df["p1_crowns"].values
+    p2_crowns = df["p2_crowns"].values
+
+    # remove mirror matches (same cards in the same order) and draws
+    keep = (decks[:, 0] != decks[:, 1]).any(axis=1) & (p1_crowns != p2_crowns)
+    return aggregate(decks[keep], (p1_crowns > p2_crowns)[keep])
+
+
+def aggregate_chunks(chunks, chunksize=None):
+    # With chunksize, chunks are chunksize battles at a time and their aggregates
+    # are combined (memory is bounded by chunksize and unique pairs).
+    if chunksize is None:
+        return aggregate_battles(chunks)
+    keys = np.empty((0, 2), dtype=np.uint64)
+    wins = np.empty((0, 2), dtype=np.int64)
+    for df in chunks:
+        chunk_keys, chunk_wins = aggregate_battles(df)
+        keys, wins = combine(
+            np.concatenate([keys, chunk_keys]), np.concatenate([wins, chunk_wins])
+        )
+    return keys, wins
+
+
+def process_csv_file(
+    csv_path_in, csv_path_out, max_rows=None, dictionary=None, chunksize=None
+):
+    chunks = pd.read_csv(
         csv_path_in,
         nrows=max_rows,
-        names=list(CONVERTERS.keys()),
+        names=COLUMNS,
         usecols=USECOLS,
-        converters=CONVERTERS,  # type: ignore
+        dtype=DTYPES,
+        chunksize=chunksize,
+    )
+    keys, wins = aggregate_chunks(chunks, chunksize)
+    write_decks(csv_path_out, keys, wins)
+
+    if dictionary is not None:
+        dictionary.ids(keys)
+    return keys, wins
+
+
+# Pairs of deck ids of DeckDictionary (first is the deck with the smaller key,
+# as in rows of decks files) with wins of the first and of the second deck
+PAIRS = np.dtype(
+    [("first", "<i8"), ("second", "<i8"), ("wins", "<i8"), ("losses", "<i8")]
+)
+
+
+def to_pairs(ids, wins):
+    # Pairs of deck ids (N x 2) and wins (N x 2) as PAIRS sorted by ids
+    ids, wins = combine(ids, wins)
+    pairs = np.empty(len(ids), dtype=PAIRS)
+    pairs["first"], pairs["second"] = ids[:, 0], ids[:, 1]
+    pairs["wins"], pairs["losses"] = wins[:, 0], wins[:, 1]
+    return pairs
+
+
+def write_pairs(npy_path_out, pairs):
+    tmp_path = npy_path_out.with_name(f".{npy_path_out.name}.tmp.npy")
+    np.save(tmp_path, pairs)
+    tmp_path.replace(npy_path_out)
+
+
+def read_pairs(npy_path):
+    # Rows of a pairs file as pairs of ids (N x 2) and wins (N x 2)
+    pairs = np.load(npy_path)
+    ids = np.stack([pairs["first"], pairs["second"]], axis=1)
+    return ids, np.stack([pairs["wins"], pairs["losses"]], axis=1)
+
+
+def merge_pairs(npy_paths_in, npy_path_out):
+    # Sum wins of the same pairs of deck ids of every pairs file (integers only)
+    write_pairs(npy_path_out, to_pairs(*fold(map(read_pairs, npy_paths_in))))
+
+
+def read_decks(csv_path):
+    # Rows of a decks file as pairs of keys (N x 2) and wins (N x 2)
+    try:
+        rows = pd.read_csv(csv_path, header=None, dtype=np.int64).values
+    except pd.errors.EmptyDataError:
+        rows = np.empty((0, 18), dtype=np.int64)
+    return pack(rows[:, :16].reshape(-1, 2, 8)), rows[:, 16:]
+
+
+def fold(parts):
+    # Combine aggregates (pairs of keys or ids, wins) one at a time into a
+    # running aggregate: memory is bounded by the unique pairs, not by inputs
+    keys = np.empty((0, 2), dtype=np.uint64)
+    wins = np.empty((0, 2), dtype=np.int64)
+    for i, (part_keys, part_wins) in enumerate(parts):
+        if i == 0:
+            keys, wins = combine(part_keys, part_wins)
+        else:
+            keys, wins = combine(
+                np.concatenate([keys, part_keys]), np.concatenate([wins, part_wins])
+            )
+    return keys, wins
+
+
+def read_and_combine(csv_paths):
+    # Decks files combined in a single (sorted, unique) aggregate
+    return fold(map(read_decks, csv_paths))
+
+
+def merge_decks(csv_paths_in, csv_path_out, jobs=None):
+    # Merge decks files (e.g. days of a season) in one pass: every process
+    # folds a group of files, then groups are folded and written once.
+    jobs = min(jobs or os.cpu_count() or 1, len(csv_paths_in))
+    groups = [csv_paths_in[i::jobs] for i in range(jobs)]
+    if jobs > 1:
+        with ProcessPoolExecutor(jobs) as executor:
+            keys, wins = fold(executor.map(read_and_combine, groups))
+    else:
+        keys, wins = read_and_combine(csv_paths_in)
+    write_decks(csv_path_out, keys, wins)
+
+
+def is_fresh(csv_path_in, *paths_out):
+    # outputs exist and they are newer than their input
+    return all(
+        path.exists() and path.stat().st_mtime >= csv_path_in.stat().st_mtime
+        for path in paths_out
     )
 
-    # remove mirror matches and draws
-    df = df[(df[P1_DECK].values != df[P2_DECK].values).any(axis=1)]
-    df = df[df["p1_crowns"] != df["p2_crowns"]]
-
-    # numpy arrays
-    decks = df[P1_DECK + P2_DECK].values.reshape(-1, 2, 8)
-    targets = np.eye(2, 2, dtype=int)[(df["p1_crowns"] < df["p2_crowns"]).astype(int)]
-
-    # sort cards in decks
-    decks.sort()
 
-    # sort decks in battles
-    idx = np.apply_along_axis(stringify, axis=2, arr=decks).argsort(axis=1)
-    idx_decks = idx[:, :, np.newaxis]
-    idx_targets = idx[:, 0].astype(bool)
-    decks = np.take_along_axis(decks, idx_decks, axis=1).reshape(-1, 16)
-    targets[idx_targets] = (targets[idx_targets] + 1) % 2
-
-    # unique decks and total wins
-    decks, inv = np.unique(decks, axis=0, return_inverse=True)
-    wins = np.zeros((len(decks), 2), dtype=int)
-    np.add.at(wins, inv, targets)
-
-    # save to CSV
-    with open(csv_path_out, "w", newline="") as f:
-        writer = csv.writer(f)
-        for deck, win in zip(decks, wins):
-            writer.writerow([*deck, *win])
-
-
-def next_row(reader):
-    row = next(reader, None)
-    if row is None:
-        return None
-    return row, stringify(row[:16]), int(row[16]), int(row[17])
-
-
-def merge_csv_files(csv_path_in_1, csv_path_in_2, csv_path_out):
-    with (
-        open(csv_path_in_1, "r") as f1,
-        open(csv_path_in_2, "r") as f2,
-        open(csv_path_out, "w") as out,
-    ):
-        reader1 = csv.reader(f1)
-        reader2 = csv.reader(f2)
-        writer = csv.writer(out)
-
-        ROW = 0
-        DECKS = 1
-        WINS = 2
-        LOSSES = 3
-
-        # Read the first line from each file
-        row1 = next_row(reader1)
-        row2 = next_row(reader2)
-
-        while row1 and row2:
-            if row1[DECKS] == row2[DECKS]:
-                # Merge the rows and sum the values
-                merged_row = row1[ROW][:-2] + [
-                    row1[WINS] + row2[WINS],
-                    row1[LOSSES] + row2[LOSSES],
-                ]
-                writer.writerow(merged_row)
-                row1 = next_row(reader1)
-                row2 = next_row(reader2)
-            elif row1[DECKS] < row2[DECKS]:
-                writer.writerow(row1[ROW])
-                row1 = next_row(reader1)
-            else:
-                writer.writerow(row2[ROW])
-                row2 = next_row(reader2)
-
-        # Write the remaining rows from each file
-        while row1:
-            writer.writerow(row1[ROW])
-            row1 = next_row(reader1)
-
-        while row2:
-            writer.writerow(row2[ROW])
-            row2 = next_row(reader2)
+def process_day(csv_path_in, csv_path_out, max_rows=None, memory=None):
+    # process_csv_file in a worker: days larger than memory (bytes) are read in
+    # chunks. Pairs of keys and their wins are sent back to be written as pairs
+    # of deck ids (the dictionary lives in the main process).
+    chunksize = None
+    if memory is not None:
+        chunksize = max(memory // BYTES_PER_BATTLE, 1)
+    return process_csv_file(csv_path_in, csv_path_out, max_rows, chunksize=chunksize)
 
 
 def main(path_battles, path_decks, args):
-    # process battles
+    # process new or updated days in parallel, then add their decks to the
+    # dictionary of every season in the order of days (ids are reproducible)
+    # and write battles of every day as pairs of deck ids (pairs-YYYYMMDD.npy)
+    dictionary = DeckDictionary(path_decks.parent / "decks.npy")
     csv_battles = sorted(list(path_battles.glob("????????.csv")))
     assert len(csv_battles) > 0, "No battles CSV files found"
-    for csv_battle in track(
-        csv_battles,
-        disable=not args.verbose,
-        description="Processing...",
-    ):
-        csv_deck = path_decks / f"decks-{csv_battle.name}"
-        if not csv_deck.exists():
-            process_csv_file(csv_battle, csv_deck, args.max_rows)
-
-    # merge decks (slower version than merge_decks.sh)
-    if args.merge:
-        csv_decks = sorted(list(path_decks.glob("decks-????????.csv")))
-        csv_all_decks = path_decks / f"decks-{args.season}.csv"
-        assert len(csv_battles) > 0, "No decks CSV files found"
-        if csv_all_decks.exists():
-            csv_all_decks.unlink()
-        csv_all_decks.touch()
-        for csv_deck in track(
-            csv_decks,
+    todo = [
+        (csv_battle, path_decks / f"decks-{csv_battle.name}")
+        for csv_battle in csv_battles
+        if not is_fresh(
+            csv_battle,
+            path_decks / f"decks-{csv_battle.name}",
+            path_decks / f"pairs-{csv_battle.stem}.npy",
+        )
+    ]
+    memory = args.memory * 2**20 if args.memory else None
+    with ProcessPoolExecutor(args.jobs) as executor:
+        futures = [
+            executor.submit(process_day, csv_battle, csv_deck, args.max_rows, memory)
+            for csv_battle, csv_deck in todo
+        ]
+        for (csv_battle, _), future in track(
+            zip(todo, futures),
+            total=len(todo),
             disable=not args.verbose,
-            description="Merging...",
+            description="Processing...",
         ):
-            csv_all_decks_prev = path_decks / f"decks-{args.season}-prev.csv"
-            csv_all_decks = path_decks / f"decks-{args.season}.csv"
-            csv_all_decks.rename(csv_all_decks_prev)
-            merge_csv_files(csv_all_decks_prev, csv_deck, csv_all_decks)
-        csv_all_decks_prev.unlink()  # type: ignore
+            keys, wins = future.result()
+            pairs = to_pairs(dictionary.ids(keys), wins)
+            # ids are saved before any file refers to them
+            dictionary.save()
+            write_pairs(path_decks / f"pairs-{csv_battle.stem}.npy", pairs)
+
+    # merge decks (and pairs of deck ids) of every day of the season
+    if args.merge:
+        csv_decks = sorted(list(path_decks.glob("decks-????????.csv")))
+        assert len(csv_decks) > 0, "No decks CSV files found"
+        merge_decks(csv_decks, path_decks / f"decks-{args.season}.csv", args.jobs)
+        npy_pairs = sorted(list(path_decks.glob("pairs-????????.npy")))
+        merge_pairs(npy_pairs, path_decks / f"pairs-{args.season}.npy")
 
 
 if __name__ == "__main__":
@@ -181,6 +378,8 @@ if __name__ == "__main__":
     parser.add_argument("-r", "--max_rows", type=int, default=None)
     parser.add_argument("-v", "--verbose", action="store_true")
     parser.add_argument("-m", "--merge", action="store_true", default=False)
+    parser.add_argument("-j", "--jobs", type=int, default=None)
+    parser.add_argument("-M", "--memory", type=int, default=1024, help="MiB/worker")
     args = parser.parse_args()
 
     path_battles = path_db / "kaggle" / args.season
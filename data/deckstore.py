@@ -0,0 +1,363 @@
+import argparse
+import json
+import pathlib
+import shutil
+import threading
+from typing import Iterable, Union
+
+import numpy as np
+import pandas as pd
+from decks import cards, pack, read_decks, unpack
+
+"""
+# Example: how to use DeckStore
+
+store = DeckStore(pathlib.Path("../db/decks/store"))
+store.add_file(pathlib.Path("../db/decks/20231002-20231106/decks-20231106.csv"))
+
+store.get([0, 5, 12, 33, 47, 60, 88, 101])  # (wins, losses) of a deck
+store.get(deck, start="20231101", end="20231106")  # only some days (included)
+store.containing([5, 12, 33]).head(20)  # decks with these cards by games
+
+# from shell
+python deckstore.py ../db/decks/store add ../db/decks/20231002-20231106/decks-*.csv
+python deckstore.py ../db/decks/store query hog-rider fireball --start 20231101
+"""
+
+# Win/loss totals of every deck on every day are stored in sorted runs (like a
+# LSM tree): a day added is a new run of level 0 and FANOUT runs of a level are
+# compacted (in a background thread) into one run of the next level. MANIFEST
+# lists the live runs and the days they hold: it is replaced atomically, so
+# runs are never lost nor counted twice, and directories not in it are garbage.
+FANOUT = 4
+RECORD = np.dtype([("key", "<u8"), ("day", "<u4"), ("wins", "<u4"), ("losses", "<u4")])
+
+# card key (e.g. "hog-rider") -> card index
+CARDS_KEYS = {card["key"]: i for i, card in enumerate(cards)}
+
+
+class Run:
+    # Records sorted by (key, day) and an inverted index card -> rows of the
+    # decks with that card (rows[offsets[card] : offsets[card + 1]], sorted).
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.records = np.load(path / "records.npy", mmap_mode="r")
+        self.offsets = np.load(path / "offsets.npy")
+        self.rows = np.load(path / "rows.npy", mmap_mode="r")
+
+    @staticmethod
+    def write(path: pathlib.Path, records: np.ndarray) -> "Run":
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        tmp_path.mkdir(parents=True)
+        decks = unpack(records["key"]).astype(np.int64)
+        rows = np.repeat(np.arange(len(records), dtype=np.uint32), 8)
+        # a card appears once in the index of a deck (even if repeated)
+        repeated = np.zeros_like(decks, dtype=bool)
+        repeated[:, 1:] = decks[:, 1:] == decks[:, :-1]
+        decks, rows = decks.ravel()[~repeated.ravel()], rows[~repeated.ravel()]
+        order = np.argsort(decks, kind="stable")
+        offsets = np.zeros(257, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(decks, minlength=256))
+        np.save(tmp_path / "records.npy", records)
+        np.save(tmp_path / "offsets.npy", offsets)
+        np.save(tmp_path / "rows.npy", rows[order])
+        tmp_path.replace(path)
+        return Run(path)
+
+    def find(self, key: int) -> np.ndarray:
+        # records of a deck: binary search, O(log n)
+        keys = self.records["key"]
+        first = np.searchsorted(keys, np.uint64(key), side="left")
+        last = np.searchsorted(keys, np.uint64(key), side="right")
+        return self.records[first:last]
+
+    def find_range(self, low: int, high: int) -> np.ndarray:
+        # records of decks with low <= key <= high
+        keys = self.records["key"]
+        first = np.searchsorted(keys, np.uint64(low), side="left")
+        last = np.searchsorted(keys, np.uint64(high), side="right")
+        return self.records[first:last]
+
+    def containing(self, cards: list[int]) -> np.ndarray:
+        # records of decks with every card: intersection of the rows of every
+        # card, from the rarest (cost of the shortest lists, not of the run).
+        # Every record without cards.
+        if not len(cards):
+            return self.records
+        lists = sorted(
+            (self.rows[self.offsets[c] : self.offsets[c + 1]] for c in cards), key=len
+        )
+        rows = np.asarray(lists[0])
+        for other in lists[1:]:
+            rows = rows[np.isin(rows, other, assume_unique=True)]
+        return self.records[np.sort(rows)]
+
+
+def concatenate(parts: Iterable[np.ndarray]) -> np.ndarray:
+    return np.concatenate([np.empty(0, dtype=RECORD), *parts])
+
+
+def merge_records(runs: Iterable[np.ndarray]) -> np.ndarray:
+    # Records of several runs sorted by (key, day), summing equal (key, day)
+    records = concatenate(runs)
+    records = records[np.lexsort((records["day"], records["key"]))]
+    if not len(records):
+        return records
+    new = np.ones(len(records), dtype=bool)
+    new[1:] = (records["key"][1:] != records["key"][:-1]) | (
+        records["day"][1:] != records["day"][:-1]
+    )
+    starts = np.flatnonzero(new)
+    merged = records[new].copy()
+    merged["wins"] = np.add.reduceat(records["wins"], starts)
+    merged["losses"] = np.add.reduceat(records["losses"], starts)
+    return merged
+
+
+def day_records(day: str, keys: np.ndarray, wins: np.ndarray) -> np.ndarray:
+    # Pairs of decks of a day (N x 2 keys, N x 2 wins, see decks.py) to the wins
+    # and losses of every deck of that day
+    decks = keys.ravel()
+    won = wins.ravel()
+    lost = wins[:, ::-1].ravel()
+    uniques, inverse = np.unique(decks, return_inverse=True)
+    records = np.empty(len(uniques), dtype=RECORD)
+    records["key"] = uniques
+    records["day"] = int(day)
+    records["wins"] = np.bincount(inverse, weights=won, minlength=len(uniques))
+    records["losses"] = np.bincount(inverse, weights=lost, minlength=len(uniques))
+    return records
+
+
+def in_days(
+    records: np.ndarray, start: Union[str, None], end: Union[str, None]
+) -> np.ndarray:
+    if start is not None:
+        records = records[records["day"] >= int(start)]
+    if end is not None:
+        records = records[records["day"] <= int(end)]
+    return records
+
+
+class DeckStore:
+    def __init__(self, path: pathlib.Path) -> None:
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.lock = threading.Lock()
+        self.compaction = None
+        self.compacting = False
+        # error of the last compaction, raised by compact(wait=True) and close()
+        self.error = None
+        # runs merged by compaction: still used by queries started before the
+        # manifest changed, they are deleted by close() (files of memory mapped
+        # runs can not be removed on Windows). Runs left by a crash are not in
+        # the manifest and are deleted when the store is opened.
+        self.obsolete = []
+        manifest = path / "MANIFEST"
+        if manifest.exists():
+            state = json.loads(manifest.read_text())
+        else:
+            state = {"runs": {}, "next_run": 0}
+        # run name -> days in the run
+        self.runs = {name: Run(path / name) for name in state["runs"]}
+        self.days = state["runs"]
+        self.next_run = state["next_run"]
+        for garbage in path.iterdir():
+            if garbage.is_dir() and garbage.name not in self.runs:
+                shutil.rmtree(garbage)
+
+    def _save_manifest(self) -> None:
+        state = {"runs": self.days, "next_run": self.next_run}
+        tmp_path = self.path / ".MANIFEST.tmp"
+        tmp_path.write_text(json.dumps(state, indent=1))
+        tmp_path.replace(self.path / "MANIFEST")
+
+    def _run_name(self, level: int) -> str:
+        # called with the lock held (runs are written without it)
+        name = f"L{level}-{self.next_run:06d}"
+        self.next_run += 1
+        return name
+
+    def loaded_days(self) -> set[str]:
+        with self.lock:
+            return {day for days in self.days.values() for day in days}
+
+    def add(self, day: str, keys: np.ndarray, wins: np.ndarray) -> None:
+        # Add a day of pairs of decks (e.g. read_decks of decks-YYYYMMDD.csv)
+        assert day not in self.loaded_days(), f"{day} is already in {self.path}"
+        records = day_records(day, keys, wins)
+        with self.lock:
+            name = self._run_name(0)
+        run = Run.write(self.path / name, records)
+        with self.lock:
+            self.runs[name] = run
+            self.days[name] = [day]
+            self._save_manifest()
+        self.compact(wait=False)
+
+    def add_file(self, path: pathlib.Path) -> bool:
+        # Add decks-YYYYMMDD.csv unless its day is already in the store
+        day = path.stem.split("-")[-1]
+        if day in self.loaded_days():
+            return False
+        self.add(day, *read_decks(path))
+        return True
+
+    def _full_level(self) -> Union[list[str], None]:
+        levels = {}
+        for name in sorted(self.runs):
+            levels.setdefault(int(name[1 : name.index("-")]), []).append(name)
+        for level in sorted(levels):
+            if len(levels[level]) >= FANOUT:
+                return levels[level][:FANOUT]
+        return None
+
+    def _compact(self) -> None:
+        # Merge FANOUT runs of a level in a run of the next level, until no
+        # level is full. Queries keep using old runs until the manifest changes.
+        # On error (e.g. disk full) compaction stops and the error is kept for
+        # the caller: a later compact() starts again from the manifest.
+        try:
+            while True:
+                with self.lock:
+                    names = self._full_level()
+                    if names is None:
+                        self.compacting = False
+                        return
+                    runs = [self.runs[name] for name in names]
+                records = merge_records(run.records for run in runs)
+                level = int(names[0][1 : names[0].index("-")]) + 1
+                with self.lock:
+                    name = self._run_name(level)
+                run = Run.write(self.path / name, records)
+                with self.lock:
+                    self.runs[name] = run
+                    self.days[name] = sorted(d for n in names for d in self.days[n])
+                    for old in names:
+                        del self.runs[old]
+                        del self.days[old]
+                    self._save_manifest()
+                    self.obsolete.extend(names)
+        except BaseException as exc:
+            with self.lock:
+                self.error = exc
+                self.compacting = False
+
+    def _raise_error(self) -> None:
+        with self.lock:
+            error, self.error = self.error, None
+        if error is not None:
+            raise error
+
+    def compact(self, wait: bool = True) -> None:
+        # Start compaction in background (if not running) or wait for it. A
+        # running compaction checks levels again (with the lock) before ending.
+        with self.lock:
+            if not self.compacting:
+                self.compacting = True
+                self.compaction = threading.Thread(target=self._compact, daemon=True)
+                self.compaction.start()
+        if wait:
+            self.compaction.join()
+            self._raise_error()
+
+    def close(self) -> None:
+        if self.compaction is not None:
+            self.compaction.join()
+        with self.lock:
+            obsolete, self.obsolete = self.obsolete, []
+        for name in obsolete:
+            shutil.rmtree(self.path / name)
+        self._raise_error()
+
+    def _runs(self) -> list[Run]:
+        with self.lock:
+            return list(self.runs.values())
+
+    def get(
+        self,
+        deck: Union[list[int], int],
+        start: Union[str, None] = None,
+        end: Union[str, None] = None,
+    ) -> tuple[int, int]:
+        # Wins and losses of a deck (8 card indices or key) from start to end
+        key = deck if isinstance(deck, (int, np.integer)) else int(pack(sorted(deck)))
+        records = in_days(concatenate(r.find(key) for r in self._runs()), start, end)
+        return int(records["wins"].sum()), int(records["losses"].sum())
+
+    def _totals(self, records: np.ndarray) -> pd.DataFrame:
+        keys, inverse = np.unique(records["key"], return_inverse=True)
+        wins = np.bincount(inverse, weights=records["wins"], minlength=len(keys))
+        losses = np.bincount(inverse, weights=records["losses"], minlength=len(keys))
+        totals = pd.DataFrame(
+            {"key": keys, "wins": wins.astype(int), "losses": losses.astype(int)}
+        )
+        totals["games"] = totals["wins"] + totals["losses"]
+        return totals.sort_values("games", ascending=False, ignore_index=True)
+
+    def prefix(
+        self,
+        cards: list[int],
+        start: Union[str, None] = None,
+        end: Union[str, None] = None,
+    ):
+        # Decks whose lowest card indices are cards (a range of keys), by games
+        cards = sorted(cards)
+        shift = 8 * (8 - len(cards))
+        low = int(pack(cards + [0] * (8 - len(cards))))
+        high = low | ((1 << shift) - 1)
+        records = concatenate(r.find_range(low, high) for r in self._runs())
+        return self._totals(in_days(records, start, end))
+
+    def containing(
+        self,
+        cards: list[int],
+        start: Union[str, None] = None,
+        end: Union[str, None] = None,
+    ):
+        # Decks with every card of cards (and any other card), by games
+        records = concatenate(r.containing(cards) for r in self._runs())
+        return self._totals(in_days(records, start, end))
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Store of win/loss totals of decks by day.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("store", type=pathlib.Path, help="Store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    add = commands.add_parser("add", help="Add days (decks-YYYYMMDD.csv of decks.py)")
+    add.add_argument("inputs", type=pathlib.Path, nargs="+")
+    commands.add_parser("compact", help="Compact runs of full levels")
+    query = commands.add_parser("query", help="Decks containing cards by games")
+    query.add_argument(
+        "cards", type=str, nargs="*", help="Card keys (e.g. hog-rider, none: any deck)"
+    )
+    query.add_argument("-s", "--start", type=str, default=None, help="YYYYMMDD")
+    query.add_argument("-e", "--end", type=str, default=None, help="YYYYMMDD")
+    query.add_argument("-n", "--top", type=int, default=20, help="Decks printed")
+    args = parser.parse_args()
+
+    store = DeckStore(args.store)
+    if args.command == "add":
+        for path in args.inputs:
+            status = "added" if store.add_file(path) else "skipped"
+            print(f"{status} '{path}'")
+    elif args.command == "compact":
+        store.compact()
+    else:
+        query = [CARDS_KEYS[card] for card in args.cards]
+        totals = store.containing(query, args.start, args.end)
+        for row in totals.head(args.top).itertuples():
+            deck = ", ".join(cards[i]["key"] for i in unpack(row.key))
+            print(f"{row.games:8d} {row.wins / row.games:6.1%}  {deck}")
+    store.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,122 @@
+import fcntl
+import hashlib
+import math
+import pathlib
+from datetime import datetime, timedelta, timezone
+from typing import Union
+
+"""
+# Example: how to use BattlesFilter
+
+battles_saved = BattlesFilter(pathlib.Path("../db/dedup"), days=7)
+for battle in battles:
+    fp = fingerprint(battle)
+    if not battles_saved.check_and_add(battle[0], fp):
+        ...  # battle is new (up to false positive rate), save it
+battles_saved.save()
+"""
+
+
+def fingerprint(battle: tuple) -> int:
+    # Stable across runs and processes (unlike hash): 64-bit digest of the csv row
+    row = ",".join(map(str, battle)).encode()
+    return int.from_bytes(hashlib.blake2b(row, digest_size=8).digest(), "little")
+
+
+class BloomFilter:
+    def __init__(self, capacity: int, error_rate: float) -> None:
+        # optimal number of bits and of hash functions
+        self.m = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.m = (self.m + 7) // 8 * 8
+        self.k = max(1, round(self.m / capacity * math.log(2)))
+        self.bits = bytearray(self.m // 8)
+
+    def _indexes(self, fp: int):
+        # double hashing: derive k indexes from the two halves of fingerprint
+        h1, h2 = fp & 0xFFFFFFFF, (fp >> 32) | 1
+        return ((h1 + i * h2) % self.m for i in range(self.k))
+
+    def __contains__(self, fp: int) -> bool:
+        bits = self.bits
+        return all(bits[i >> 3] & (1 << (i & 7)) for i in self._indexes(fp))
+
+    def add(self, fp: int) -> None:
+        bits = self.bits
+        for i in self._indexes(fp):
+            bits[i >> 3] |= 1 << (i & 7)
+
+    def update(self, other: bytes) -> None:
+        # union with the bits of another filter (ignored if size differs, e.g.
+        # saved with another capacity)
+        if len(other) != len(self.bits):
+            return
+        merged = int.from_bytes(self.bits, "little") | int.from_bytes(other, "little")
+        self.bits = bytearray(merged.to_bytes(len(self.bits), "little"))
+
+
+class BattlesFilter:
+    # One Bloom filter per battle day. A battle is looked up only in the filter
+    # of its day, and filters older than `days` are deleted, so the size is
+    # bounded. Filters are persisted in `path` (if not None) as DAY.bloom files.
+
+    def __init__(
+        self,
+        path: Union[pathlib.Path, None],
+        days: int = 7,
+        capacity: int = 2_000_000,
+        error_rate: float = 0.001,
+    ) -> None:
+        self.path = path
+        self.days = days
+        self.capacity = capacity
+        self.error_rate = error_rate
+        self.filters = {}
+        self.duplicates_counter = 0
+        if self.path is not None:
+            self.path.mkdir(parents=True, exist_ok=True)
+            self._rotate()
+
+    def _rotate(self) -> None:
+        oldest = datetime.now(timezone.utc) - timedelta(days=self.days)
+        oldest = oldest.strftime("%Y%m%d")
+        # a long running collector keeps in memory the last days only
+        for day in [day for day in self.filters if day < oldest]:
+            del self.filters[day]
+        if self.path is None:
+            return
+        for bloom_path in self.path.glob("????????.bloom"):
+            if bloom_path.stem < oldest:
+                bloom_path.unlink()
+
+    def _filter(self, day: str) -> BloomFilter:
+        if day not in self.filters:
+            bloom = BloomFilter(self.capacity, self.error_rate)
+            if self.path is not None and (self.path / f"{day}.bloom").exists():
+                bloom.update((self.path / f"{day}.bloom").read_bytes())
+            self.filters[day] = bloom
+        return self.filters[day]
+
+    def check_and_add(self, battle_time: str, fp: int) -> bool:
+        # True if the battle was (probably) already seen
+        bloom = self._filter(battle_time[:8])
+        if fp in bloom:
+            self.duplicates_counter += 1
+            return True
+        bloom.add(fp)
+        return False
+
+    def save(self) -> None:
+        self._rotate()
+        if self.path is None:
+            return
+        # Other collectors (e.g. shards) may have saved the same day in the
+        # meanwhile: merge filters under a lock instead of overwriting them.
+        with open(self.path / ".lock", "w") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            for day, bloom in self.filters.items():
+                bloom_path = self.path / f"{day}.bloom"
+                if bloom_path.exists():
+                    bloom.update(bloom_path.read_bytes())
+                tmp_path = bloom_path.with_suffix(".tmp")
+                tmp_path.write_bytes(bloom.bits)
+                tmp_path.replace(bloom_path)
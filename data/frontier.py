@@ -0,0 +1,466 @@
+import calendar
+import gzip
+import pathlib
+from array import array
+from collections import namedtuple
+from typing import Iterator, Union
+
+import orjson
+
+"""
+# Example: how to use the frontier containers
+
+queue = PlayersQueue()
+queue[encode_tag("G9YV9GR8R")] = Priority(0, 0, 0, 0)
+tag, priority = queue.popitem()  # player with the lowest priority
+decode_tag(tag)  # "G9YV9GR8R"
+
+requested = TagSet()
+requested.add(tag)
+tag in requested  # True
+"""
+
+# Tags are made of these characters only, so a tag can be stored as an integer
+# in base 15 (0 is never used as a digit, hence 0 is not a valid tag).
+ALPHABET = "0289PYLQGRJCUV"
+BASE = len(ALPHABET) + 1
+DIGITS = {c: i + 1 for i, c in enumerate(ALPHABET)}
+
+# Battle times are stored as seconds since epoch (0 means no battle).
+# Priority fields are compared in order: the lower the better.
+Priority = namedtuple(
+    "Priority",
+    ("ranked_trophies", "ladder_trophies", "last_ranked_battle", "last_ladder_battle"),
+    defaults=[0, 0, 0, 0],
+)
+
+EMPTY = 0
+MASK64 = (1 << 64) - 1
+FIBONACCI = 0x9E3779B97F4A7C15
+
+
+def encode_tag(tag: str) -> int:
+    n = 0
+    for c in tag:
+        n = n * BASE + DIGITS[c]
+    return n
+
+
+def decode_tag(n: int) -> str:
+    chars = []
+    while n:
+        n, d = divmod(n, BASE)
+        chars.append(ALPHABET[d - 1])
+    return "".join(reversed(chars))
+
+
+def to_epoch(battle_time: str) -> int:
+    # battle_time is formatted as 20221107T123456.000Z
+    return calendar.timegm(
+        (
+            int(battle_time[0:4]),
+            int(battle_time[4:6]),
+            int(battle_time[6:8]),
+            int(battle_time[9:11]),
+            int(battle_time[11:13]),
+            int(battle_time[13:15]),
+        )
+    )
+
+
+class _TagTable:
+    # Open addressing hash table (linear probing) of uint64 tags. Deletion
+    # shifts back the following entries, so no tombstone is needed.
+
+    def __init__(self, capacity: int = 1024) -> None:
+        self._init(capacity)
+
+    def _init(self, capacity: int) -> None:
+        self._bits = max(capacity - 1, 1).bit_length()
+        self._shift = 64 - self._bits
+        self._mask = (1 << self._bits) - 1
+        self._keys = array("Q", bytes(8 << self._bits))
+        self._len = 0
+
+    def __len__(self) -> int:
+        return self._len
+
+    def _home(self, key: int) -> int:
+        return ((key * FIBONACCI) & MASK64) >> self._shift
+
+    def _find(self, key: int) -> int:
+        # slot containing key or the empty slot where it should be inserted
+        keys, mask = self._keys, self._mask
+        i = ((key * FIBONACCI) & MASK64) >> self._shift
+        k = keys[i]
+        while k != EMPTY and k != key:
+            i = (i + 1) & mask
+            k = keys[i]
+        return i
+
+    def _insert(self, key: int, i: int) -> int:
+        # insert key missing from the table, i is the slot returned by _find
+        if 2 * (self._len + 1) > len(self._keys):
+            self._grow()
+            i = self._find(key)
+        self._keys[i] = key
+        self._len += 1
+        return i
+
+    def _delete(self, i: int) -> None:
+        keys, mask = self._keys, self._mask
+        keys[i] = EMPTY
+        self._len -= 1
+        j = i
+        while True:
+            j = (j + 1) & mask
+            if keys[j] == EMPTY:
+                return
+            home = self._home(keys[j])
+            # move keys[j] into the hole if its home slot is not in (i, j]
+            if (j > i and (home <= i or home > j)) or (j < i and i >= home > j):
+                keys[i] = keys[j]
+                self._move(j, i)
+                keys[j] = EMPTY
+                i = j
+
+    def _move(self, src: int, dst: int) -> None:
+        pass
+
+    def _grow(self) -> None:
+        raise NotImplementedError
+
+    def _slots(self) -> Iterator[int]:
+        keys = self._keys
+        return (i for i in range(len(keys)) if keys[i] != EMPTY)
+
+
+class TagSet(_TagTable):
+    def __contains__(self, tag: int) -> bool:
+        return self._keys[self._find(tag)] == tag
+
+    def __iter__(self) -> Iterator[int]:
+        keys = self._keys
+        return (keys[i] for i in self._slots())
+
+    def add(self, tag: int) -> None:
+        i = self._find(tag)
+        if self._keys[i] != tag:
+            self._insert(tag, i)
+
+    def update(self, tags) -> None:
+        for tag in tags:
+            self.add(tag)
+
+    def discard(self, tag: int) -> None:
+        i = self._find(tag)
+        if self._keys[i] == tag:
+            self._delete(i)
+
+    def _grow(self) -> None:
+        keys = self._keys
+        self._init(2 * len(keys))
+        for key in keys:
+            if key != EMPTY:
+                self._keys[self._find(key)] = key
+                self._len += 1
+
+    def to_array(self) -> array:
+        return array("Q", iter(self))
+
+
+class PlayersQueue(_TagTable):
+    # Priority queue of players with the same interface of heapdict. Each
+    # player is a record (tag, score, priority) stored in arrays: the binary
+    # heap holds record ids and the hash table maps tags to record ids. Records
+    # are ordered by score first and by priority fields then (score is 0 when
+    # set through __setitem__).
+
+    def __init__(self, capacity: int = 1024) -> None:
+        super().__init__(capacity)
+        self._records = array("I", bytes(4 << self._bits))  # slot -> record
+        self._tags = array("Q")  # record -> tag
+        self._score = array("I")  # record -> score
+        self._hi = array("I")  # record -> ranked_trophies, ladder_trophies
+        self._lo = array("Q")  # record -> last_ranked_battle, last_ladder_battle
+        self._pos = array("I")  # record -> position in heap
+        self._free = array("I")  # unused records
+        self._heap = array("I")  # heap of records
+
+    def _move(self, src: int, dst: int) -> None:
+        self._records[dst] = self._records[src]
+
+    def _grow(self) -> None:
+        keys, records = self._keys, self._records
+        self._init(2 * len(keys))
+        self._records = array("I", bytes(4 << self._bits))
+        for key, record in zip(keys, records):
+            if key != EMPTY:
+                i = self._find(key)
+                self._keys[i] = key
+                self._records[i] = record
+                self._len += 1
+
+    @staticmethod
+    def _pack(priority: Priority) -> tuple[int, int]:
+        ranked, ladder, last_ranked, last_ladder = priority
+        hi = (min(ranked, 0xFFFF) << 16) | min(ladder, 0xFFFF)
+        lo = (last_ranked << 32) | last_ladder
+        return hi, lo
+
+    @staticmethod
+    def _unpack(hi: int, lo: int) -> Priority:
+        return Priority(hi >> 16, hi & 0xFFFF, lo >> 32, lo & 0xFFFFFFFF)
+
+    def _priority(self, record: int) -> Priority:
+        return self._unpack(self._hi[record], self._lo[record])
+
+    def _less(self, r1: int, r2: int) -> bool:
+        s1, s2 = self._score[r1], self._score[r2]
+        if s1 != s2:
+            return s1 < s2
+        hi1, hi2 = self._hi[r1], self._hi[r2]
+        return hi1 < hi2 or (hi1 == hi2 and self._lo[r1] < self._lo[r2])
+
+    def _sift_up(self, i: int) -> None:
+        heap, pos = self._heap, self._pos
+        record = heap[i]
+        while i > 0:
+            parent = (i - 1) >> 1
+            if not self._less(record, heap[parent]):
+                break
+            heap[i] = heap[parent]
+            pos[heap[i]] = i
+            i = parent
+        heap[i] = record
+        pos[record] = i
+
+    def _sift_down(self, i: int) -> None:
+        heap, pos = self._heap, self._pos
+        n = len(heap)
+        record = heap[i]
+        while True:
+            child = 2 * i + 1
+            if child >= n:
+                break
+            if child + 1 < n and self._less(heap[child + 1], heap[child]):
+                child += 1
+            if not self._less(heap[child], record):
+                break
+            heap[i] = heap[child]
+            pos[heap[i]] = i
+            i = child
+        heap[i] = record
+        pos[record] = i
+
+    def __contains__(self, tag: int) -> bool:
+        return self._keys[self._find(tag)] == tag
+
+    def __getitem__(self, tag: int) -> Priority:
+        i = self._find(tag)
+        if self._keys[i] != tag:
+            raise KeyError(tag)
+        return self._priority(self._records[i])
+
+    def get(self, tag: int, default=None) -> Union[Priority, None]:
+        i = self._find(tag)
+        if self._keys[i] != tag:
+            return default
+        return self._priority(self._records[i])
+
+    def __setitem__(self, tag: int, priority: Priority) -> None:
+        self.push(tag, priority)
+
+    def push(self, tag: int, priority: Priority, score: int = 0) -> None:
+        hi, lo = self._pack(priority)
+        score = min(score, 0xFFFFFFFF)
+        i = self._find(tag)
+        if self._keys[i] == tag:
+            record = self._records[i]
+            self._score[record], self._hi[record], self._lo[record] = score, hi, lo
+            self._sift_up(self._pos[record])
+            self._sift_down(self._pos[record])
+            return
+
+        if self._free:
+            record = self._free.pop()
+            self._tags[record], self._score[record] = tag, score
+            self._hi[record], self._lo[record] = hi, lo
+        else:
+            record = len(self._tags)
+            self._tags.append(tag)
+            self._score.append(score)
+            self._hi.append(hi)
+            self._lo.append(lo)
+            self._pos.append(0)
+        # _insert may grow the table (and replace _records)
+        i = self._insert(tag, i)
+        self._records[i] = record
+        self._heap.append(record)
+        self._sift_up(len(self._heap) - 1)
+
+    def peek_score(self) -> int:
+        return self._score[self._heap[0]]
+
+    def popitem(self) -> tuple[int, Priority]:
+        if not self._heap:
+            raise KeyError("popitem(): queue is empty")
+        heap = self._heap
+        record = heap[0]
+        last = heap.pop()
+        if heap:
+            heap[0] = last
+            self._sift_down(0)
+        tag = self._tags[record]
+        self._delete(self._find(tag))
+        self._free.append(record)
+        return tag, self._priority(record)
+
+    def items(self) -> Iterator[tuple[int, Priority]]:
+        return ((self._tags[r], self._priority(r)) for r in self._heap)
+
+    def scored_items(self) -> Iterator[tuple[int, Priority, int]]:
+        return ((self._tags[r], self._priority(r), self._score[r]) for r in self._heap)
+
+    def __iter__(self) -> Iterator[int]:
+        return (self._tags[r] for r in self._heap)
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+
+class PlayersStats(_TagTable):
+    # For every requested player: time of the newest battle in its battlelog,
+    # time of the request and estimated number of battles played per second.
+
+    def __init__(self, capacity: int = 1024) -> None:
+        super().__init__(capacity)
+        self._newest = array("I", bytes(4 << self._bits))
+        self._fetched = array("I", bytes(4 << self._bits))
+        self._rate = array("f", bytes(4 << self._bits))
+
+    def _move(self, src: int, dst: int) -> None:
+        self._newest[dst] = self._newest[src]
+        self._fetched[dst] = self._fetched[src]
+        self._rate[dst] = self._rate[src]
+
+    def _grow(self) -> None:
+        keys, newest, fetched, rate = (
+            self._keys,
+            self._newest,
+            self._fetched,
+            self._rate,
+        )
+        self._init(2 * len(keys))
+        self._newest = array("I", bytes(4 << self._bits))
+        self._fetched = array("I", bytes(4 << self._bits))
+        self._rate = array("f", bytes(4 << self._bits))
+        for i in range(len(keys)):
+            if keys[i] != EMPTY:
+                self[keys[i]] = newest[i], fetched[i], rate[i]
+
+    def __contains__(self, tag: int) -> bool:
+        return self._keys[self._find(tag)] == tag
+
+    def get(self, tag: int, default=None) -> Union[tuple[int, int, float], None]:
+        i = self._find(tag)
+        if self._keys[i] != tag:
+            return default
+        return self._newest[i], self._fetched[i], self._rate[i]
+
+    def __getitem__(self, tag: int) -> tuple[int, int, float]:
+        stats = self.get(tag)
+        if stats is None:
+            raise KeyError(tag)
+        return stats
+
+    def __setitem__(self, tag: int, stats: tuple[int, int, float]) -> None:
+        i = self._find(tag)
+        if self._keys[i] != tag:
+            i = self._insert(tag, i)
+        self._newest[i], self._fetched[i], self._rate[i] = stats
+
+    def items(self) -> Iterator[tuple[int, tuple[int, int, float]]]:
+        return (
+            (self._keys[i], (self._newest[i], self._fetched[i], self._rate[i]))
+            for i in self._slots()
+        )
+
+
+# PERSISTENCE -------------------------------------------------------------------------
+
+Frontier = namedtuple(
+    "Frontier",
+    ("queue", "requested", "revisits", "stats", "saved_at"),
+)
+
+
+def _dump_queue(f, records: list[tuple[int, Priority, int]]) -> int:
+    tags, score, hi, lo = array("Q"), array("I"), array("I"), array("Q")
+    for tag, priority, s in records:
+        h, lo_ = PlayersQueue._pack(priority)
+        tags.append(tag)
+        score.append(s)
+        hi.append(h)
+        lo.append(lo_)
+    for a in (tags, score, hi, lo):
+        f.write(a.tobytes())
+    return len(tags)
+
+
+def _load_queue(f, n: int) -> PlayersQueue:
+    tags, score, hi, lo = array("Q"), array("I"), array("I"), array("Q")
+    for a in (tags, score, hi, lo):
+        a.frombytes(f.read(n * a.itemsize))
+    queue = PlayersQueue(2 * n)
+    for tag, s, h, lo_ in zip(tags, score, hi, lo):
+        queue.push(tag, PlayersQueue._unpack(h, lo_), s)
+    return queue
+
+
+def save_frontier(
+    path: pathlib.Path,
+    frontier: Frontier,
+    pending: list[tuple[int, Priority]] = [],
+) -> None:
+    # Write to a temporary file first: a crash while saving must not corrupt
+    # the previous checkpoint. Arrays are written after a json header that
+    # stores their sizes.
+    queue = [*frontier.queue.scored_items(), *((t, p, 0) for t, p in pending)]
+    stats = list(frontier.stats.items())
+    header = {
+        "saved_at": frontier.saved_at,
+        "queue": len(queue),
+        "requested": len(frontier.requested),
+        "revisits": len(frontier.revisits),
+        "stats": len(stats),
+    }
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with gzip.open(tmp_path, "wb", compresslevel=5) as f:
+        f.write(orjson.dumps(header) + b"\n")
+        _dump_queue(f, queue)
+        f.write(frontier.requested.to_array().tobytes())
+        _dump_queue(f, list(frontier.revisits.scored_items()))
+        f.write(array("Q", (tag for tag, _ in stats)).tobytes())
+        f.write(array("I", (newest for _, (newest, _, _) in stats)).tobytes())
+        f.write(array("I", (fetched for _, (_, fetched, _) in stats)).tobytes())
+        f.write(array("f", (rate for _, (_, _, rate) in stats)).tobytes())
+    tmp_path.replace(path)
+
+
+def load_frontier(path: pathlib.Path) -> Frontier:
+    with gzip.open(path, "rb") as f:
+        header = orjson.loads(f.readline())
+        queue = _load_queue(f, header["queue"])
+        requested = TagSet(2 * header["requested"])
+        requested.update(array("Q", f.read(8 * header["requested"])))
+        revisits = _load_queue(f, header["revisits"])
+        n = header["stats"]
+        tags = array("Q", f.read(8 * n))
+        newest = array("I", f.read(4 * n))
+        fetched = array("I", f.read(4 * n))
+        rate = array("f", f.read(4 * n))
+    stats = PlayersStats(2 * n)
+    for tag, t, t_fetched, r in zip(tags, newest, fetched, rate):
+        stats[tag] = t, t_fetched, r
+    return Frontier(queue, requested, revisits, stats, header["saved_at"])
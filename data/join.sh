@@ -16,14 +16,8 @@ fi
 input_files=$(find "../db/hours" -type f -name "$yesterday*.csv.gz")
 output_file="../db/days/$yesterday.csv.gz"
 
-# create a command for merge yesterday file.
-cmd="sort --merge --unique"
-for input in $input_files; do
-  cmd="$cmd <(gunzip -c '$input')"
-done
-
-# execute command and save result in output_file.
-eval "$cmd" | gzip -c > "$output_file"
+# merge yesterday files (sorted) without duplicated battles.
+python merge.py $input_files --output "$output_file"
 
 # remove hours csv file keeping only days csv.
-[[ -s "$output_file" ]] && rm $input_files
+[[ -s "$output_file" ]] && rm $input_files && rm -f ${input_files//.csv.gz/.csv.gz.idx}
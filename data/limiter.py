@@ -0,0 +1,155 @@
+import asyncio
+import time
+from collections import deque
+from typing import Union
+
+"""
+# Example: how to use RateLimiter
+
+limiter = RateLimiter(rate=10, window=10)
+
+async def request(session, url):
+    await limiter.acquire()
+    start = time.perf_counter()
+    async with session.get(url) as resp:
+        if resp.status == 429:
+            limiter.on_throttle()
+        else:
+            limiter.on_success(time.perf_counter() - start)
+"""
+
+
+# Latency baseline: LATENCY_PERCENTILE of the last LATENCY_SAMPLES latencies (the
+# median is not moved by jitter and outliers, unlike the minimum or the mean)
+LATENCY_SAMPLES = 200
+LATENCY_PERCENTILE = 0.5
+
+
+class RateLimiter:
+    def __init__(
+        self,
+        rate: float = 10.0,
+        window: int = 10,
+        min_rate: float = 1.0,
+        max_rate: float = 100.0,
+        min_window: int = 1,
+        max_window: int = 100,
+        rate_step: float = 0.5,
+        decrease: float = 0.5,
+        latency_factor: float = 3.0,
+        cooldown: float = 5.0,
+    ) -> None:
+        # Token bucket: requests are allowed at `rate` req/s with bursts of at
+        # most `window` requests.
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.tokens = 1.0
+        self.last_refill = time.monotonic()
+
+        # In-flight window: additive increase of one request per window of
+        # successful requests, multiplicative decrease on congestion.
+        self._window = float(window)
+        self.min_window = min_window
+        self.max_window = max_window
+
+        self.rate_step = rate_step
+        self.decrease = decrease
+        self.latency_factor = latency_factor
+        self.cooldown = cooldown
+        self.paused_until = 0.0
+        self.last_decrease = float("-inf")
+
+        # Latency baseline (percentile of the last samples: robust to jitter,
+        # old values are forgotten) and exponential moving average
+        self.latencies = deque(maxlen=LATENCY_SAMPLES)
+        self.latency_base: Union[float, None] = None
+        self.latency_avg: Union[float, None] = None
+
+        # Stats
+        self.started = time.monotonic()
+        self.successes = deque()
+        self.requests_counter = 0
+        self.throttled_counter = 0
+        self._lock = None
+
+    @property
+    def window(self) -> int:
+        return int(self._window)
+
+    @property
+    def rate_effective(self) -> float:
+        # successful req/s over the last minute
+        now = time.monotonic()
+        while self.successes and self.successes[0] < now - 60:
+            self.successes.popleft()
+        elapsed = min(60.0, now - self.started)
+        return len(self.successes) / elapsed if elapsed > 0 else 0.0
+
+    def _refill(self, now: float) -> None:
+        self.tokens = min(
+            float(self.window), self.tokens + (now - self.last_refill) * self.rate
+        )
+        self.last_refill = now
+
+    async def acquire(self) -> None:
+        # The lock is created lazily so that it belongs to the running loop.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self._refill(now)
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    self.requests_counter += 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def _multiplicative_decrease(self, now: float) -> bool:
+        # Requests already in flight when congestion is detected report it as
+        # well: decrease at most once per cooldown.
+        if now - self.last_decrease < self.cooldown:
+            return False
+        self.last_decrease = now
+        self._window = max(self.min_window, self._window * self.decrease)
+        return True
+
+    def on_success(self, latency: float) -> None:
+        now = time.monotonic()
+        self.successes.append(now)
+
+        self.latencies.append(latency)
+        latencies = sorted(self.latencies)
+        self.latency_base = latencies[int(LATENCY_PERCENTILE * (len(latencies) - 1))]
+        if self.latency_avg is None:
+            self.latency_avg = latency
+        else:
+            self.latency_avg = 0.9 * self.latency_avg + 0.1 * latency
+
+        if self.latency_avg > self.latency_factor * self.latency_base:
+            # Latency grows before the api starts to throttle: back off the
+            # window but keep the rate (at most once per cooldown, as for 429,
+            # and without increasing it meanwhile).
+            self._multiplicative_decrease(now)
+        else:
+            self._window = min(self.max_window, self._window + 1 / self._window)
+            self.rate = min(self.max_rate, self.rate + self.rate_step / self.rate)
+
+    def pause(self, seconds: float) -> None:
+        # e.g. api in maintenance: no request is allowed for a while
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0.0
+
+    def on_throttle(self) -> None:
+        now = time.monotonic()
+        self.throttled_counter += 1
+        if self._multiplicative_decrease(now):
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            # Pause every request (not only the throttled one) and empty the
+            # bucket to avoid a burst when the pause ends.
+            self.paused_until = now + self.cooldown
+            self.tokens = 0.0
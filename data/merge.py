@@ -0,0 +1,229 @@
+import argparse
+import gzip
+import heapq
+import pathlib
+import queue
+import threading
+from datetime import datetime, timedelta
+from typing import Iterator, Union
+
+from blocks import BlockWriter
+
+"""
+# Example: how to use merge
+
+# join hours of a day in a single file (like join.sh)
+hours = sorted(pathlib.Path("db/hours").glob("20231106*.csv.gz"))
+merge(hours, pathlib.Path("db/days/20231106.csv.gz"))
+
+# split battles of a season by battle day (like season.sh)
+merge_by_day(days, pathlib.Path("db/20231002-20231106"), "20231002", "20231106")
+"""
+
+# Every input is decompressed by its own thread (zlib releases the GIL) in
+# chunks of about CHUNK_SIZE bytes. At most QUEUE_SIZE chunks per input wait to
+# be merged, so memory is bounded by the number of inputs.
+CHUNK_SIZE = 1 << 18
+QUEUE_SIZE = 2
+
+
+def _read(path: pathlib.Path, chunks: queue.Queue) -> None:
+    # chunks of lines, then None (end of file) or the error of the reader
+    try:
+        with gzip.open(path, "rb") as f:
+            while lines := f.readlines(CHUNK_SIZE):
+                chunks.put(lines)
+    except BaseException as exc:
+        chunks.put(exc)
+    else:
+        chunks.put(None)
+
+
+def read_lines(path: pathlib.Path) -> Iterator[bytes]:
+    # Lines of a .csv.gz decompressed in a background thread. Errors (e.g. a
+    # truncated file) are raised here: a partial input is never a normal end.
+    chunks = queue.Queue(QUEUE_SIZE)
+    thread = threading.Thread(target=_read, args=(path, chunks), daemon=True)
+    thread.start()
+    while (lines := chunks.get()) is not None:
+        if isinstance(lines, BaseException):
+            thread.join()
+            raise lines
+        yield from lines
+    thread.join()
+
+
+def unique(lines):
+    # Skip consecutive duplicates of sorted lines
+    previous = None
+    for line in lines:
+        if line != previous:
+            yield line
+            previous = line
+
+
+def merged_lines(paths: list[pathlib.Path]) -> Iterator[bytes]:
+    # k-way merge of sorted files without duplicates (like sort --merge --unique)
+    return unique(heapq.merge(*map(read_lines, paths)))
+
+
+class _Output:
+    # block compressed file (see blocks.py) written by a background thread
+    def __init__(self, path: pathlib.Path, compresslevel: int = 6) -> None:
+        self.path = path
+        self.writer = BlockWriter(path, compresslevel=compresslevel)
+        self.buffer = []
+        self.size = 0
+        self.lines_counter = 0
+        self.aborted = False
+        # error of the writer thread, raised by write and close
+        self.error = None
+        self.chunks = queue.Queue(QUEUE_SIZE)
+        self.thread = threading.Thread(target=self._write, daemon=True)
+        self.thread.start()
+
+    def _write(self) -> None:
+        try:
+            while (lines := self.chunks.get()) is not None:
+                self.writer.write(lines)
+            if self.aborted:
+                self.writer.abort()
+            else:
+                self.writer.close()
+        except BaseException as exc:
+            self.error = exc
+            self.writer.abort()
+            # keep taking chunks, so put never blocks on a full queue
+            while self.chunks.get() is not None:
+                pass
+
+    def _raise_error(self) -> None:
+        if self.error is not None:
+            raise self.error
+
+    def write(self, line: bytes) -> None:
+        self.buffer.append(line)
+        self.size += len(line)
+        self.lines_counter += 1
+        if self.size >= CHUNK_SIZE:
+            self._raise_error()
+            self.chunks.put(self.buffer)
+            self.buffer, self.size = [], 0
+
+    def close(self) -> None:
+        self.chunks.put(self.buffer)
+        self.chunks.put(None)
+        self.thread.join()
+        self._raise_error()
+
+    def abort(self) -> None:
+        # stop writing: the output file is not created (or left as it was)
+        self.aborted = True
+        self.chunks.put(None)
+        self.thread.join()
+
+
+def merge(paths: list[pathlib.Path], output: pathlib.Path) -> int:
+    out = _Output(output)
+    try:
+        for line in merged_lines(paths):
+            out.write(line)
+    except BaseException:
+        out.abort()
+        raise
+    out.close()
+    return out.lines_counter
+
+
+def merge_by_day(
+    paths: list[pathlib.Path],
+    output_dir: pathlib.Path,
+    start: Union[str, None] = None,
+    end: Union[str, None] = None,
+) -> dict[str, int]:
+    # Write battles of every day from start to end (YYYYMMDD, both included) in
+    # output_dir/YYYYMMDD.csv.gz. Lines start with battle time and are merged in
+    # order, so days are written one after the other in a single pass.
+    output_dir.mkdir(parents=True, exist_ok=True)
+    days = {}
+    out = None
+    try:
+        for line in merged_lines(paths):
+            day = line[:8].decode()
+            if (start is not None and day < start) or (end is not None and day > end):
+                continue
+            if out is None or day != out.path.name[:8]:
+                if out is not None:
+                    out.close()
+                    days[out.path.name[:8]] = out.lines_counter
+                out = _Output(output_dir / f"{day}.csv.gz")
+            out.write(line)
+    except BaseException:
+        # the day being written is not created (days before it are complete)
+        if out is not None:
+            out.abort()
+        raise
+    if out is not None:
+        out.close()
+        days[out.path.name[:8]] = out.lines_counter
+    return days
+
+
+def season_inputs(paths: list[pathlib.Path], start: str, end: str) -> list:
+    # Battles of a day are collected on that day or on the next one (battlelogs
+    # of the last hours), so a season needs the files from start to end + 1 day.
+    last = (datetime.strptime(end, "%Y%m%d") + timedelta(days=1)).strftime("%Y%m%d")
+    return [path for path in paths if start <= path.name[:8] <= last]
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge sorted .csv.gz files without duplicated battles.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("inputs", type=pathlib.Path, nargs="+", help="Sorted .csv.gz")
+    output = parser.add_mutually_exclusive_group(required=True)
+    output.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        help="Merge every input in this .csv.gz file.",
+    )
+    output.add_argument(
+        "-d",
+        "--output-dir",
+        type=pathlib.Path,
+        help="Write battles of every day in DIR/YYYYMMDD.csv.gz.",
+    )
+    parser.add_argument(
+        "--season",
+        type=str,
+        nargs=2,
+        metavar=("START", "END"),
+        default=None,
+        help="Keep battles from START to END (YYYYMMDD) reading only the inputs "
+        "named from START to the day after END (requires --output-dir).",
+    )
+    args = parser.parse_args()
+
+    if args.output is not None:
+        assert args.season is None, "--season requires --output-dir"
+        n = merge(args.inputs, args.output)
+        print(f"created '{args.output}' ({n} battles)")
+        return
+
+    inputs, start, end = args.inputs, None, None
+    if args.season is not None:
+        start, end = args.season
+        inputs = season_inputs(inputs, start, end)
+    for i, (day, n) in enumerate(
+        merge_by_day(inputs, args.output_dir, start, end).items()
+    ):
+        print(f"created '{args.output_dir / day}.csv.gz' ({n} battles) [{i + 1}]")
+
+
+if __name__ == "__main__":
+    main()
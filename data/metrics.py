@@ -0,0 +1,230 @@
+import collections
+import functools
+import os
+import pathlib
+import sys
+import threading
+import time
+from bisect import bisect_left
+from typing import Union
+
+import orjson
+
+"""
+# Example: how to use Metrics
+
+metrics = Metrics()
+metrics.inc("requests_total", status="200")
+metrics.observe("request_seconds", 0.12, status="200")
+metrics.set("players_queue", 1234)
+metrics.write(pathlib.Path("metrics.prom"))  # or metrics.json
+
+profiler = SamplingProfiler([parse_battle])
+profiler.start()
+...  # stacks that run parse_battle are sampled every 5 ms
+profiler.stop()
+profiler.write(pathlib.Path("profile.txt"))  # flamegraph.pl / speedscope input
+"""
+
+# Upper bounds of histogram buckets [s]: from 1 ms to 1 min
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 60)
+BATTLES = (0, 1, 5, 10, 15, 20, 25)
+
+
+class Histogram:
+    def __init__(self, buckets: tuple) -> None:
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float:
+        # upper bound of the bucket that contains the q-quantile
+        rank = q * self.count
+        seen = 0
+        for bound, count in zip(self.buckets, self.counts):
+            seen += count
+            if seen >= rank:
+                return bound
+        return float("inf")
+
+
+class Metrics:
+    # Counters, gauges and histograms identified by name and labels, exported as
+    # Prometheus text format (.prom) or json (any other suffix).
+
+    def __init__(self) -> None:
+        self.counters = collections.defaultdict(float)
+        self.gauges = {}
+        self.histograms = {}
+        self.started = time.time()
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        self.counters[name, tuple(sorted(labels.items()))] += value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        self.gauges[name, tuple(sorted(labels.items()))] = value
+
+    def observe(
+        self, name: str, value: float, buckets: tuple = SECONDS, **labels
+    ) -> None:
+        key = name, tuple(sorted(labels.items()))
+        if key not in self.histograms:
+            self.histograms[key] = Histogram(buckets)
+        self.histograms[key].observe(value)
+
+    def to_json(self) -> bytes:
+        def name(key):
+            name, labels = key
+            return name + "".join(f",{k}={v}" for k, v in labels)
+
+        metrics = {
+            "uptime": time.time() - self.started,
+            "counters": {name(k): v for k, v in self.counters.items()},
+            "gauges": {name(k): v for k, v in self.gauges.items()},
+            "histograms": {
+                name(k): {
+                    "count": h.count,
+                    "sum": h.sum,
+                    "p50": h.quantile(0.5),
+                    "p99": h.quantile(0.99),
+                    "buckets": dict(zip(map(str, (*h.buckets, "+Inf")), h.counts)),
+                }
+                for k, h in self.histograms.items()
+            },
+        }
+        return orjson.dumps(metrics, option=orjson.OPT_INDENT_2)
+
+    def to_prometheus(self, prefix: str = "crawler_") -> str:
+        def labels(labels, **extra):
+            labels = (*labels, *extra.items())
+            if not labels:
+                return ""
+            return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+        lines = [f"{prefix}uptime_seconds {time.time() - self.started:.3f}"]
+        for (name, l), value in sorted(self.counters.items()):
+            lines.append(f"{prefix}{name}{labels(l)} {value:g}")
+        for (name, l), value in sorted(self.gauges.items()):
+            lines.append(f"{prefix}{name}{labels(l)} {value:g}")
+        for (name, l), h in sorted(self.histograms.items()):
+            cumulative = 0
+            for bound, count in zip((*h.buckets, "+Inf"), h.counts):
+                cumulative += count
+                lines.append(f"{prefix}{name}_bucket{labels(l, le=bound)} {cumulative}")
+            lines.append(f"{prefix}{name}_sum{labels(l)} {h.sum:g}")
+            lines.append(f"{prefix}{name}_count{labels(l)} {h.count}")
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: pathlib.Path) -> None:
+        # Replace the file atomically: readers never see a partial file
+        if path.suffix == ".prom":
+            content = self.to_prometheus().encode()
+        else:
+            content = self.to_json()
+        tmp_path = path.with_name(f".{path.name}.tmp")
+        tmp_path.write_bytes(content)
+        tmp_path.replace(path)
+
+
+class SamplingProfiler:
+    # Every `interval` seconds a background thread looks at the stack of every
+    # thread and counts the stacks that go through one of `functions` (e.g.
+    # parse_battle in the parse workers). Suspended coroutines are not on any
+    # stack, so only cpu time is sampled, never time spent waiting for the api.
+
+    def __init__(self, functions: list, interval: float = 0.005) -> None:
+        self.codes = {f.__code__ for f in map(_unwrap, functions)}
+        self.interval = interval
+        self.stacks = collections.Counter()
+        self.samples_counter = 0
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        self._thread: Union[threading.Thread, None] = None
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            self.samples_counter += 1
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == me:
+                    continue
+                stack = []
+                hooked = False
+                while frame is not None:
+                    code = frame.f_code
+                    hooked = hooked or code in self.codes
+                    stack.append(
+                        f"{code.co_name} ({os.path.basename(code.co_filename)})"
+                    )
+                    frame = frame.f_back
+                if hooked:
+                    with self._lock:
+                        self.stacks[";".join(reversed(stack))] += 1
+
+    def write(self, path: pathlib.Path) -> None:
+        # collapsed stacks: "outer;...;inner count" per line
+        with self._lock:
+            stacks = self.stacks.most_common()
+        lines = [f"{stack} {count}" for stack, count in stacks]
+        path.write_text("\n".join(lines) + "\n")
+
+
+def _unwrap(function):
+    # profile the function of a method or of a decorated function
+    function = getattr(function, "__func__", function)
+    while hasattr(function, "__wrapped__"):
+        function = function.__wrapped__
+    return function
+
+
+# Timers
+METRICS = Metrics()
+
+
+def timer(function):
+    # record the time spent in function in METRICS (function_seconds histogram)
+    @functools.wraps(function)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            METRICS.observe(
+                "function_seconds",
+                time.perf_counter() - start,
+                function=function.__name__,
+            )
+
+    return wrapper
+
+
+def atimer(function):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            METRICS.observe(
+                "function_seconds",
+                time.perf_counter() - start,
+                function=function.__name__,
+            )
+
+    return wrapper
@@ -0,0 +1,291 @@
+import argparse
+import asyncio
+import pathlib
+import random
+import time
+
+import orjson
+from aiohttp import web
+from frontier import ALPHABET
+
+"""
+# Example: how to use the mock api
+
+python mockapi.py --port 8080 --latency 0.05 --throttle-rate 0.01 &
+python collect.py --base-url http://127.0.0.1:8080 --api-token mock \\
+  --root-players $(python mockapi.py --root-players 4)
+"""
+
+here = pathlib.Path(__file__).parent
+
+GAME_MODES = [
+    (72000323, "Ranked1v1", 0.75),
+    (72000006, "Ladder", 0.15),
+    (72000010, "Challenge", 0.05),
+    (72000061, "TeamVsTeam", 0.05),  # 2v2: not collected by Crawler
+]
+
+
+def player_tag(i: int) -> str:
+    # Player i has the 9-character tag made of the digits of i in base 14
+    chars = []
+    for _ in range(9):
+        i, d = divmod(i, len(ALPHABET))
+        chars.append(ALPHABET[d])
+    return "".join(reversed(chars))
+
+
+def player_index(tag: str) -> int:
+    i = 0
+    for c in tag:
+        i = i * len(ALPHABET) + ALPHABET.index(c)
+    return i
+
+
+def to_battle_time(epoch: float) -> str:
+    return time.strftime("%Y%m%dT%H%M%S.000Z", time.gmtime(epoch))
+
+
+class MockApi:
+    # Stand-in for the Clash Royale API backed by a synthetic player graph.
+    # Players are sorted by trophies and meet opponents with close indexes. Every
+    # player plays battles at a steady pace (around `battles_per_hour`), so the
+    # overlap of two battlelogs of the same player depends on the time between
+    # requests (like the real api). Battles are generated from a seed: the same
+    # battle is returned every time it is in a battlelog.
+
+    def __init__(
+        self,
+        players: int = 100_000,
+        neighbours: int = 200,
+        battles_per_hour: float = 6.0,
+        latency: float = 0.05,
+        jitter: float = 0.02,
+        throttle_rate: float = 0.0,
+        rate_limit: float = 0.0,
+        maintenance_rate: float = 0.0,
+        maintenance_duration: float = 30.0,
+        seed: int = 0,
+    ) -> None:
+        self.players = players
+        self.neighbours = neighbours
+        self.battles_per_hour = battles_per_hour
+        self.latency = latency
+        self.jitter = jitter
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self.maintenance_rate = maintenance_rate
+        self.maintenance_duration = maintenance_duration
+        self.seed = seed
+        self.random = random.Random(seed)
+
+        self.cards = orjson.loads(
+            (here.parent / "analysis/assets/cards.json").read_bytes()
+        )
+        self.cards_ids = [card["id"] for card in self.cards]
+        self.started = time.time()
+
+        # Token bucket of the rate limit (0 means no limit)
+        self.tokens = rate_limit
+        self.last_refill = time.monotonic()
+        self.maintenance_until = 0.0
+
+        # Stats
+        self.status_counter = {}
+
+    def _trophies(self, i: int) -> int:
+        # best players first
+        return 9000 - 6000 * i // self.players
+
+    def _interval(self, i: int) -> float:
+        # seconds between two battles of player i (some players play more)
+        r = random.Random(self.seed * 1_000_003 + i)
+        return 3600 / self.battles_per_hour * r.lognormvariate(0, 0.5)
+
+    def _battle(self, i: int, k: int, interval: float) -> dict:
+        # k-th battle of player i
+        r = random.Random((self.seed * 1_000_003 + i) * 1_000_003 + k)
+        j = (i + r.randint(-self.neighbours, self.neighbours)) % self.players
+        game_mode, name = r.choices(
+            [(mode, name) for mode, name, _ in GAME_MODES],
+            weights=[weight for _, _, weight in GAME_MODES],
+        )[0]
+        teams = [[self._player(i, r)], [self._player(j, r)]]
+        if game_mode == 72000061:
+            teams[0].append(self._player(r.randrange(self.players), r))
+            teams[1].append(self._player(r.randrange(self.players), r))
+        return {
+            "type": "PvP",
+            "battleTime": to_battle_time(self.started - 86400 + k * interval),
+            "arena": {"id": 54000050, "name": "Legendary Arena"},
+            "gameMode": {"id": game_mode, "name": name},
+            "deckSelection": "collection",
+            "team": teams[0],
+            "opponent": teams[1],
+        }
+
+    def _player(self, i: int, r: random.Random) -> dict:
+        return {
+            "tag": "#" + player_tag(i),
+            "name": f"Player {i}",
+            "startingTrophies": self._trophies(i),
+            "trophyChange": r.choice([-30, 30]),
+            "crowns": r.randint(0, 3),
+            "kingTowerHitPoints": 6000,
+            "princessTowersHitPoints": [3000, 2000],
+            "clan": {"tag": "#2PP", "name": "Clan", "badgeId": 16000000},
+            "cards": [
+                {"name": "", "id": card_id, "level": 14, "maxLevel": 14}
+                for card_id in r.sample(self.cards_ids, 8)
+            ],
+            "elixirLeaked": 1.23,
+        }
+
+    def battlelog(self, i: int) -> list[dict]:
+        # last 25 battles played by player i up to now
+        interval = self._interval(i)
+        k = int((time.time() - self.started + 86400) / interval)
+        return [self._battle(i, k - n, interval) for n in range(25) if k - n >= 0]
+
+    def _error(self, status: int, reason: str, message: str) -> web.Response:
+        self.status_counter[status] = self.status_counter.get(status, 0) + 1
+        return web.json_response({"reason": reason, "message": message}, status=status)
+
+    def _throttled(self) -> bool:
+        if self.throttle_rate and self.random.random() < self.throttle_rate:
+            return True
+        if not self.rate_limit:
+            return False
+        now = time.monotonic()
+        elapsed, self.last_refill = now - self.last_refill, now
+        self.tokens = min(self.rate_limit, self.tokens + elapsed * self.rate_limit)
+        if self.tokens < 1:
+            return True
+        self.tokens -= 1
+        return False
+
+    async def handle_cards(self, request: web.Request) -> web.Response:
+        items = [
+            {"name": card["name"], "id": card["id"], "maxLevel": 14, "iconUrls": {}}
+            for card in self.cards
+        ]
+        return web.json_response({"items": items})
+
+    async def handle_battlelog(self, request: web.Request) -> web.Response:
+        now = time.monotonic()
+        if now < self.maintenance_until:
+            return self._error(503, "inMaintenance", "Mock api in maintenance")
+        if self.maintenance_rate and self.random.random() < self.maintenance_rate:
+            self.maintenance_until = now + self.maintenance_duration
+            return self._error(503, "inMaintenance", "Mock api in maintenance")
+        if self._throttled():
+            return self._error(429, "requestThrottled", "Mock api rate limit")
+
+        await asyncio.sleep(max(0.0, self.random.gauss(self.latency, self.jitter)))
+
+        tag = request.match_info["tag"].lstrip("#")
+        if len(tag) != 9 or not set(tag) <= set(ALPHABET):
+            return self._error(404, "notFound", "Player not found")
+        i = player_index(tag)
+        if i >= self.players:
+            return self._error(404, "notFound", "Player not found")
+        self.status_counter[200] = self.status_counter.get(200, 0) + 1
+        return web.Response(
+            body=orjson.dumps(self.battlelog(i)), content_type="application/json"
+        )
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_get("/v1/cards", self.handle_cards)
+        app.router.add_get("/v1/players/{tag}/battlelog", self.handle_battlelog)
+        return app
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Local stand-in for the Clash Royale API (cards and battlelogs).",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument("--host", type=str, default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument(
+        "--players", type=int, default=100_000, help="Players in the graph."
+    )
+    parser.add_argument(
+        "--neighbours",
+        type=int,
+        default=200,
+        help="Opponents are at most this far in the trophies ranking.",
+    )
+    parser.add_argument(
+        "--battles-per-hour",
+        type=float,
+        default=6.0,
+        help="Average pace of players (the higher, the lower the overlap of two "
+        "battlelogs of the same player).",
+    )
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean latency [s].")
+    parser.add_argument(
+        "--jitter", type=float, default=0.02, help="Latency standard deviation [s]."
+    )
+    parser.add_argument(
+        "--throttle-rate",
+        type=float,
+        default=0.0,
+        help="Fraction of requests answered with 429 at random.",
+    )
+    parser.add_argument(
+        "--rate-limit",
+        type=float,
+        default=0.0,
+        help="Answer 429 above this many req/s (0: no limit).",
+    )
+    parser.add_argument(
+        "--maintenance-rate",
+        type=float,
+        default=0.0,
+        help="Probability that a request starts a maintenance window (503).",
+    )
+    parser.add_argument(
+        "--maintenance-duration",
+        type=float,
+        default=30.0,
+        help="Length of maintenance windows [s].",
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--root-players",
+        type=int,
+        metavar="N",
+        default=0,
+        help="Print N tags of top players (for --root-players) and exit.",
+    )
+    args = parser.parse_args()
+
+    if args.root_players:
+        print(" ".join(player_tag(i) for i in range(args.root_players)))
+        return
+
+    api = MockApi(
+        players=args.players,
+        neighbours=args.neighbours,
+        battles_per_hour=args.battles_per_hour,
+        latency=args.latency,
+        jitter=args.jitter,
+        throttle_rate=args.throttle_rate,
+        rate_limit=args.rate_limit,
+        maintenance_rate=args.maintenance_rate,
+        maintenance_duration=args.maintenance_duration,
+        seed=args.seed,
+    )
+    try:
+        web.run_app(api.app(), host=args.host, port=args.port, print=None)
+    finally:
+        print(f"Responses by status: {api.status_counter}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,201 @@
+import argparse
+import json
+import pathlib
+import time
+from typing import Iterator, Union
+
+import numpy as np
+import pandas as pd
+from frontier import ALPHABET, BASE, decode_tag
+
+"""
+# Example: how to use battle records
+
+python records.py ../db/days/20231106.csv.gz -o ../db/days/20231106.rec
+
+battles = load_records(pathlib.Path("../db/days/20231106.rec"))  # np.memmap
+battles["trophies1"].mean()
+battles[battles["game_mode"] == 72000323]["cards1"]  # card indices (cards.json)
+decode_tag(battles[0]["tag1"])  # "G9YV9GR8R"
+"""
+
+here = pathlib.Path(__file__).parent
+assets = here.parent / "analysis" / "assets"
+
+# A battle is a fixed-width record of 46 bytes (a csv row is about 150 bytes):
+# time is seconds since epoch, tags are encoded like in frontier.py and cards are
+# indices of cards.json (UNKNOWN_CARD if not in cards.json).
+DTYPE = np.dtype(
+    [
+        ("time", "<i4"),
+        ("game_mode", "<u4"),
+        ("tag1", "<u8"),
+        ("trophies1", "<i2"),
+        ("crowns1", "i1"),
+        ("cards1", "u1", (8,)),
+        ("tag2", "<u8"),
+        ("trophies2", "<i2"),
+        ("crowns2", "i1"),
+        ("cards2", "u1", (8,)),
+    ]
+)
+UNKNOWN_CARD = 255
+
+# Files start with a header of HEADER_SIZE bytes: magic string and record size,
+# so files written with another layout are not silently misread.
+MAGIC = b"CRBATTLE"
+HEADER_SIZE = 16
+
+# csv columns (see collect.py) and their types
+CSV_DTYPES = {
+    0: str,
+    1: np.uint32,
+    2: str,
+    3: np.int16,
+    4: np.int8,
+    **{i: np.uint32 for i in range(5, 13)},
+    13: str,
+    14: np.int16,
+    15: np.int8,
+    **{i: np.uint32 for i in range(16, 24)},
+}
+
+with open(assets / "cards.json") as f:
+    CARDS_IDS = np.array([card["id"] for card in json.load(f)], dtype=np.uint32)
+CARDS_ORDER = CARDS_IDS.argsort()
+
+# value of every tag character (0 for any other byte, e.g. padding)
+TAG_DIGITS = np.zeros(256, dtype=np.uint64)
+for i, c in enumerate(ALPHABET):
+    TAG_DIGITS[ord(c)] = i + 1
+
+
+def encode_tags(tags: np.ndarray) -> np.ndarray:
+    # Vectorised frontier.encode_tag: tags are parsed as fixed-width bytes
+    tags = tags.astype("S16")
+    digits = TAG_DIGITS[tags.view(np.uint8).reshape(len(tags), 16)]
+    encoded = np.zeros(len(tags), dtype=np.uint64)
+    for column in digits.T:
+        valid = column > 0
+        encoded[valid] = encoded[valid] * np.uint64(BASE) + column[valid]
+    return encoded
+
+
+def encode_cards(ids: np.ndarray) -> np.ndarray:
+    # Card ids to indices of cards.json with a binary search (no python loop)
+    i = np.searchsorted(CARDS_IDS, ids, sorter=CARDS_ORDER)
+    i = np.minimum(i, len(CARDS_IDS) - 1)
+    found = CARDS_IDS[CARDS_ORDER[i]] == ids
+    return np.where(found, CARDS_ORDER[i], UNKNOWN_CARD).astype(np.uint8)
+
+
+def to_records(df: pd.DataFrame) -> np.ndarray:
+    records = np.empty(len(df), dtype=DTYPE)
+    times = pd.to_datetime(df[0], format="%Y%m%dT%H%M%S.%fZ").values
+    records["time"] = times.astype("datetime64[s]").astype(np.int64)
+    records["game_mode"] = df[1].values
+    for player, first in ((1, 2), (2, 13)):
+        records[f"tag{player}"] = encode_tags(df[first].values)
+        records[f"trophies{player}"] = df[first + 1].values
+        records[f"crowns{player}"] = df[first + 2].values
+        cards = df.iloc[:, first + 3 : first + 11].values
+        records[f"cards{player}"] = encode_cards(cards)
+    return records
+
+
+def read_csv(path: pathlib.Path, chunksize: int = 1_000_000) -> Iterator[np.ndarray]:
+    # Stream a (compressed) csv file as chunks of records
+    for df in pd.read_csv(path, header=None, dtype=CSV_DTYPES, chunksize=chunksize):
+        yield to_records(df)
+
+
+def convert(paths: list[pathlib.Path], output: pathlib.Path) -> int:
+    # Append records of every csv file (e.g. days of a season) to output
+    n = 0
+    tmp_path = output.with_name(f".{output.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(MAGIC + DTYPE.itemsize.to_bytes(HEADER_SIZE - len(MAGIC), "little"))
+        for path in paths:
+            for records in read_csv(path):
+                f.write(records.tobytes())
+                n += len(records)
+    tmp_path.replace(output)
+    return n
+
+
+def load_records(path: pathlib.Path, mode: str = "r") -> np.ndarray:
+    # Memory map a records file: nothing is read nor parsed until accessed
+    with open(path, "rb") as f:
+        header = f.read(HEADER_SIZE)
+    assert header[: len(MAGIC)] == MAGIC, f"{path} is not a records file"
+    itemsize = int.from_bytes(header[len(MAGIC) :], "little")
+    assert itemsize == DTYPE.itemsize, f"{path} has records of {itemsize} bytes"
+    if path.stat().st_size == HEADER_SIZE:
+        return np.empty(0, dtype=DTYPE)
+    return np.memmap(path, dtype=DTYPE, mode=mode, offset=HEADER_SIZE)
+
+
+def load_many(paths: list[pathlib.Path]) -> np.ndarray:
+    # Records of several files (e.g. days of a season) in a single array: data
+    # are copied but never parsed.
+    return np.concatenate([load_records(path) for path in paths])
+
+
+def to_dataframe(
+    records: np.ndarray, tags: bool = False, cards: Union[list, None] = None
+) -> pd.DataFrame:
+    # Readable view of records: datetimes, decoded tags (slow: optional) and
+    # card columns named after `cards` (e.g. card names)
+    df = pd.DataFrame({"datetime": records["time"].astype("datetime64[s]")})
+    df["game_mode"] = records["game_mode"]
+    for player in (1, 2):
+        tag = records[f"tag{player}"]
+        df[f"tag{player}"] = [decode_tag(int(t)) for t in tag] if tags else tag
+        df[f"trophies{player}"] = records[f"trophies{player}"]
+        df[f"crowns{player}"] = records[f"crowns{player}"]
+        for i in range(8):
+            card = records[f"cards{player}"][:, i]
+            df[f"card{player}{i + 1}"] = card if cards is None else np.take(cards, card)
+    return df
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Convert .csv.gz battles into fixed-width binary records.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "inputs", type=pathlib.Path, nargs="+", help="csv files (e.g. a season)"
+    )
+    parser.add_argument(
+        "-o",
+        "--output",
+        type=pathlib.Path,
+        required=True,
+        help="Records file (.rec) with the battles of every input.",
+    )
+    parser.add_argument(
+        "-f", "--force", action="store_true", help="Overwrite output file."
+    )
+    args = parser.parse_args()
+
+    assert (
+        not args.output.exists() or args.force
+    ), f"{args.output} already exists. Use -f for overwrite it."
+
+    start = time.perf_counter()
+    n = convert(args.inputs, args.output)
+    elapsed = time.perf_counter() - start
+    size_in = sum(path.stat().st_size for path in args.inputs)
+    size_out = args.output.stat().st_size
+    print(
+        f"created '{args.output}' ({n} battles in {elapsed:.1f} s, "
+        f"{size_out / 2**20:.1f} MiB from {size_in / 2**20:.1f} MiB)"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,98 @@
+import pathlib
+import sqlite3
+import zlib
+
+"""
+# Example: how to use ShardRouter
+
+router = ShardRouter("coordinator.sqlite", shard=0, shards=4)
+
+if not router.owns(tag):
+    # tag will be requested by the crawler working on shard router.owner(tag)
+    router.send([(tag, priority)])
+
+for tag, priority in router.receive():
+    ...  # players discovered by other shards that belong to this shard
+"""
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS inbox (
+  shard INT,
+  tag TEXT,
+  ranked_trophies INT,
+  ladder_trophies INT,
+  last_ranked_battle INT,
+  last_ladder_battle INT,
+  PRIMARY KEY (shard, tag)
+)
+"""
+
+# Keep the most recent information for both ranked and ladder, like
+# Crawler._update_players_queue does.
+UPSERT = """
+INSERT INTO inbox VALUES (?, ?, ?, ?, ?, ?)
+ON CONFLICT (shard, tag) DO UPDATE SET
+  ranked_trophies = CASE WHEN excluded.last_ranked_battle > last_ranked_battle
+    THEN excluded.ranked_trophies ELSE ranked_trophies END,
+  last_ranked_battle = MAX(excluded.last_ranked_battle, last_ranked_battle),
+  ladder_trophies = CASE WHEN excluded.last_ladder_battle > last_ladder_battle
+    THEN excluded.ladder_trophies ELSE ladder_trophies END,
+  last_ladder_battle = MAX(excluded.last_ladder_battle, last_ladder_battle)
+"""
+
+
+def shard_of(tag: str, shards: int) -> int:
+    # crc32 is stable across processes and machines (unlike hash)
+    return zlib.crc32(tag.encode()) % shards
+
+
+class ShardRouter:
+    def __init__(self, db_path: pathlib.Path, shard: int, shards: int) -> None:
+        assert 0 <= shard < shards, f"Shard {shard} is not in [0, {shards})"
+        self.shard = shard
+        self.shards = shards
+        self.db_path = db_path
+        # The connection is used by one thread at a time (see Crawler), but not
+        # always by the one that created it.
+        self.db = sqlite3.connect(db_path, timeout=60, check_same_thread=False)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute(SCHEMA)
+        self.db.commit()
+        self.sent_counter = 0
+        self.received_counter = 0
+
+    def owner(self, tag: str) -> int:
+        return shard_of(tag, self.shards)
+
+    def owns(self, tag: str) -> bool:
+        return self.owner(tag) == self.shard
+
+    def send(self, players: list[tuple]) -> None:
+        with self.db:
+            self.db.executemany(
+                UPSERT,
+                ((self.owner(tag), tag, *priority) for tag, priority in players),
+            )
+        self.sent_counter += len(players)
+
+    def receive(self) -> list[tuple]:
+        # Lock the database between select and delete: other shards can not
+        # send players in the meanwhile.
+        with self.db:
+            self.db.execute("BEGIN IMMEDIATE")
+            rows = self.db.execute(
+                "SELECT tag, ranked_trophies, ladder_trophies, last_ranked_battle, "
+                "last_ladder_battle FROM inbox WHERE shard = ?",
+                (self.shard,),
+            ).fetchall()
+            self.db.execute("DELETE FROM inbox WHERE shard = ?", (self.shard,))
+        self.received_counter += len(rows)
+        return [(tag, tuple(priority)) for tag, *priority in rows]
+
+    def exchange(self, players: list[tuple]) -> list[tuple]:
+        if players:
+            self.send(players)
+        return self.receive()
+
+    def close(self) -> None:
+        self.db.close()
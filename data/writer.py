@@ -0,0 +1,128 @@
+import asyncio
+import csv
+import gzip
+import heapq
+import io
+import pathlib
+from contextlib import ExitStack
+from itertools import islice
+
+from blocks import BlockWriter
+from merge import unique
+
+"""
+# Example: how to use SortedWriter
+
+async with SortedWriter(pathlib.Path("battles.csv.gz")) as writer:
+    async for battles in battlelogs:
+        await writer.write(battles)
+# battles.csv.gz is sorted and without duplicated rows (like sort --unique)
+"""
+
+
+class SortedWriter:
+    # Rows are sent through a bounded queue to a background thread that keeps
+    # them in an in-memory run. Full runs are sorted and spilled to disk as
+    # compressed chunks, which are merged in the final .csv.gz on close.
+
+    def __init__(
+        self,
+        path: pathlib.Path,
+        run_size: int = 500_000,
+        queue_size: int = 256,
+        compresslevel: int = 6,
+    ) -> None:
+        assert path.name.endswith(".csv.gz"), "Output file must be a .csv.gz file"
+        self.path = path
+        self.run_size = run_size
+        self.queue_size = queue_size
+        self.compresslevel = compresslevel
+        self.run = []
+        self.chunks = []
+        self.rows_counter = 0
+
+    def open(self) -> None:
+        # must be called with a running event loop
+        self.queue = asyncio.Queue(self.queue_size)
+        self.consumer = asyncio.create_task(self._consume())
+
+    async def close(self) -> None:
+        # write rows still in queue, then merge chunks into the output file
+        await self._put(None)
+        await self.consumer
+        await asyncio.to_thread(self._close)
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc) -> None:
+        await self.close()
+
+    async def write(self, rows: list[tuple]) -> None:
+        # Waits only if the background thread is far behind (queue is full)
+        if rows:
+            await self._put(rows)
+
+    async def _put(self, item) -> None:
+        # Put item in the queue unless the consumer stopped: its error (e.g. disk
+        # full while spilling) is raised instead of waiting for a full queue
+        if not self.consumer.done() and not self.queue.full():
+            self.queue.put_nowait(item)
+            return
+        put = asyncio.ensure_future(self.queue.put(item))
+        await asyncio.wait([put, self.consumer], return_when=asyncio.FIRST_COMPLETED)
+        if not put.done():
+            put.cancel()
+        if self.consumer.done():
+            self.consumer.result()
+
+    async def _consume(self) -> None:
+        while (rows := await self.queue.get()) is not None:
+            # Take every batch already queued, so the thread is called less often
+            batches = [rows]
+            while not self.queue.empty():
+                rows = self.queue.get_nowait()
+                if rows is None:
+                    await asyncio.to_thread(self._add, batches)
+                    return
+                batches.append(rows)
+            await asyncio.to_thread(self._add, batches)
+
+    def _add(self, batches: list[list[tuple]]) -> None:
+        # Format rows as csv.writer does (same line terminator of collect.py)
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for rows in batches:
+            writer.writerows(rows)
+        lines = buffer.getvalue().splitlines(keepends=True)
+        self.run.extend(lines)
+        self.rows_counter += len(lines)
+        if len(self.run) >= self.run_size:
+            self._spill()
+
+    def _spill(self) -> None:
+        chunk = self.path.with_name(f".{self.path.name}.{len(self.chunks)}")
+        # chunks are temporary: favour speed over compression
+        with gzip.open(chunk, "wt", compresslevel=1, newline="") as f:
+            f.writelines(unique(sorted(self.run)))
+        self.chunks.append(chunk)
+        self.run = []
+
+    def _close(self) -> None:
+        # output is block compressed with a time index (see blocks.py)
+        with ExitStack() as stack:
+            runs = [
+                stack.enter_context(gzip.open(chunk, "rt", newline=""))
+                for chunk in self.chunks
+            ]
+            runs.append(sorted(self.run))
+            out = stack.enter_context(
+                BlockWriter(self.path, compresslevel=self.compresslevel)
+            )
+            lines = unique(heapq.merge(*runs))
+            while batch := [line.encode() for line in islice(lines, 10_000)]:
+                out.write(batch)
+        for chunk in self.chunks:
+            chunk.unlink()
+        self.run, self.chunks = [], []
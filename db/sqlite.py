@@ -0,0 +1,221 @@
+import argparse
+import csv
+import gzip
+import pathlib
+import sqlite3
+import time
+
+"""
+# Example: how to query db.sqlite
+
+python sqlite.py  # load new files of seasons (START-END/*.csv.gz) in db.sqlite
+
+-- battles of a game mode in a time range (index on battles)
+SELECT COUNT(*) FROM battles
+WHERE game_mode = 72000006 AND datetime BETWEEN '20231106T18' AND '20231106T20';
+
+-- win rate of decks with a card above 7000 trophies (index on deck_cards, sides)
+SELECT AVG(s.crowns > o.crowns) FROM deck_cards AS d
+JOIN sides AS s ON s.deck = d.deck
+JOIN sides AS o ON o.battle = s.battle AND o.side != s.side
+WHERE d.card = 26000000 AND s.trophies > 7000;
+"""
+
+here = pathlib.Path(__file__).parent
+
+# A battle has two sides (0 is team, 1 is opponent). Decks are stored once (cards
+# are sorted ids) and every card of a deck is a row of deck_cards.
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS files (
+  name TEXT PRIMARY KEY,
+  size INT,
+  mtime REAL,
+  first_battle INT,
+  last_battle INT
+);
+CREATE TABLE IF NOT EXISTS battles (
+  id INTEGER PRIMARY KEY,
+  datetime TEXT,
+  game_mode INT
+);
+CREATE TABLE IF NOT EXISTS sides (
+  battle INT,
+  side INT,
+  tag TEXT,
+  trophies INT,
+  crowns INT,
+  deck INT,
+  PRIMARY KEY (battle, side)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS decks (
+  id INTEGER PRIMARY KEY,
+  cards TEXT UNIQUE
+);
+CREATE TABLE IF NOT EXISTS deck_cards (
+  card INT,
+  deck INT,
+  PRIMARY KEY (card, deck)
+) WITHOUT ROWID;
+"""
+
+# Created after the first load (bulk inserts without indexes are faster), then
+# updated by every insert.
+INDEXES = """
+CREATE INDEX IF NOT EXISTS battles_datetime ON battles (datetime);
+CREATE INDEX IF NOT EXISTS battles_game_mode ON battles (game_mode, datetime);
+CREATE INDEX IF NOT EXISTS sides_trophies ON sides (trophies);
+CREATE INDEX IF NOT EXISTS sides_deck ON sides (deck);
+CREATE INDEX IF NOT EXISTS sides_tag ON sides (tag);
+"""
+
+# rows inserted by a single executemany
+BATCH_SIZE = 50_000
+
+
+class Loader:
+    def __init__(self, db_path: pathlib.Path) -> None:
+        self.db = sqlite3.connect(db_path)
+        self.db.execute("PRAGMA journal_mode = WAL")
+        self.db.execute("PRAGMA synchronous = NORMAL")
+        self.db.execute("PRAGMA cache_size = -262144")  # 256 MiB
+        self.db.executescript(SCHEMA)
+        # decks (sorted cards) -> id, so decks are looked up without queries
+        self.decks = dict(self.db.execute("SELECT cards, id FROM decks"))
+        (last,) = self.db.execute("SELECT MAX(id) FROM battles").fetchone()
+        self.next_battle = (last or 0) + 1
+
+    def status(self, name: str, path: pathlib.Path) -> str:
+        # "new", "loaded" or "changed" (loaded, but size or mtime are different)
+        row = self.db.execute(
+            "SELECT size, mtime FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            return "new"
+        stat = path.stat()
+        return "loaded" if row == (stat.st_size, stat.st_mtime) else "changed"
+
+    def _unload(self, name: str) -> None:
+        # Battles of a file have consecutive ids: delete them by range (in the
+        # transaction of the caller)
+        first, last = self.db.execute(
+            "SELECT first_battle, last_battle FROM files WHERE name = ?", (name,)
+        ).fetchone()
+        self.db.execute("DELETE FROM sides WHERE battle BETWEEN ? AND ?", (first, last))
+        self.db.execute("DELETE FROM battles WHERE id BETWEEN ? AND ?", (first, last))
+        self.db.execute("DELETE FROM files WHERE name = ?", (name,))
+
+    def _deck(self, cards: list[str], new_decks: list, new_cards: list) -> int:
+        cards = sorted(map(int, cards))
+        key = ",".join(map(str, cards))
+        deck = self.decks.get(key)
+        if deck is None:
+            deck = self.decks[key] = len(self.decks) + 1
+            new_decks.append((deck, key))
+            new_cards.extend((card, deck) for card in set(cards))
+        return deck
+
+    def _insert(self, battles: list, sides: list, decks: list, cards: list) -> None:
+        self.db.executemany("INSERT INTO battles VALUES (?, ?, ?)", battles)
+        self.db.executemany("INSERT INTO sides VALUES (?, ?, ?, ?, ?, ?)", sides)
+        self.db.executemany("INSERT INTO decks VALUES (?, ?)", decks)
+        self.db.executemany("INSERT INTO deck_cards VALUES (?, ?)", cards)
+
+    def load(self, name: str, path: pathlib.Path, reload: bool = False) -> int:
+        # Load a .csv.gz in a single transaction: a file is loaded entirely or not
+        # at all (e.g. if interrupted). With reload, battles previously loaded
+        # from name are deleted in the same transaction (kept if loading fails).
+        first = self.next_battle
+        battles, sides, decks, cards = [], [], [], []
+        decks_backup = dict(self.decks)
+        try:
+            with self.db, gzip.open(path, "rt", newline="") as f:
+                if reload:
+                    self._unload(name)
+                for row in csv.reader(f):
+                    battle = self.next_battle
+                    self.next_battle += 1
+                    battles.append((battle, row[0], int(row[1])))
+                    for side, i in ((0, 2), (1, 13)):
+                        deck = self._deck(row[i + 3 : i + 11], decks, cards)
+                        sides.append(
+                            (
+                                battle,
+                                side,
+                                row[i],
+                                int(row[i + 1]),
+                                int(row[i + 2]),
+                                deck,
+                            )
+                        )
+                    if len(battles) >= BATCH_SIZE:
+                        self._insert(battles, sides, decks, cards)
+                        battles, sides, decks, cards = [], [], [], []
+                self._insert(battles, sides, decks, cards)
+                stat = path.stat()
+                self.db.execute(
+                    "INSERT INTO files VALUES (?, ?, ?, ?, ?)",
+                    (name, stat.st_size, stat.st_mtime, first, self.next_battle - 1),
+                )
+        except BaseException:
+            # rolled back: forget ids and decks of this file
+            self.next_battle = first
+            self.decks = decks_backup
+            raise
+        return self.next_battle - first
+
+    def create_indexes(self) -> None:
+        self.db.executescript(INDEXES)
+        self.db.execute("ANALYZE")
+
+    def close(self) -> None:
+        self.db.close()
+
+
+# MAIN --------------------------------------------------------------------------------
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Load new .csv.gz battles files in a SQLite database.",
+        formatter_class=argparse.ArgumentDefaultsHelpFormatter,
+    )
+    parser.add_argument(
+        "inputs",
+        type=pathlib.Path,
+        nargs="*",
+        help="csv files (default: every START-END/*.csv.gz of db)",
+    )
+    parser.add_argument(
+        "-o", "--output", type=pathlib.Path, default=here / "db.sqlite", help="Database"
+    )
+    parser.add_argument(
+        "--reload",
+        action="store_true",
+        help="Load again files that changed since they were loaded.",
+    )
+    args = parser.parse_args()
+
+    inputs = args.inputs or sorted(here.glob("*-*/*.csv.gz"))
+    loader = Loader(args.output)
+    start = time.perf_counter()
+    loaded = 0
+    for path in inputs:
+        # files are tracked by season directory and name (START-END/DAY.csv.gz),
+        # wherever the checkout (or the input) is
+        name = f"{path.resolve().parent.name}/{path.name}"
+        status = loader.status(name, path)
+        if status == "loaded" or (status == "changed" and not args.reload):
+            if status == "changed":
+                print(f"skipped '{name}': changed since loaded (use --reload)")
+            continue
+        n = loader.load(name, path, reload=status == "changed")
+        loaded += n
+        print(f"loaded '{name}' ({n} battles)")
+    loader.create_indexes()
+    loader.close()
+    elapsed = time.perf_counter() - start
+    print(f"loaded {loaded} battles in '{args.output}' in {elapsed:.1f} s")
+
+
+if __name__ == "__main__":
+    main()